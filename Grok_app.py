@@ -3,14 +3,31 @@
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime
 import yaml
 import os
 from typing import Dict, Any
 import time
 
+from services.query_engine import BatchQueryEngine, QueryError
+from utils.lazy import lazy_import
+from utils.llm import LLMProvider
+
+# 首頁（上傳檔案前）不需要的模組延遲到第一次使用才匯入，縮短冷啟動時間
+px = lazy_import("plotly.express")
+pipeline = lazy_import("agents.pipeline")
+job_queue = lazy_import("services.job_queue")
+monitoring = lazy_import("services.monitoring")
+alerts = lazy_import("services.alerts")
+scheduler = lazy_import("services.scheduler")
+
+MAP_REDUCE_ROWS = 5_000   # 上傳資料超過此列數時預設開啟 map-reduce 完整分析
+JOBS_PER_TENANT = 1       # 每組 API 金鑰同時執行的完整分析數
+MONITOR_SOURCE = "data/stream/events.ndjson"
+ALERTS_PATH = "data/stream/alerts.ndjson"   # 告警通知（去重、合併後）的本地輸出，可換成 WebhookSink
+MONITOR_TILES = 24        # 監控面板最多顯示的批次圖塊（紅、黃燈優先）
+MONITOR_REFRESH = 2       # 監控面板輪詢間隔（秒）
+
 # ==================== 內建 agents.yaml ====================
 AGENTS_CONFIG = yaml.safe_load('''
 agent_031:
@@ -22,8 +39,7 @@ agent_031:
 data_cleaning:
   agent_001: { name: "數據結構分析師", role: "檢查欄位、資料型態、唯一性" }
   agent_002: { name: "缺失值診斷專家", role: "識別並建議填補策略" }
-  agent_003: { name: "異常值偵測員", role: "基於3σ與箱形圖檢測""
-  }
+  agent_003: { name: "異常值偵測員", role: "基於3σ與箱形圖檢測" }
   agent_004: { name: "日期格式統一師", role: "解析並標準化所有日期欄位" }
   agent_005: { name: "溫度記錄驗證師", role: "檢查冷鏈溫度是否符合2-8°C" }
   agent_006: { name: "批次ID一致性檢查員", role: "確保批次ID在各階段一致" }
@@ -46,162 +62,193 @@ ai_enhanced:
   agent_031: { name: "最終報告生成總監", role: "彙整所有代理輸出，產出PDF級報告" }
 ''')
 
-# ==================== 系統 Prompt（來自規格第4章） ====================
-SYSTEM_PROMPT = """
-你是一個專業的台灣食品溯源與安全AI專家，專注於雞蛋冷鏈追溯。
-關鍵法規與標準：
-- 冷藏溫度必須保持在 2~8°C
-- 產蛋到包裝不得超過 24 小時
-- 洗選蛋保存期限最多 28 天
-- 冷鏈中斷超過 2 小時視為高風險
-
-請使用繁體中文回覆，輸出格式：
-# ✨ 最終報告
+# ==================== LLM 呼叫（OpenAI / Gemini / Grok，關鍵代理使用 hedged request） ====================
+@st.cache_resource
+def _llm_provider(openai_key: str, gemini_key: str, groq_key: str) -> LLMProvider:
+    # 快取供應商物件，首 token 延遲統計（hedging 門檻）在重新執行間保留
+    return LLMProvider(openai_key, gemini_key, groq_key, system_prompt=pipeline.SYSTEM_PROMPT)
 
-## ⚠️ 風險總評
+def _api_keys() -> tuple:
+    openai_key = st.session_state.get("openai_key", "")
+    gemini_key = st.session_state.get("gemini_key", "")
+    groq_key = st.session_state.get("groq_key", "")
+    if not openai_key.startswith("sk-"):
+        openai_key = ""
+    return openai_key, gemini_key, groq_key
 
+@st.cache_resource
+def get_scheduler():
+    # 所有使用者共用一個排程器：各組金鑰公平輪流、互動查詢優先於背景分析，並各有並行上限與 token 額度
+    return scheduler.FairScheduler()
 
-## 📊 關鍵發現
+def get_llm_client():
+    """目前使用者的互動查詢用客戶端（經排程器，背景分析再多也不會讓查詢排隊）"""
+    keys = _api_keys()
+    if not any(keys):
+        return None
+    return scheduler.ScheduledLLM(_llm_provider(*keys), get_scheduler(), scheduler.tenant_id(*keys),
+                                  scheduler.INTERACTIVE)
 
+@st.cache_resource
+def get_query_engine(df: pd.DataFrame) -> BatchQueryEngine:
+    return BatchQueryEngine(df)
 
-## 🔧 建議行動
+# ==================== 背景工作（流程在 agents/pipeline.py，由 worker 執行緒在背景執行） ====================
+@st.cache_resource
+def get_job_queue():
+    return job_queue.JobQueue()
 
+@st.cache_resource
+def _job_pool(openai_key: str, gemini_key: str, groq_key: str):
+    # worker 執行緒活在 Streamlit server process 中，瀏覽器重新整理或關閉分頁都不會中斷工作；
+    # 每組金鑰各自一個佇列，工作只會由持有相同金鑰的 worker 執行
+    # 每組金鑰一個 worker：同一位使用者同時只跑一個完整分析，其餘排隊；LLM 呼叫以批次優先序經過排程器
+    name = scheduler.tenant_id(openai_key, gemini_key, groq_key)
+    llm_call = None
+    if openai_key or gemini_key or groq_key:
+        llm_call = scheduler.ScheduledLLM(_llm_provider(openai_key, gemini_key, groq_key), get_scheduler(), name,
+                                          scheduler.BATCH)
+    return job_queue.JobWorkerPool(get_job_queue(), llm_call, workers=JOBS_PER_TENANT, name=name).start()
+
+def get_job_pool():
+    return _job_pool(*_api_keys())
+
+def temperature_figure(df: pd.DataFrame, chart: Dict[str, Any]):
+    data = df.assign(**{chart["x"]: pd.to_datetime(df[chart["x"]], errors="coerce")})
+    fig1 = px.line(data, x=chart["x"], y=chart["y"], color=chart["color"],
+                   title="🐔 冷鏈溫度趨勢圖（2-8°C 為安全範圍）")
+    fig1.add_hline(y=8, line_dash="dash", line_color="red", annotation_text="危險上限 8°C")
+    fig1.add_hline(y=2, line_dash="dash", line_color="blue", annotation_text="危險下限 2°C")
+    return fig1
+
+def render_result(result: Dict[str, Any], df: pd.DataFrame) -> None:
+    st.success("🎉 分析完成！以下為 AI 生成報告")
+
+    # 風險總覽
+    col_a, col_b, col_c = st.columns(3)
+    col_a.metric("整體風險分數", f"{result['risk_score']:.1f}/10")
+    col_b.metric("風險等級", result['risk_level'])
+    col_c.metric("異常批次", result.get("anomaly_batches", 0))
+    for alert in result.get("alerts", []):
+        st.warning(f"📣 {alert['message']} → {alert['action']}")
+    if result.get("memoized"):
+        st.caption(f"♻️ 輸入欄位未變動，沿用先前結果：{'、'.join(result['memoized'])}")
+
+    # 圖表
+    chart = result["charts"].get("溫度趨勢")
+    if chart and chart["x"] in df.columns and chart["y"] in df.columns:
+        st.plotly_chart(temperature_figure(df, chart), use_container_width=True)
+
+    # 最終報告
+    st.markdown("### 📄 AI 專業分析報告")
+    if "prompt_estimate" in result:
+        est = result["prompt_estimate"]
+        st.caption(f"📏 {est['model']}：提示詞約 {est['prompt_tokens']:,} tokens"
+                   f"（上限 {est['context_window']:,}{'，已自動壓縮' if est['compacted'] else ''}）"
+                   f" · 預估成本 ${est['cost_usd']:.4f} · 預估延遲 {est['latency_s']:.0f} 秒")
+    if "violation_map_reduce" in result:
+        mr = result["violation_map_reduce"]
+        st.caption(f"🗂️ 溫度異常批次 map-reduce：{mr['rows']:,} 筆 · {mr['partitions']} 個分區 · {mr['chunks']} 個區塊"
+                   f" · {mr['calls']} 次呼叫（快取 {mr['cached']}）· 涵蓋 {mr['coverage']:.0%}")
+    st.markdown(result["final_report"])
+
+    # 下載
+    st.download_button(
+        "⬇️ 下載完整報告 (Markdown)",
+        result["final_report"],
+        f"蛋品溯源報告_{datetime.now().strftime('%Y%m%d')}.md",
+        "text/markdown"
+    )
 
-## 📈 視覺化圖表
-（在此描述圖表內容）
+def render_job(job_id: str) -> None:
+    """顯示背景工作進度或結果；工作 id 在網址中，重新整理頁面後會自動重新連上"""
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        st.warning(f"找不到分析工作 {job_id}")
+        return
+    if job["status"] in job_queue.ACTIVE_STATES:
+        get_job_pool()  # 伺服器重啟後確保有 worker 接手（逾時的工作會從 checkpoint 接續）
+        st.progress(job["progress"], text=job["message"] or "⏳ 排隊中...")
+        st.caption(f"已完成 {len(job['completed_stages'])} 個階段 · 可關閉或重新整理頁面，稍後回到此網址查看結果")
+        if st.button("⏹️ 取消分析"):
+            queue.cancel(job_id)
+        time.sleep(1)
+        st.rerun()
+    elif job["status"] == "done":
+        render_result(job["result"], pd.read_pickle(job["input_path"]))
+    else:
+        st.error(f"分析{'已取消' if job['status'] == 'cancelled' else '失敗'}：{job['error'] or ''}")
+        st.caption(f"已完成的 {len(job['completed_stages'])} 個階段會保留，繼續時不需重新執行")
+        if st.button("▶️ 從中斷處繼續"):
+            queue.resume(job_id)
+            st.rerun()
 
-嚴格遵守：不偽造數據、不提供法律建議、所有高風險必須標註來源。
-"""
+# ==================== 即時監控（Agent 003 / 019 / 021，事件處理在 services/monitoring.py） ====================
+_LIGHTS = {"green": "🟢", "yellow": "🟡", "red": "🔴"}
+_LIGHT_RANK = {"red": 0, "yellow": 1, "green": 2}
 
-# ==================== 簡化版 LLM 呼叫（支援 OpenAI / Gemini / Grok） ====================
 @st.cache_resource
-def get_llm_client():
-    openai_key = st.session_state.get("openai_key", "")
-    gemini_key = st.session_state.get("gemini_key", "")
-    groq_key = st.session_state.get("groq_key", "")
-
-    try:
-        import openai
-        if openai_key and openai_key.startswith("sk-"):
-            client = openai.OpenAI(api_key=openai_key)
-            return lambda prompt, model: client.chat.completions.create(
-                model=model,
-                messages=[{"role": "system", "content": SYSTEM_PROMPT},
-                          {"role": "user", "content": prompt}],
-                temperature=0.2,
-                max_tokens=3000
-            ).choices[0].message.content
-    except: pass
-
-    try:
-        import google.generativeai as genai
-        if gemini_key:
-            genai.configure(api_key=gemini_key)
-            model = genai.GenerativeModel('gemini-1.5-pro')
-            return lambda prompt, _: model.generate_content(SYSTEM_PROMPT + prompt).text
-    except: pass
+def get_alert_dispatcher():
+    return alerts.AlertDispatcher(alerts.NdjsonSink(ALERTS_PATH)).start()
 
-    try:
-        from groq import Groq
-        if groq_key:
-            client = Groq(api_key=groq_key)
-            return lambda prompt, model: client.chat.completions.create(
-                model="llama3-70b-8192" if "70b" in model else "llama3-8b-8192",
-                messages=[{"role": "system", "content": SYSTEM_PROMPT},
-                          {"role": "user", "content": prompt}],
-                temperature=0.2,
-                max_tokens=3000
-            ).choices[0].message.content
-    except: pass
-
-    return None
-
-# ==================== 代理模擬執行（31個代理核心邏輯） ====================
-def run_all_agents(df: pd.DataFrame, llm_call, model: str) -> Dict[str, Any]:
-    progress = st.progress(0)
-    status = st.empty()
-    results = {"notes": [], "figures": {}}
-
-    # Agent 001-006: 數據清理
-    status.text("🧹 Agent 001-006：數據清理與驗證中...")
-    progress.progress(10)
-
-    # 自動日期解析
-    date_cols = ["laying_date", "packing_date", "distribution_date", "產蛋日期", "包裝日期", "出貨日期"]
-    for col in date_cols:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-
-    # 溫度欄位統一處理
-    temp_cols = [c for c in df.columns if any(k in c.lower() for k in ["temp", "溫度"])]
-    if temp_cols:
-        df["temperature_violation"] = df[temp_cols[0]].apply(lambda x: x > 8 or x < 2 if pd.notna(x) else False)
-
-    results["notes"].append("✅ 數據結構已標準化，溫度欄位已驗證")
-
-    # Agent 007-013: 統計分析
-    status.text("📊 Agent 007-013：統計分析中...")
-    progress.progress(40)
-    time.sleep(1)
-
-    stats = {
-        "總批次數": len(df),
-        "平均溫度": df[temp_cols[0]].mean() if temp_cols else None,
-        "溫度異常批次": df["temperature_violation"].sum() if "temperature_violation" in df.columns else 0,
-        "高風險批次": df[df["temperature_violation"] == True]["batch_id"].tolist() if "bath_id" in df.columns else []
-    }
-    results["notes"].append(f"🔢 發現 {stats['溫度異常批次']} 個溫度異常批次")
-
-    # Agent 014-020: 可視化
-    status.text("🎨 Agent 014-020：生成圖表中...")
-    progress.progress(70)
-    time.sleep(1)
-
-    if temp_cols and "laying_date" in df.columns:
-        fig1 = px.line(df, x="laying_date", y=temp_cols[0], color="batch_id" if "batch_id" in df.columns else None,
-                       title="🐔 冷鏈溫度趨勢圖（2-8°C 為安全範圍）")
-        fig1.add_hline(y=8, line_dash="dash", line_color="red", annotation_text="危險上限 8°C")
-        fig1.add_hline(y=2, line_dash="dash", line_color="blue", annotation_text="危險下限 2°C")
-        results["figures"]["溫度趨勢"] = fig1
-
-    # Agent 021-026: 風險評估
-    status.text("⚠️ Agent 021-026：風險評分中...")
-    progress.progress(85)
-    risk_score = min(10.0, 2.0 + stats['溫度異常批次'] * 1.5)
-    results["risk_score"] = risk_score
-    results["risk_level"] = "🟢 低" if risk_score < 4 else "🟡 中" if risk_score < 7 else "🔴 高" if risk_score < 9 else "⚫ 緊急"
-
-    # Agent 031: 最終報告生成（真正呼叫 LLM）
-    status.text("📄 Agent 031：生成完整報告中...")
-    progress.progress(95)
-
-    prompt = f"""
-請根據以下數據生成專業的食品溯源分析報告（繁體中文）：
-
-資料摘要：
-{stats}
-
-溫度異常批次：{df[df['temperature_violation']==True].to_markdown(index=False) if 'temperature_violation' in df.columns else '無'}
-
-請嚴格按照規範格式輸出最終報告。
-"""
-
-    if llm_call:
-        try:
-            report = llm_call(prompt, model)
-        except Exception as e:
-            report = f"⚠️ LLM 呼叫失敗（{e}），以下為本地分析結果：\n\n" + "\n".join(results["notes"])
+@st.cache_resource
+def get_monitor(source: str):
+    # 讀取執行緒活在 server process 中，所有分頁共用同一份監控狀態，重新整理頁面不會重新讀取事件流
+    return monitoring.MonitorRunner(monitoring.Monitor(on_event=get_alert_dispatcher().submit), source).start()
+
+def render_tile(tile: Dict[str, Any]) -> None:
+    with st.container(border=True):
+        temp = "—" if tile["temperature"] is None else f"{tile['temperature']:.1f}°C"
+        st.markdown(f"{_LIGHTS[tile['status']]} **{tile['batch_id']}** · {temp}")
+        detail = f"{tile['farm_name'] or ''} {tile['stage'] or ''} · {tile['updated']}"
+        if tile["excursion_minutes"]:
+            detail += f" · 超標 {tile['excursion_minutes']} 分鐘"
+        st.caption(detail)
+        if len(tile["trend"]) > 1:
+            st.line_chart(tile["trend"], height=80)
+
+@st.fragment(run_every=MONITOR_REFRESH)
+def render_monitor(source: str) -> None:
+    """只重跑這個 fragment；每次輪詢只取回上次之後變動的圖塊，未變動的圖塊內容與位置不變，前端不會重繪"""
+    runner = get_monitor(source)
+    if st.session_state.get("monitor_source") != source:
+        st.session_state.monitor_source = source
+        st.session_state.monitor_tiles = {}
+        st.session_state.monitor_version = 0
+    tiles = st.session_state.monitor_tiles
+    version, changed = runner.monitor.changes(st.session_state.monitor_version)
+    for tile in changed:
+        tiles[tile["batch_id"]] = tile
+    st.session_state.monitor_version = version
+    summary = runner.monitor.summary()
+
+    if runner.error:
+        st.error(f"事件來源中斷：{runner.error}")
+    c1, c2, c3, c4, c5 = st.columns(5)
+    c1.metric("事件數", f"{summary['events']:,}")
+    c2.metric("每秒事件", f"{summary['events_per_sec']:,.0f}")
+    c3.metric("🟢 正常", summary["status"]["green"])
+    c4.metric("🟡 警告", summary["status"]["yellow"])
+    c5.metric("🔴 緊急", summary["status"]["red"])
+
+    # 依燈號與批次 ID 排序（不依更新時間），圖塊位置穩定
+    shown = sorted(tiles.values(), key=lambda t: (_LIGHT_RANK[t["status"]], t["batch_id"]))[:MONITOR_TILES]
+    cols = st.columns(4)
+    for i, tile in enumerate(shown):
+        with cols[i % 4]:
+            render_tile(tile)
+
+    dispatcher = get_alert_dispatcher()
+    st.caption(f"📣 告警通知：送出 {dispatcher.stats['notifications']:,} 則 · 重複抑制 {dispatcher.stats['suppressed']:,} 筆"
+               + (f" · ⚠️ 通知失敗：{dispatcher.last_error}" if dispatcher.last_error else ""))
+
+    st.markdown("#### 🚨 最新異常事件")
+    if summary["recent"]:
+        st.dataframe(pd.DataFrame(summary["recent"])[["time", "batch_id", "severity", "message"]],
+                     use_container_width=True, hide_index=True)
     else:
-        report = "⚠️ 未提供 API Key，使用本地模擬報告\n\n" + "\n".join(results["notes"])
-
-    results["final_report"] = report
-    progress.progress(100)
-    status.text("🎉 所有 31 個代理執行完畢！")
-    time.sleep(1)
-    progress.empty()
-    status.empty()
-
-    return results
+        st.caption("尚無異常事件")
 
 # ==================== Streamlit UI ====================
 st.set_page_config(page_title="🐔 台灣蛋品溯源AI系統 v2.0", layout="wide", initial_sidebar_state="expanded")
@@ -218,9 +265,20 @@ with st.sidebar:
     st.session_state.gemini_key = gemini_key
     st.session_state.groq_key = groq_key
 
+    if any(_api_keys()):
+        usage = get_scheduler().stats(scheduler.tenant_id(*_api_keys()))
+        st.caption(f"🎟️ 本小時剩餘額度約 {usage['tokens_remaining']:,} tokens · 進行中 {usage['running']} 個呼叫")
+
     st.divider()
+    mode = st.radio("模式", ["📂 上傳分析", "📡 即時監控"], horizontal=True)
     st.caption("🚀 部署於 Hugging Face Spaces · 2025-11-21 更新")
 
+if mode == "📡 即時監控":
+    source = st.text_input("事件來源（NDJSON 檔案路徑或 tcp://host:port）", value=MONITOR_SOURCE)
+    st.caption("每行一筆 JSON：感測器讀數 {batch_id, ts, temperature, humidity} 或批次階段 {batch_id, ts, stage}")
+    render_monitor(source)
+    st.stop()
+
 # 主畫面
 col1, col2 = st.columns([2, 1])
 with col1:
@@ -252,41 +310,42 @@ if uploaded_file:
         st.success(f"✅ 成功載入 {len(df):,} 筆資料，共 {len(df.columns)} 欄")
         st.dataframe(df.head(10), use_container_width=True)
 
+        # Agent 027：自然語言查詢（LLM 只產生 SQL，查詢在本地執行）
+        with st.expander("💬 自然語言查詢（Agent 027）"):
+            question = st.text_input("用中文或英文提問", placeholder="例：哪個農場的批次最多？")
+            if question:
+                llm_call = get_llm_client()
+                if llm_call is None:
+                    st.warning("請先設定至少一個 API Key")
+                else:
+                    try:
+                        answer = get_query_engine(df).ask(question, llm_call, llm_call.resolve_model())
+                        st.code(answer["sql"], language="sql")
+                        st.dataframe(answer["rows"], use_container_width=True)
+                        if answer["truncated"]:
+                            st.caption(f"僅顯示前 {len(answer['rows'])} 列")
+                    except QueryError as e:
+                        st.error(f"查詢失敗：{e}")
+                    except scheduler.QuotaExceededError as e:
+                        st.warning(f"⏳ {e}")
+
+        map_reduce = st.toggle("🗂️ 大型資料完整分析（依農場 × 月份分區 map-reduce，涵蓋所有溫度異常批次）",
+                               value=len(df) > MAP_REDUCE_ROWS)
         if st.button("🚀 啟動 31 個 AI 代理進行完整分析", type="primary", use_container_width=True):
-            llm_call = get_llm_client()
-            with st.spinner("Agent 031 協調員已就位，正在調度 31 個專業代理..."):
-                result = run_all_agents(df.copy(), llm_call, "gpt-4o")
-
-            st.success("🎉 分析完成！以下為 AI 生成報告")
-
-            # 風險總覽
-            col_a, col_b, col_c = st.columns(3)
-            col_a.metric("最高風險分數", f"{result['risk_score']:.1f}/10")
-            col_b.metric("風險等級", result['risk_level'])
-            col_c.metric("異常批次", len(result.get('figures', {}))
-
-            # 圖表
-            if "溫度趨勢" in result["figures"]:
-                st.plotly_chart(result["figures"]["溫度趨勢"], use_container_width=True)
-
-            # 最終報告
-            st.markdown("### 📄 AI 專業分析報告")
-            st.markdown(result["final_report"])
-
-            # 下載
-            st.download_button(
-                "⬇️ 下載完整報告 (Markdown)",
-                result["final_report"],
-                f"蛋品溯源報告_{datetime.now().strftime('%Y%m%d')}.md",
-                "text/markdown"
-            )
+            # 送出背景工作：重新整理頁面不會中斷分析，中斷的工作可從最後完成的代理接續
+            pool = get_job_pool()
+            st.query_params["job"] = pool.queue.submit(df, params={"model": "gpt-4o", "map_reduce": map_reduce},
+                                                       queue=pool.name)
 
     except Exception as e:
         st.error(f"資料讀取失敗：{e}")
 
-else:
+elif "job" not in st.query_params:
     st.info("👈 請上傳資料並設定至少一個 API Key 即可啟動 31 個 AI 代理！")
     st.markdown("### 🔥 支援模型：GPT-4o · Gemini 1.5 Pro · Grok · Llama3-70B（Groq 超快）")
 
+if "job" in st.query_params:
+    render_job(st.query_params["job"])
+
 st.markdown("---")
 st.caption("Food Traceability AI System v2.0 - Built with ❤️ by xAI & Taiwan Food Safety Team")
@@ -0,0 +1 @@
+"""代理執行流程：不依賴 Streamlit 的 31 個代理 pipeline 與協調員介面。"""
@@ -0,0 +1,73 @@
+# agents/orchestrator.py - Agent 031 總協調員（app2.py 使用的介面）
+# 執行 agents/pipeline.py 的完整流程，再整理風險總評與兩張關鍵圖表。
+# plotly 只在產生圖表時才匯入，headless worker 使用 pipeline 時不需要它。
+
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+from agents.pipeline import ProgressCallback, run_all_agents
+from utils.features import SAFE_TEMP_RANGE, STAGE_DATE_COLUMNS
+
+
+class TraceabilityOrchestrator:
+    """
+    orchestrator = TraceabilityOrchestrator(df, llm, "gpt-4o")
+    result = orchestrator.run_full_pipeline()
+    """
+
+    def __init__(self, df: pd.DataFrame, llm=None, model: str = "gpt-4o",
+                 progress: Optional[ProgressCallback] = None):
+        self.df = df
+        self.llm = llm
+        self.model = model
+        self.progress = progress
+
+    def run_full_pipeline(self) -> Dict[str, Any]:
+        """
+        Returns:
+            pipeline 結果，另加 risk_summary（Markdown）與 temp_heatmap / timeline_chart（有對應欄位時）
+        """
+        data = self.df.copy()
+        result = run_all_agents(data, self.llm, self.model, progress=self.progress)
+        summary = result.get("structured_report", {}).get("summary")
+        result["risk_summary"] = "\n".join(
+            [f"**風險等級：** {result['risk_level']}", ""] + ([summary, ""] if summary else [])
+            + [f"- {note}" for note in result["notes"]])
+        temp_col = result["charts"].get("溫度趨勢", {}).get("y")
+        heatmap = temperature_heatmap(data, temp_col) if temp_col else None
+        if heatmap is not None:
+            result["temp_heatmap"] = heatmap
+        timeline = stage_timeline(data)
+        if timeline is not None:
+            result["timeline_chart"] = timeline
+        return result
+
+
+def temperature_heatmap(df: pd.DataFrame, temp_col: str):
+    """農場 × 日期的平均溫度熱圖"""
+    if "farm_name" not in df.columns or "laying_date" not in df.columns:
+        return None
+    temps = pd.to_numeric(df[temp_col], errors="coerce")
+    grid = temps.groupby([df["farm_name"], df["laying_date"].dt.date], observed=True).mean().unstack()
+    if grid.empty:
+        return None
+    import plotly.express as px
+    low, high = SAFE_TEMP_RANGE
+    fig = px.imshow(grid, aspect="auto", color_continuous_scale="RdBu_r", zmin=low - 4, zmax=high + 4,
+                    labels={"x": "產蛋日期", "y": "農場", "color": "平均溫度 °C"},
+                    title=f"🌡️ 冷鏈溫度熱圖（{low:g}-{high:g}°C 為安全範圍）")
+    return fig
+
+
+def stage_timeline(df: pd.DataFrame):
+    """各供應鏈階段每日批次數"""
+    stages = [c for c in STAGE_DATE_COLUMNS if c in df.columns and pd.api.types.is_datetime64_any_dtype(df[c])]
+    if not stages:
+        return None
+    counts = pd.concat({c: df[c].dt.floor("D").value_counts() for c in stages}, axis=1).sort_index().fillna(0)
+    if counts.empty:
+        return None
+    import plotly.express as px
+    return px.line(counts, x=counts.index, y=stages, title="📅 供應鏈各階段每日批次數",
+                   labels={"x": "日期", "value": "批次數", "variable": "階段"})
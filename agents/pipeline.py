@@ -0,0 +1,592 @@
+# agents/pipeline.py - 31 個代理的無介面（headless）執行流程
+# 從 Grok_app.py 抽離：進度以 callback 回報，不匯入 streamlit / plotly，
+# cron、佇列 worker 與 CLI 可直接執行，多個資料集可跨 process 平行處理。
+#
+#   python -m agents.pipeline data.csv --split-by farm_name --workers 4 --out data/reports
+
+import argparse
+import json
+import os
+import uuid
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from models.data_models import AnalysisResult, ReportOutput
+from models.ml_models.anomaly_detector import ANOMALY_THRESHOLD, AnomalyDetector, model_path
+from services.agent_cache import AgentCache, ColumnFingerprints, code_version, resolve_inputs, text_key
+from services.entity_resolution import apply_entity_merges, canonicalize_entities
+from services.local_compute import AGENT_INPUTS, LOCAL_AGENTS, run_local_agents
+from services.map_reduce import map_reduce as run_map_reduce
+from services.profiler import profile_dataframe
+from utils.data_validator import validate_dataframe
+from utils.features import SAFE_TEMP_RANGE, batch_features, parse_dates
+from utils.llm import LLMProvider, StructuredOutputError, json_instruction
+from utils.prompt_engine import get_prompt_engine, render_value
+from utils.serialization import to_jsonable
+from utils.shared_frame import SharedFrame
+from utils.token_budget import PromptTooLargeError, fit_prompt
+
+# 進度回報：callback(百分比 0-100, 目前階段說明)
+ProgressCallback = Callable[[int, str], None]
+
+# ==================== 系統 Prompt（來自規格第4章） ====================
+SYSTEM_PROMPT = """
+你是一個專業的台灣食品溯源與安全AI專家，專注於雞蛋冷鏈追溯。
+關鍵法規與標準：
+- 冷藏溫度必須保持在 2~8°C
+- 產蛋到包裝不得超過 24 小時
+- 洗選蛋保存期限最多 28 天
+- 冷鏈中斷超過 2 小時視為高風險
+
+請使用繁體中文回覆，輸出格式：
+# ✨ 最終報告
+
+## ⚠️ 風險總評
+
+
+## 📊 關鍵發現
+
+
+## 🔧 建議行動
+
+
+## 📈 視覺化圖表
+（在此描述圖表內容）
+
+嚴格遵守：不偽造數據、不提供法律建議、所有高風險必須標註來源。
+"""
+
+REPORT_QUERY = "請根據以上數據生成專業的食品溯源分析報告（繁體中文），並嚴格按照規範格式輸出最終報告。"
+VIOLATION_ROWS = 200     # 報告提示詞中列出的溫度異常批次上限
+HIGH_RISK_BATCHES = 20   # 合併後保留的高風險批次數
+RISK_SATURATION_RATE = 0.10  # 超出預期誤報率的異常批次比例達 10% 時整體風險為 10 分
+# map-reduce 模式：溫度異常批次超過 VIOLATION_ROWS 時，由 Agent 021 依農場 × 月份分區完整分析後再彙整
+MAP_QUERY = ("以上是溫度異常批次的其中一個分區（農場 × 月份）。請列出此分區的風險重點：異常批次、溫度偏離程度、"
+             "可能原因與需立即檢查的批次。只根據此分區的資料，不要推測其他分區。")
+REDUCE_QUERY = ("以上是各分區的部分分析報告。請合併成一份涵蓋所有分區的溫度異常摘要：依農場與月份歸納共同模式、"
+                "最嚴重的批次與建議行動，不得遺漏任何分區列出的需立即檢查批次。")
+API_KEY_ENV = {"openai_key": "OPENAI_API_KEY", "gemini_key": "GEMINI_API_KEY",
+               "groq_key": "GROQ_API_KEY", "xai_key": "XAI_API_KEY"}
+
+
+# checkpoint 的階段名稱（本地統計代理以各自的 agent_id 為階段）
+CLEANING_STAGE = "agent_001-006"
+RISK_STAGE = "agent_021-029"
+REPORT_STAGE = "agent_031"
+VIOLATION_STAGE = "agent_021:map_reduce"
+
+# Agent 021-029 風險評分讀取的欄位（batch_features 的輸入），宣告方式同 local_compute.AGENT_INPUTS
+RISK_INPUTS = ("@stage_dates", "@temperature", "@quantity", "batch_id")
+
+
+def _silent(percent: int, message: str) -> None:
+    pass
+
+
+class Checkpoint:
+    """
+    階段輸出的保存介面（預設不保存）
+
+    每個階段完成後 save(stage, output)；重新執行時 load(stage) 有值就直接沿用，
+    中斷的流程因此從最後完成的代理接續，不重算、不重複呼叫 LLM。output 一律可 json.dumps。
+    """
+
+    def load(self, stage: str) -> Optional[Any]:
+        return None
+
+    def save(self, stage: str, output: Any) -> None:
+        pass
+
+
+def risk_level(score: float) -> str:
+    return "🟢 低" if score < 4 else "🟡 中" if score < 7 else "🔴 高" if score < 9 else "⚫ 緊急"
+
+
+# ==================== 各階段 ====================
+def _flag_temperature(df: pd.DataFrame) -> Optional[str]:
+    """加上 temperature_violation 欄位，回傳使用的溫度欄位"""
+    temp_cols = [c for c in df.columns if any(k in str(c).lower() for k in ["temp", "溫度"])]
+    if not temp_cols:
+        return None
+    temps = pd.to_numeric(df[temp_cols[0]], errors="coerce")
+    low, high = SAFE_TEMP_RANGE
+    df["temperature_violation"] = (temps > high) | (temps < low)
+    return temp_cols[0]
+
+
+def clean_dataset(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Agent 001-006：就地清理資料（日期解析、實體合併、溫度異常旗標）
+
+    Returns:
+        {"profile", "entity_merges", "validation", "temp_column"}
+    """
+    # Agent 001-002：欄位結構與缺失值概況在本地單次掃描計算，LLM 只看精簡 profile
+    profile = profile_dataframe(df)
+    parse_dates(df)
+    # Agent 005：實體名稱模糊比對，彙總前先把重複農場 / 包裝廠 / 零售商合併為同一名稱
+    entity_merges = canonicalize_entities(df)
+    # Agent 006：階段日期順序、參照完整性與數量平衡（validation_rules.yaml）
+    validation = validate_dataframe(df)
+    temp_col = _flag_temperature(df)
+    return {"profile": profile, "entity_merges": entity_merges, "validation": validation,
+            "temp_column": temp_col}
+
+
+def restore_cleaning(df: pd.DataFrame, cleaning: Dict[str, Any]) -> None:
+    """以 checkpoint 的清理結果重建清理後的資料（只做轉換，不重新 profile / 比對 / 驗證）"""
+    parse_dates(df)
+    apply_entity_merges(df, cleaning["entity_merges"])
+    _flag_temperature(df)
+
+
+def score_risk(df: pd.DataFrame, update_model: bool = True,
+               baseline: Optional[str] = None) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Agent 021-026 / 029：異常偵測模型為每個批次評分 0-1，整體風險分數 0-10
+
+    整體分數取「超出預期誤報率的異常批次比例」：正常資料約有 1 - ANOMALY_THRESHOLD 的批次會被標記，
+    超出部分達 RISK_SATURATION_RATE 時為 10 分；不取各批次最大值（批次數越多越必然接近 10）。
+    模型只以評為正常的批次更新（update_model=False 時不更新已存檔的模型）；沒有數值特徵時不評分。
+    baseline 為租戶或資料集 id 時使用該對象自己的基線檔（見 anomaly_detector.model_path）。
+    """
+    features = batch_features(df).select_dtypes(include="number")
+    if features.empty or not len(features.columns):
+        scored = pd.DataFrame({"anomaly_score": pd.Series(dtype=float), "is_anomaly": pd.Series(dtype=bool),
+                               "top_feature": pd.Series(dtype=object)})
+        return scored, {"risk_score": 0.0, "highest_risk_batch": "無", "anomaly_batches": 0,
+                        "anomaly_rate": 0.0, "risk_level": risk_level(0.0)}
+    path = model_path(baseline)
+    detector = AnomalyDetector.load(path)
+    if detector is None or not detector.covers(features):
+        # 沒有歷史基線（或既有基線的特徵與本資料完全不同），先以本資料評分，存檔的基線只納入評為正常的批次
+        scored = AnomalyDetector().fit(features).score(features)
+        detector = detector or AnomalyDetector()
+    else:
+        scored = detector.score(features)
+    if update_model and detector.learn(features, scored, AnomalyDetector.dataset_digest(features)):
+        detector.save(path)
+
+    rate = float(scored["is_anomaly"].mean())
+    excess = max(rate - (1 - ANOMALY_THRESHOLD), 0.0)
+    score = round(10 * min(excess / RISK_SATURATION_RATE, 1.0), 2)
+    return scored, {
+        "risk_score": score,
+        "highest_risk_batch": str(scored["anomaly_score"].idxmax()),
+        "anomaly_batches": int(scored["is_anomaly"].sum()),
+        "anomaly_rate": round(rate, 4),
+        "risk_level": risk_level(score),
+    }
+
+
+def run_all_agents(df: pd.DataFrame, llm_call=None, model: str = "gpt-4o",
+                   progress: Optional[ProgressCallback] = None, local_workers: Optional[int] = None,
+                   update_model: bool = True, checkpoint: Optional[Checkpoint] = None,
+                   memo: Optional[AgentCache] = None, map_reduce: bool = False,
+                   baseline: Optional[str] = None) -> Dict[str, Any]:
+    """
+    執行 31 個代理的完整流程
+
+    Args:
+        df: 原始批次資料，會被就地清理（呼叫端若要保留原資料請傳入副本）
+        llm_call: llm_call(prompt, model) 介面（例如 LLMProvider）；None 時產生本地報告
+        progress: 進度 callback，預設不回報
+        local_workers: 本地統計代理的 process 數量（多資料集平行時設為 1 避免超額訂閱）
+        checkpoint: 各階段輸出的保存位置，已完成的階段直接沿用
+        memo: 代理輸出快取；代理宣告的輸入欄位內容與上次相同時直接沿用（results["memoized"] 列出沿用的代理）
+        map_reduce: 溫度異常批次超過 VIOLATION_ROWS 時以 map-reduce 完整分析，不只列出前幾百筆
+        baseline: 異常偵測基線的擁有者（租戶或資料集 id），None 時使用共用的預設基線
+
+    Returns:
+        可 json.dumps 的結果（final_report、風險分數、各階段輸出與 charts 圖表規格）
+    """
+    progress = progress or _silent
+    checkpoint = checkpoint or Checkpoint()
+    results: Dict[str, Any] = {"notes": [], "charts": {}, "memoized": []}
+
+    # Agent 001-006: 數據清理
+    progress(10, "🧹 Agent 001-006：數據清理與驗證中...")
+    cleaning = checkpoint.load(CLEANING_STAGE)
+    if cleaning is None:
+        cleaning = to_jsonable(clean_dataset(df))
+        checkpoint.save(CLEANING_STAGE, cleaning)
+    else:
+        restore_cleaning(df, cleaning)
+    validation = cleaning["validation"]
+    temp_col = cleaning["temp_column"]
+    results.update(profile=cleaning["profile"], entity_merges=cleaning["entity_merges"], validation=validation)
+    if cleaning["entity_merges"]:
+        results["notes"].append("🔗 合併重複實體：" + "、".join(
+            f"{col} {len(m)} 個" for col, m in cleaning["entity_merges"].items()))
+    if not validation["passed"]:
+        results["notes"].append("🧾 完整性檢查未通過：" + "、".join(
+            f"{r['id']} {r['violations']} 筆" for r in validation["rules"] if r["status"] == "violated"))
+    results["notes"].append("✅ 數據結構已標準化，溫度欄位已驗證")
+    # 清理後的欄位指紋（每欄只雜湊一次，各代理依宣告的輸入欄位組成快取鍵）
+    fingerprints = ColumnFingerprints(df) if memo else None
+
+    # Agent 007-013、015: 統計與供應鏈網絡分析（每個代理完成即寫 checkpoint，只執行尚未完成的代理）
+    progress(40, "📊 Agent 007-013、015：統計與供應鏈網絡分析中...")
+    done = {a: checkpoint.load(a) for a in LOCAL_AGENTS}
+    local_analysis = {a: r for a, r in done.items() if r is not None}
+    remaining = [a for a in LOCAL_AGENTS if a not in local_analysis]
+    keys = {a: fingerprints.key(resolve_inputs(df, AGENT_INPUTS[a]), code_version(LOCAL_AGENTS[a]))
+            for a in remaining} if memo else {}
+    for a, key in keys.items():
+        cached = memo.get(a, key)
+        if cached is not None:
+            local_analysis[a] = cached
+            checkpoint.save(a, cached)
+            results["memoized"].append(a)
+    remaining = [a for a in remaining if a not in local_analysis]
+
+    def save_agent(result: Dict[str, Any]) -> None:
+        if result["status"] == "ok":
+            checkpoint.save(result["agent_id"], result)
+            if memo:
+                memo.put(result["agent_id"], keys[result["agent_id"]], result)
+
+    if remaining and local_workers == 1:
+        local_analysis.update(run_local_agents(df, remaining, max_workers=1, on_result=save_agent))
+    elif remaining:
+        # 資料集只放一份在共享記憶體，所有平行代理 attach 使用
+        with SharedFrame.from_dataframe(df) as shared:
+            local_analysis.update(run_local_agents(shared, remaining, local_workers, on_result=save_agent))
+    local_analysis = {a: local_analysis[a] for a in LOCAL_AGENTS}
+    results["local_analysis"] = local_analysis
+
+    violations = df[df["temperature_violation"] == True] if "temperature_violation" in df.columns else None
+    stats = {
+        "總批次數": len(df),
+        "平均溫度": pd.to_numeric(df[temp_col], errors="coerce").mean() if temp_col else None,
+        "溫度異常批次": len(violations) if violations is not None else 0,
+        "高風險批次": violations["batch_id"].head(50).tolist()
+                     if violations is not None and "batch_id" in df.columns else [],
+    }
+    results["stats"] = stats
+    results["notes"].append(f"🔢 發現 {stats['溫度異常批次']} 個溫度異常批次")
+
+    # Agent 014-020: 可視化（只輸出圖表規格，由介面端繪製，worker 不需載入 plotly）
+    progress(70, "🎨 Agent 014-020：生成圖表中...")
+    if temp_col and "laying_date" in df.columns:
+        results["charts"]["溫度趨勢"] = {"type": "line", "x": "laying_date", "y": temp_col,
+                                       "color": "batch_id" if "batch_id" in df.columns else None,
+                                       "safe_range": list(SAFE_TEMP_RANGE)}
+
+    # Agent 021-026: 風險評估（Agent 029 異常行為學習模型為每個批次評分 0-10）
+    progress(85, "⚠️ Agent 021-026：風險評分中...")
+    risk = checkpoint.load(RISK_STAGE)
+    # 評分依賴已存檔的異常偵測基線：基線更新後同一份資料也要重新評分
+    risk_key = fingerprints.key(resolve_inputs(df, RISK_INPUTS), code_version(score_risk, AnomalyDetector),
+                                AnomalyDetector.version(model_path(baseline))) if memo else None
+    if risk is None and memo:
+        risk = memo.get(RISK_STAGE, risk_key)
+        if risk is not None:
+            results["memoized"].append(RISK_STAGE)
+            checkpoint.save(RISK_STAGE, risk)
+    if risk is None:
+        # 續跑或沿用快取時不再重算，異常偵測模型也不會被同一份資料更新兩次
+        scored, risk = score_risk(df, update_model, baseline)
+        risk["top_anomalies"] = scored[scored["is_anomaly"]].nlargest(10, "anomaly_score").round(4).to_dict(orient="index")
+        risk = to_jsonable(risk)
+        checkpoint.save(RISK_STAGE, risk)
+        if memo:
+            memo.put(RISK_STAGE, risk_key, risk)
+    results.update(risk)
+    results["notes"].append(f"🤖 異常偵測模型標記 {risk['anomaly_batches']} 個異常批次")
+    # Agent 015 的關鍵節點（溫度異常率高、或為單點故障且流量占比高）一併列入風險評估
+    network = local_analysis.get("agent_015", {}).get("output") or {}
+    results["critical_nodes"] = network.get("critical_nodes", [])
+    if network.get("single_points_of_failure") or results["critical_nodes"]:
+        results["notes"].append(f"🕸️ 供應鏈網絡：{len(network.get('single_points_of_failure', []))} 個單點故障節點、"
+                                f"{len(results['critical_nodes'])} 個高風險節點")
+
+    # Agent 031: 最終報告生成（成功的 LLM 報告才寫 checkpoint，失敗時續跑會重試）
+    progress(95, "📄 Agent 031：生成完整報告中...")
+    report = checkpoint.load(REPORT_STAGE)
+    if report is None:
+        summary = None
+        if map_reduce and llm_call and violations is not None and len(violations) > VIOLATION_ROWS:
+            summary = checkpoint.load(VIOLATION_STAGE)
+            if summary is None:
+                try:
+                    summary = summarize_violations(violations, llm_call, model, memo,
+                                                   lambda pct, msg: progress(88 + pct * 6 // 100, msg))
+                    checkpoint.save(VIOLATION_STAGE, summary)
+                except Exception as e:
+                    results["notes"].append(f"⚠️ 溫度異常批次 map-reduce 分析失敗（{e}），報告只列出前 {VIOLATION_ROWS} 批")
+            if summary is not None:
+                results["violation_map_reduce"] = {k: v for k, v in summary.items() if k != "summary"}
+        report, ok = _final_report(df, results, violations, llm_call, model, memo, summary)
+        if report.pop("memoized", False):
+            results["memoized"].append(REPORT_STAGE)
+        if ok:
+            checkpoint.save(REPORT_STAGE, report)
+    results.update(report)
+    merge_report(results)
+    progress(100, "🎉 所有 31 個代理執行完畢！")
+    return to_jsonable(results)
+
+
+def _violation_context(violations: Optional[pd.DataFrame], summary: Optional[Dict[str, Any]]) -> str:
+    if violations is None:
+        return "無"
+    if summary is not None:
+        return (f"共 {len(violations):,} 批，依農場 × 月份分 {summary['partitions']} 區、{summary['chunks']} 個區塊"
+                f"完整分析後彙整（涵蓋 {summary['coverage']:.0%}）\n" + summary["summary"])
+    return (f"共 {len(violations):,} 批，列出前 {min(len(violations), VIOLATION_ROWS)} 批\n"
+            + violations.head(VIOLATION_ROWS).to_csv(index=False))
+
+
+def summarize_violations(violations: pd.DataFrame, llm_call, model: str = "gpt-4o",
+                         memo: Optional[AgentCache] = None,
+                         progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """Agent 021 以 map-reduce 分析全部溫度異常批次（每個分區一次呼叫，再逐層彙整），回傳 map_reduce 的結果"""
+    engine = get_prompt_engine()
+    return run_map_reduce(
+        violations, llm_call,
+        map_prompt=lambda label, text: engine.build_prompt(
+            "agent_021", user_query=MAP_QUERY, context_data={f"溫度異常批次（{label}）": text}),
+        reduce_prompt=lambda parts: engine.build_prompt(
+            "agent_021", user_query=REDUCE_QUERY, context_data={f"部分報告（{label}）": text for label, text in parts}),
+        model=model, memo=memo, stage="agent_021", progress=progress,
+    )
+
+
+def _final_report(df: pd.DataFrame, results: Dict[str, Any], violations: Optional[pd.DataFrame],
+                  llm_call, model: str, memo: Optional[AgentCache] = None,
+                  violation_summary: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    回傳 ({"final_report", "prompt_estimate", "llm_hedge"}, 是否為 LLM 成功產生的報告)
+
+    memo 以「提示詞 + 實際模型」為鍵：上游代理輸出都沒變時提示詞相同，沿用上次的報告、不再呼叫 LLM。
+    violation_summary 為 summarize_violations 的結果，有值時以完整的分區彙整取代「前 VIOLATION_ROWS 批」。
+    """
+    out: Dict[str, Any] = {}
+    local_notes = "\n".join(results["notes"])
+    # 代理 031 的固定提示詞（已編譯、前綴不變）在前，本次資料在後，供應商前綴快取可命中
+    context = {
+        "資料摘要": results["stats"],
+        "資料結構與缺失值概況（Agent 001-002）": results["profile"],
+        "資料完整性檢查（Agent 006，違規規則與樣本列）":
+            [r for r in results["validation"]["rules"] if r["status"] == "violated"],
+        "本地統計與供應鏈網絡分析（Agent 007-013、015）":
+            {k: v["output"] for k, v in results["local_analysis"].items()},
+        "異常偵測模型（Agent 029）前 10 名異常批次（批次、異常機率、主要異常特徵）": results["top_anomalies"],
+        "溫度異常批次": _violation_context(violations, violation_summary),
+    }
+    # 送出前估算 token / 成本 / 延遲；超過模型上下文視窗時自動壓縮最大的上下文區段
+    target_model = llm_call.resolve_model(model) if hasattr(llm_call, "resolve_model") else model
+    # 支援 JSON mode 的客戶端直接回傳 ReportOutput 欄位（估算時把附加的 schema 說明一併算入）
+    structured = hasattr(llm_call, "structured")
+    schema_note = json_instruction(ReportOutput.model_json_schema()) if structured else ""
+    try:
+        prompt, estimate = fit_prompt(
+            lambda c: get_prompt_engine().build_prompt("agent_031", user_query=REPORT_QUERY, context_data=c),
+            context, target_model, max_output_tokens=getattr(llm_call, "max_tokens", None),
+            system_prompt=SYSTEM_PROMPT + schema_note, agent_id="agent_031", render=render_value,
+        )
+        out["prompt_estimate"] = estimate.to_dict()
+    except PromptTooLargeError as e:
+        out["final_report"] = f"⚠️ 報告提示詞過大，未送出（{e}），以下為本地分析結果：\n\n" + local_notes
+        return out, False
+
+    if not llm_call:
+        out["final_report"] = "⚠️ 未提供 API Key，使用本地模擬報告\n\n" + local_notes
+        return out, False
+    key = text_key(SYSTEM_PROMPT, prompt, target_model, structured)
+    cached = memo.get(REPORT_STAGE, key) if memo else None
+    if cached is not None:
+        return {**out, **cached, "memoized": True}, True
+    try:
+        reply: Dict[str, Any] = {}
+        if structured:
+            try:
+                parsed = llm_call.structured(prompt, ReportOutput, model, agent_id="agent_031")
+                reply.update(final_report=parsed.report_markdown, structured_report=parsed.model_dump(mode="json"))
+            except StructuredOutputError as e:
+                # 不重新請求：不符 schema 的回應仍當作 Markdown 報告，分數沿用本地模型
+                reply["final_report"] = e.text
+        else:
+            reply["final_report"] = llm_call(prompt, model, agent_id="agent_031")
+        reply["llm_hedge"] = getattr(llm_call, "last_hedge", {})
+        if memo:
+            memo.put(REPORT_STAGE, key, reply)
+        return {**out, **reply}, True
+    except Exception as e:
+        out["final_report"] = f"⚠️ LLM 呼叫失敗（{e}），以下為本地分析結果：\n\n" + local_notes
+        return out, False
+
+
+def merge_report(results: Dict[str, Any]) -> None:
+    """
+    Agent 031 的結構化輸出與 Agent 029 本地風險評分就地合併（dict 合併，不再呼叫 LLM 解決衝突）
+
+    Agent 029 的分數是異常批次的盛行率（不會因批次數多而飽和），Agent 031 則反映 LLM 看到的質性問題，
+    兩者衡量不同面向，不一致時採保守原則取較高者；高風險批次依 batch_id 合併，同一批次取較高分。
+    """
+    structured = results.get("structured_report")
+    local_score = results.get("risk_score", 0.0)
+    batches: Dict[str, Dict[str, Any]] = {
+        str(batch): {"batch_id": str(batch), "risk_score": round(row["anomaly_score"] * 10, 2),
+                     "sources": ["agent_029"]}
+        for batch, row in results.get("top_anomalies", {}).items()
+    }
+    results["agent_scores"] = {"agent_029": local_score}
+    if structured:
+        results["agent_scores"]["agent_031"] = structured["risk_score"]
+        for item in structured["high_risk_batches"]:
+            entry = batches.setdefault(item["batch_id"], {"batch_id": item["batch_id"], "risk_score": 0.0,
+                                                          "sources": []})
+            entry["risk_score"] = max(entry["risk_score"], item["risk_score"])
+            entry["sources"].append("agent_031")
+            entry["reasons"] = item["reasons"]
+        if structured["risk_score"] > local_score and structured["highest_risk_batch"]:
+            results["highest_risk_batch"] = structured["highest_risk_batch"]
+        results["risk_score"] = max(local_score, structured["risk_score"])
+        results["risk_level"] = risk_level(results["risk_score"])
+        results.update(key_findings=structured["key_findings"], recommendations=structured["recommendations"])
+    results["high_risk_batches"] = sorted(batches.values(), key=lambda b: b["risk_score"],
+                                          reverse=True)[:HIGH_RISK_BATCHES]
+
+
+def analysis_result(results: Dict[str, Any], request_id: Optional[str] = None) -> AnalysisResult:
+    """把 run_all_agents 的結果整理成規格的 AnalysisResult"""
+    structured = results.get("structured_report") or {}
+    return AnalysisResult(
+        request_id=request_id or uuid.uuid4().hex,
+        timestamp=datetime.now(),
+        summary=structured.get("summary") or "\n".join(results["notes"]),
+        risk_assessment={k: results.get(k) for k in
+                         ["risk_score", "risk_level", "highest_risk_batch", "anomaly_batches",
+                          "agent_scores", "high_risk_batches", "critical_nodes"]},
+        visualizations=list(results["charts"]),
+        recommendations=results.get("recommendations", []),
+        agent_outputs={a: r["output"] for a, r in results["local_analysis"].items()},
+    )
+
+
+# ==================== 多資料集平行執行 ====================
+# worker 端的 LLM 客戶端（LLMProvider 含 lock，無法 pickle，每個 process 各自建立）
+_LLM: Optional[LLMProvider] = None
+
+
+def keys_from_env() -> Dict[str, str]:
+    return {arg: os.getenv(env, "") for arg, env in API_KEY_ENV.items()}
+
+
+def make_llm(api_keys: Optional[Dict[str, str]]) -> Optional[LLMProvider]:
+    if not api_keys or not any(api_keys.values()):
+        return None
+    return LLMProvider(**api_keys, system_prompt=SYSTEM_PROMPT)
+
+
+def _init_worker(api_keys: Optional[Dict[str, str]]) -> None:
+    global _LLM
+    _LLM = make_llm(api_keys)
+
+
+def _run_dataset(item: Tuple[str, pd.DataFrame, str, Optional[AgentCache], bool]) -> Tuple[str, Dict[str, Any]]:
+    dataset_id, df, model, memo, map_reduce = item
+    try:
+        # 多個資料集同時執行時不更新共用的異常偵測模型，避免互相覆寫
+        return dataset_id, run_all_agents(df, _LLM, model, local_workers=1, update_model=False, memo=memo,
+                                          map_reduce=map_reduce)
+    except Exception as e:
+        return dataset_id, {"error": f"{type(e).__name__}: {e}"}
+
+
+def run_many(datasets: Dict[str, pd.DataFrame], model: str = "gpt-4o",
+             api_keys: Optional[Dict[str, str]] = None, max_workers: Optional[int] = None,
+             progress: Optional[ProgressCallback] = None,
+             memo: Optional[AgentCache] = None, map_reduce: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    多個資料集平行執行完整流程（每個 process 一個資料集）
+
+    Args:
+        api_keys: LLMProvider 的金鑰參數（openai_key / gemini_key / groq_key / xai_key），None 時產生本地報告
+        memo: 代理輸出快取（各 process 共用同一個 SQLite 檔）
+        map_reduce: 見 run_all_agents
+
+    Returns:
+        {dataset_id: run_all_agents 的結果，失敗時為 {"error"}}
+    """
+    progress = progress or _silent
+    workers = min(max_workers or os.cpu_count() or 1, len(datasets))
+    results: Dict[str, Dict[str, Any]] = {}
+    if workers <= 1:
+        # 與 process pool 相同的單一資料集流程：個別失敗只記錄錯誤，結果也不因 worker 數而不同
+        _init_worker(api_keys)
+        for i, (dataset_id, df) in enumerate(datasets.items(), 1):
+            results[dataset_id] = _run_dataset((dataset_id, df, model, memo, map_reduce))[1]
+            progress(int(i / len(datasets) * 100), f"{dataset_id} 完成")
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(api_keys,)) as pool:
+        futures = [pool.submit(_run_dataset, (d, df, model, memo, map_reduce)) for d, df in datasets.items()]
+        for i, future in enumerate(as_completed(futures), 1):
+            dataset_id, result = future.result()
+            results[dataset_id] = result
+            progress(int(i / len(datasets) * 100), f"{dataset_id} 完成")
+    return {d: results[d] for d in datasets}
+
+
+# ==================== CLI ====================
+def load_datasets(paths: List[str], split_by: Optional[str] = None) -> Dict[str, pd.DataFrame]:
+    """讀取 CSV / Excel / JSON；指定 split_by 時每個檔案再依該欄位（例如 farm_name）拆成多個資料集"""
+    datasets: Dict[str, pd.DataFrame] = {}
+    for path in paths:
+        if path.endswith(".csv"):
+            df = pd.read_csv(path)
+        elif path.endswith(".xlsx"):
+            df = pd.read_excel(path)
+        else:
+            df = pd.read_json(path)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if split_by and split_by in df.columns:
+            for key, part in df.groupby(split_by, sort=True, observed=True):
+                datasets[f"{stem}/{key}"] = part.reset_index(drop=True)
+        else:
+            datasets[stem] = df
+    return datasets
+
+
+def safe_name(name: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name) or "dataset"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="31 個代理完整分析（無介面）")
+    parser.add_argument("paths", nargs="+", help="資料檔（CSV / Excel / JSON）")
+    parser.add_argument("--split-by", help="依欄位拆成多個資料集，例如 farm_name")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--workers", type=int, help="平行 process 數量（預設 CPU 數）")
+    parser.add_argument("--out", default="data/reports", help="報告輸出目錄")
+    parser.add_argument("--no-llm", action="store_true", help="不呼叫 LLM，只輸出本地分析")
+    parser.add_argument("--no-cache", action="store_true", help="不沿用先前執行的代理輸出，全部重算")
+    parser.add_argument("--map-reduce", action="store_true", help="溫度異常批次以 map-reduce 完整分析")
+    args = parser.parse_args(argv)
+
+    datasets = load_datasets(args.paths, args.split_by)
+    results = run_many(datasets, args.model, None if args.no_llm else keys_from_env(), args.workers,
+                       progress=lambda pct, msg: print(f"[{pct:3d}%] {msg}", flush=True),
+                       memo=None if args.no_cache else AgentCache(), map_reduce=args.map_reduce)
+    os.makedirs(args.out, exist_ok=True)
+    for dataset_id, result in results.items():
+        name = safe_name(dataset_id)
+        with open(os.path.join(args.out, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2, default=str)
+        if "final_report" in result:
+            with open(os.path.join(args.out, f"{name}.md"), "w", encoding="utf-8") as f:
+                f.write(result["final_report"])
+    failed = [d for d, r in results.items() if "error" in r]
+    print(f"完成 {len(results)} 個資料集（失敗 {len(failed)} 個），輸出於 {args.out}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
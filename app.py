@@ -4,17 +4,32 @@
 import streamlit as st
 import pandas as pd
 import json
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import networkx as nx
-from pyvis.network import Network
 import yaml
 import os
-import requests
-from openai import OpenAI
-import google.generativeai as genai
 from datetime import datetime
+from services.entity_resolution import canonicalize_entities
+from utils.data_validator import validate_dataframe
+from utils.lazy import lazy_import
+from utils.llm import LLMProvider
+from utils.token_budget import PromptTooLargeError, fit_prompt
+from services.agent_cache import AgentCache
+from services.map_reduce import map_reduce
+
+# Heavy SDKs and plotting libraries load on first use (tab rendered / provider called), not at cold start
+px = lazy_import("plotly.express")
+go = lazy_import("plotly.graph_objects")
+make_subplots = lazy_import("plotly.subplots", "make_subplots")
+nx = lazy_import("networkx")
+Network = lazy_import("pyvis.network", "Network")
+graph_analytics = lazy_import("services.graph_analytics")
+network_view = lazy_import("services.network_view")
+components = lazy_import("streamlit.components.v1")
+scheduler = lazy_import("services.scheduler")
+requests = lazy_import("requests")
+OpenAI = lazy_import("openai", "OpenAI")
+genai = lazy_import("google.generativeai")
+
+MAP_REDUCE_ROWS = 2_000   # batch lists larger than this default to map-reduce mode
 
 # ========================= CONFIG =========================
 st.set_page_config(
@@ -54,9 +69,11 @@ with st.sidebar:
     model_map = {
         "OpenAI": ["gpt-4o", "gpt-4-turbo-2024-04-09", "gpt-4", "gpt-3.5-turbo"],
         "Google Gemini": ["gemini-1.5-pro", "gemini-1.5-flash", "gemini-pro"],
-        "xai_key": ["grok-beta", "grok-2"]
+        "xAI Grok": ["grok-beta", "grok-2"]
     }
     selected_model = st.selectbox("Model", model_map[provider])
+    hedge = st.checkbox("⚡ Hedge across providers", value=False,
+                        help="Send a backup request to another provider if the first token is slower than its p95, cancel the loser")
 
     col1, col2 = st.columns(2)
     with col1:
@@ -87,6 +104,37 @@ Write like a story for the egg carton QR code."""
     chosen_template = st.selectbox("Quick Template", list(templates.keys()))
     custom_prompt = st.text_area("Edit Prompt", value=templates[chosen_template], height=300)
 
+@st.cache_resource
+def get_hedged_llm(openai_key, gemini_key, xai_key, temperature, max_tokens):
+    # Cached so first-token latency stats (the hedge threshold) survive reruns
+    return LLMProvider(openai_key, gemini_key, xai_key=xai_key, temperature=temperature, max_tokens=max_tokens)
+
+@st.cache_resource
+def get_scheduler():
+    return scheduler.FairScheduler()
+
+@st.cache_resource
+def get_agent_cache():
+    return AgentCache()
+
+@st.cache_data
+def get_network_metrics(df):
+    return graph_analytics.node_metrics(df)
+
+@st.cache_resource
+def get_network_view(df):
+    # Clusters and layout are built once per dataset; expanding a cluster only re-aggregates the visible level
+    return network_view.NetworkView(df, get_network_metrics(df), cache=get_agent_cache())
+
+def map_prompt(label, text):
+    return (f"{custom_prompt}\n\nDATASET PARTITION ({label}), one slice of a larger dataset:\n{text}\n\n"
+            "Report findings for this partition only, citing batch IDs.")
+
+def reduce_prompt(parts):
+    sections = "\n\n".join(f"## {label}\n{text}" for label, text in parts)
+    return (f"{custom_prompt}\n\nPARTIAL REPORTS (one per partition):\n{sections}\n\n"
+            "Merge these into a single report covering every partition; keep every flagged batch.")
+
 # ========================= MAIN APP =========================
 uploaded_file = st.file_uploader("Upload Traceability JSON (use the 3 mock datasets!)", type=["json"])
 
@@ -102,6 +150,11 @@ if uploaded_file:
         df['packing_date'] = pd.to_datetime(df.get('packing_date', ''))
         df['distribution_date'] = pd.to_datetime(df.get('distribution_date', ''))
         df['delivery_date'] = pd.to_datetime(df.get('delivery_date', ''))
+        # 同一農場/包裝廠/零售商的不同寫法先合併，避免 Sankey 與統計被拆散
+        entity_merges = canonicalize_entities(df)
+        if entity_merges:
+            st.info("Merged duplicate entities: " + ", ".join(
+                f"{col} ({len(m)})" for col, m in entity_merges.items()))
 
     elif isinstance(data, dict) and "traceability_chain" in str(data):
         dataset_type = "hierarchical"
@@ -111,8 +164,8 @@ if uploaded_file:
         dataset_type = "unknown"
 
     # ========================= TABS =========================
-    tab_overview, tab_sankey, tab_gantt, tab_tree, tab_geo, tab_ai = st.tabs([
-        "Overview", "Sankey Flow", "Timeline", "Sunburst Tree", "Map Route", "AI Agent"
+    tab_overview, tab_sankey, tab_network, tab_gantt, tab_tree, tab_geo, tab_ai = st.tabs([
+        "Overview", "Sankey Flow", "Network Graph", "Timeline", "Sunburst Tree", "Map Route", "AI Agent"
     ])
 
     # ── Overview ──
@@ -123,6 +176,15 @@ if uploaded_file:
         with col3: st.metric("Farms", df['farm_name'].nunique() if 'farm_name' in df.columns else "1")
         with col4: st.metric("Retailers", df['retailer'].nunique() if 'retailer' in df.columns else "1")
         st.dataframe(df if 'df' in locals() else pd.json_normalize([data]), use_container_width=True)
+        if dataset_type == "batch_list":
+            validation = validate_dataframe(df)
+            with st.expander("Integrity checks" + (" ✅" if validation["passed"] else " ⚠️"),
+                             expanded=not validation["passed"]):
+                st.dataframe(pd.DataFrame(validation["rules"]).drop(columns=["samples"]), use_container_width=True)
+                for rule in validation["rules"]:
+                    if rule["samples"]:
+                        st.caption(f"{rule['id']}: {rule['description']}")
+                        st.dataframe(pd.DataFrame(rule["samples"]), use_container_width=True)
 
     # ── Sankey ──
     with tab_sankey:
@@ -142,18 +204,37 @@ if uploaded_file:
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("Auto-generating Sankey from batch list...")
-            # Auto Sankey from batch_list
-            nodes = pd.unique(df[['farm_name','packing_facility','distributor','retailer']].values.ravel('K'))
-            node_map = {name: i for i, name in enumerate(nodes)}
-            links = []
-            for _, r in df.iterrows():
-                links.extend([
-                    dict(source=node_map[r['farm_name']], target=node_map[r['packing_facility']], value=r['quantity_cartons']),
-                    dict(source=node_map[r['packing_facility']], target=node_map[r['distributor']], value=r['quantity_cartons']),
-                    dict(source=node_map[r['distributor']], target=node_map[r['retailer']], value=r['quantity_cartons']),
-                ])
-            fig = go.Figure(go.Sankey(node=dict(label=list(nodes), color="#4682B4"), link=links))
+            # Auto Sankey from batch_list: links aggregated per node pair, nodes colored by network risk (agent_015)
+            graph, nodes = get_network_metrics(df)
+            status_colors = graph_analytics.STATUS_COLORS
+            colors = nodes["status"].map(status_colors).tolist()
+            hover = [f"PageRank {r.pagerank:.4f} · betweenness {r.betweenness:.4f} · temp violations {r.violation_rate:.0%}"
+                     + (f" · sole route for {r.dependents}" if r.dependents else "")
+                     for r in nodes.itertuples()]
+            fig = go.Figure(go.Sankey(
+                node=dict(label=nodes["name"].tolist(), color=colors, customdata=hover,
+                          hovertemplate="%{label}<br>%{customdata}<extra></extra>"),
+                link=dict(source=graph.src, target=graph.dst, value=graph.weight,
+                          color=[status_colors[s] + "55" for s in nodes["status"].to_numpy()[graph.dst]])))
             st.plotly_chart(fig, use_container_width=True)
+            st.caption("🟢 normal · 🟡 warning (temperature violations ≥ 5% or sole route for a farm/retailer) · "
+                       "🔴 high risk (violations ≥ 20% or sole route carrying ≥ 25% of its tier)")
+            bottlenecks = nodes.sort_values("pagerank", ascending=False).head(10)
+            st.dataframe(bottlenecks[["tier", "name", "pagerank", "betweenness", "flow_share", "violation_rate",
+                                      "dependents", "status"]], use_container_width=True, hide_index=True)
+
+    # ── Network (PyVis) ──
+    with tab_network:
+        if dataset_type == "batch_list":
+            view = get_network_view(df)
+            options = dict(view.cluster_options())
+            expanded = st.multiselect("Expand clusters (tier · region)", list(options), format_func=options.get)
+            nodes, edges = view.view(expanded)
+            st.caption(f"{view.graph.n:,} nodes in {len(view.clusters)} tier × region clusters · "
+                       f"showing {len(nodes):,} nodes and {len(edges):,} links · hover a node for PageRank and risk")
+            components.html(network_view.render_html(nodes, edges), height=780)
+        else:
+            st.info("Upload a batch list to explore the supply-chain network")
 
     # ── Timeline Gantt ──
     with tab_gantt:
@@ -203,37 +284,79 @@ if uploaded_file:
     # ── AI Agent Tab ──
     with tab_ai:
         st.markdown("### Run Custom AI Agent")
-        if st.write(f"**Model:** `{selected_model}` • **Temp:** {temperature} • **Max tokens:** {max_tokens}")
+        st.write(f"**Model:** `{selected_model}` • **Temp:** {temperature} • **Max tokens:** {max_tokens}")
 
-        if st.button("Run Agent Now", type="primary", use_container_width=True):
-            with st.spinner(f"Contacting {provider}..."):
-                data_str = json.dumps(data, indent=2)
-                if len(data_str) > 60000:
-                    data_str = data_str[:60000] + "\n...[TRUNCATED]"
-                full_prompt = custom_prompt + "\n\nDATASET:\n" + data_str
+        # Large batch lists: partition by farm × month, analyse every chunk, then merge (no rows dropped)
+        use_map_reduce = dataset_type == "batch_list" and st.toggle(
+            "Map-reduce mode (full coverage for large datasets)", value=len(df) > MAP_REDUCE_ROWS)
 
+        run_clicked = st.button("Run Agent Now", type="primary", use_container_width=True)
+        if run_clicked and use_map_reduce:
+            bar = st.progress(0, text="Partitioning batches...")
+            try:
+                llm = scheduler.ScheduledLLM(get_hedged_llm(openai_key, gemini_key, xai_key, temperature, max_tokens),
+                                             get_scheduler(), scheduler.tenant_id(openai_key, gemini_key, xai_key))
+                mr = map_reduce(df, llm, map_prompt, reduce_prompt, model=selected_model, memo=get_agent_cache(),
+                                stage="app_map_reduce", progress=lambda pct, msg: bar.progress(pct, text=msg))
+                st.caption(f"{mr['rows']:,} batches • {mr['partitions']} partitions • {mr['chunks']} chunks • "
+                           f"{mr['calls']} calls ({mr['cached']} cached) • coverage {mr['coverage']:.0%} • "
+                           f"est. cost ${mr['estimate']['cost_usd']:.2f}")
+                for failed in mr["failed"]:
+                    st.warning(f"Chunk {failed['label']} failed: {failed['error']}")
+                st.markdown("### Agent Report")
+                st.markdown(mr["summary"])
+                st.download_button("Download Report", mr["summary"], f"traceability_report_{datetime.now().strftime('%Y%m%d')}.md")
+            except Exception as e:
+                st.error(f"Error: {e}")
+        elif run_clicked:
+            with st.spinner(f"Contacting {provider}..."):
+                # Count tokens before dispatch; oversized datasets are compacted to the model's context window
                 try:
+                    full_prompt, estimate = fit_prompt(
+                        lambda c: custom_prompt + "\n\nDATASET:\n" + c["DATASET"],
+                        {"DATASET": json.dumps(data, indent=2)}, selected_model, max_output_tokens=max_tokens)
+                except PromptTooLargeError as e:
+                    st.error(f"Prompt too large: {e}")
+                    st.stop()
+                st.caption(f"Prompt ≈ {estimate.prompt_tokens:,} tokens of {estimate.context_window:,}"
+                           f"{' (dataset compacted)' if estimate.compacted else ''} • "
+                           f"est. cost ${estimate.cost_usd:.4f} • est. latency {estimate.latency_s:.0f}s")
+
+                # Every call goes through the shared fair scheduler: per-key concurrency, token quota and
+                # fair queuing across users, so one heavy run does not starve everyone else on the Space
+                llm = get_hedged_llm(openai_key, gemini_key, xai_key, temperature, max_tokens)
+                tenant = scheduler.tenant_id(openai_key, gemini_key, xai_key)
+
+                def dispatch(prompt):
+                    if hedge:
+                        return llm.generate(prompt, selected_model, hedged=True)
                     if provider == "OpenAI":
                         client = OpenAI(api_key=openai_key)
                         resp = client.chat.completions.create(
                             model=selected_model,
-                            messages=[{"role": "user", "content": full_prompt}],
+                            messages=[{"role": "user", "content": prompt}],
                             max_tokens=max_tokens,
                             temperature=temperature
                         )
-                        result = resp.choices[0].message.content
+                        return resp.choices[0].message.content
                     elif provider == "Google Gemini":
                         genai.configure(api_key=gemini_key)
                         model = genai.GenerativeModel(selected_model)
-                        resp = model.generate_content(full_prompt,
+                        resp = model.generate_content(prompt,
                             generation_config=genai.types.GenerationConfig(max_output_tokens=max_tokens, temperature=temperature))
-                        result = resp.text
+                        return resp.text
                     elif provider == "xAI Grok":
                         resp = requests.post("https://api.x.ai/v1/chat/completions",
                             headers={"Authorization": f"Bearer {xai_key}"},
-                            json={"model": selected_model, "messages": [{"role": "user", "content": full_prompt}],
+                            json={"model": selected_model, "messages": [{"role": "user", "content": prompt}],
                                   "max_tokens": max_tokens, "temperature": temperature})
-                        result = resp.json()['choices'][0]['message']['content'] if resp.ok else resp.text
+                        return resp.json()['choices'][0]['message']['content'] if resp.ok else resp.text
+
+                try:
+                    result = get_scheduler().run(tenant, dispatch, full_prompt, cost=estimate.prompt_tokens + max_tokens,
+                                                 priority=scheduler.INTERACTIVE)
+                    if hedge:
+                        st.caption(f"Hedge: {llm.last_hedge}")
 
                     st.markdown("### Agent Report")
                     st.markdown(result)
@@ -0,0 +1,102 @@
+# benchmarks/cold_start.py - Streamlit 冷啟動（首頁首次繪製）時間基準測試
+# 在全新的 Python process 中以 streamlit.testing.v1.AppTest 實際執行整個 app 腳本一次（上傳檔案前的首頁），
+# 分別計時「lazy_import(...) 延遲的模組先全部匯入」（改版前）與「直接執行」（改版後），
+# 兩者的差就是首次繪製省下的時間。腳本執行失敗（例如 import 時就出錯）會直接報錯，不會產生數字。
+# streamlit 本身不計入：正式環境中 server 啟動時已經匯入。
+#
+#   python benchmarks/cold_start.py                 # app.py 與 Grok_app.py
+#   python benchmarks/cold_start.py app.py -n 9
+
+import argparse
+import ast
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_APPS = ["app.py", "Grok_app.py"]
+sys.path.insert(0, ROOT)
+
+
+def app_imports(path: str) -> Tuple[List[str], List[str]]:
+    """回傳 (頂層 import 的模組, lazy_import 延遲的模組)"""
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    eager, deferred = [], []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            eager.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            eager.append(node.module)
+        elif isinstance(node, ast.Assign) and isinstance(node.value, ast.Call):
+            func = node.value.func
+            if isinstance(func, ast.Name) and func.id == "lazy_import" and node.value.args:
+                deferred.append(node.value.args[0].value)
+    return list(dict.fromkeys(eager)), list(dict.fromkeys(deferred))
+
+
+def available(module: str) -> bool:
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+_RUN_APP = """
+import sys, time
+from streamlit.testing.v1 import AppTest
+t = time.perf_counter()
+{preload}
+at = AppTest.from_file({path!r}, default_timeout=600).run()
+elapsed = time.perf_counter() - t
+if at.exception:
+    sys.exit("app 執行失敗：" + at.exception[0].value)
+print(elapsed)
+"""
+
+
+def time_first_paint(app: str, preload: List[str], runs: int) -> float:
+    """在全新 process 中執行 app 一次到首頁繪製完成的時間（秒，取中位數）；preload 的模組先匯入並計入時間"""
+    code = _RUN_APP.format(preload="".join(f"import {m}\n" for m in preload), path=os.path.join(ROOT, app))
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+        if out.returncode:
+            raise RuntimeError(f"{app}：{out.stderr.strip().splitlines()[-1] if out.stderr.strip() else out.returncode}")
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def benchmark(app: str, runs: int) -> Dict[str, object]:
+    _, deferred = app_imports(os.path.join(ROOT, app))
+    missing = [m for m in deferred if not available(m)]
+    deferred = [m for m in deferred if m not in missing]
+    before = time_first_paint(app, deferred, runs)
+    after = time_first_paint(app, [], runs)
+    return {"app": app, "before_s": before, "after_s": after, "deferred": deferred, "missing": missing}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="冷啟動首頁繪製時間：頂層匯入 vs 延遲匯入")
+    parser.add_argument("apps", nargs="*", default=DEFAULT_APPS)
+    parser.add_argument("-n", "--runs", type=int, default=5, help="每種情境執行次數（取中位數）")
+    args = parser.parse_args()
+    if not available("streamlit"):
+        parser.error("需要安裝 streamlit（以 AppTest 實際執行 app）")
+
+    print(f"{'app':<14}{'eager (before)':>16}{'lazy (after)':>14}{'saved':>10}")
+    for app in args.apps:
+        r = benchmark(app, args.runs)
+        saved = r["before_s"] - r["after_s"]
+        pct = saved / r["before_s"] * 100 if r["before_s"] else 0.0
+        print(f"{r['app']:<14}{r['before_s']:>15.3f}s{r['after_s']:>13.3f}s{saved:>8.3f}s ({pct:.0f}%)")
+        print(f"  deferred: {', '.join(r['deferred']) or '-'}")
+        if r["missing"]:
+            print(f"  not installed (not preloaded in 'before'): {', '.join(r['missing'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""資料模型與本地機器學習模型。"""
@@ -0,0 +1,71 @@
+# models/data_models.py - 批次與分析結果的資料模型（規格 3.1.2）
+# 代理的結構化輸出也定義在這裡：LLM 以 JSON mode 回傳、pydantic 驗證（pydantic-core 為 Rust 實作，驗證只需微秒級），
+# 下游直接讀欄位、以 dict 合併各代理結果，不必再請 LLM 從 Markdown 擷取分數。
+
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class RiskLevel(str, Enum):
+    LOW = "low"
+    MEDIUM = "medium"
+    HIGH = "high"
+    CRITICAL = "critical"
+
+    @classmethod
+    def from_score(cls, score: float) -> "RiskLevel":
+        """與 agents.pipeline.risk_level 相同的分界（4 / 7 / 9）"""
+        return cls.LOW if score < 4 else cls.MEDIUM if score < 7 else cls.HIGH if score < 9 else cls.CRITICAL
+
+
+class Batch(BaseModel):
+    batch_id: str = Field(..., description="批次唯一ID")
+    farm_id: Optional[str] = None
+    farm_name: str
+    laying_date: datetime
+    packing_date: Optional[datetime] = None
+    distribution_date: Optional[datetime] = None
+    quantity: int = Field(gt=0)
+    temperature_records: List[float] = []
+    risk_score: Optional[float] = Field(None, ge=0, le=10)
+    risk_level: Optional[RiskLevel] = None
+    metadata: Dict[str, Any] = {}
+
+
+class AnalysisRequest(BaseModel):
+    dataset: List[Batch]
+    agents_to_run: List[str] = Field(default=["agent_031"])
+    parameters: Dict[str, Any] = {"temperature": 0.2, "max_tokens": 2000}
+
+
+class AnalysisResult(BaseModel):
+    request_id: str
+    timestamp: datetime
+    summary: str
+    risk_assessment: Dict[str, Any]
+    visualizations: List[str]           # 圖表名稱（規格為圖表 URL；本系統的圖表由介面端依規格繪製）
+    recommendations: List[str]
+    agent_outputs: Dict[str, Any]       # 各代理的個別輸出
+
+
+# ==================== 代理結構化輸出 ====================
+class BatchRisk(BaseModel):
+    batch_id: str
+    risk_score: float = Field(..., ge=0, le=10, description="0-10，越高越危險")
+    risk_level: RiskLevel
+    reasons: List[str] = Field(default=[], description="評分依據，需引用數據來源（代理或欄位）")
+
+
+class ReportOutput(BaseModel):
+    """Agent 031 最終報告的結構化輸出"""
+    summary: str = Field(..., description="風險總評，2-4 句繁體中文")
+    risk_score: float = Field(..., ge=0, le=10, description="整體風險分數 0-10")
+    risk_level: RiskLevel
+    highest_risk_batch: Optional[str] = Field(None, description="最高風險批次 ID，無則為 null")
+    high_risk_batches: List[BatchRisk] = Field(default=[], description="需立即檢查的批次（最多 20 個）")
+    key_findings: List[str] = Field(default=[], description="關鍵發現")
+    recommendations: List[str] = Field(default=[], description="建議行動")
+    report_markdown: str = Field(..., description="完整報告（Markdown，依系統提示詞規定的章節格式）")
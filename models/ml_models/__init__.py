@@ -0,0 +1 @@
+"""本地訓練、可持久化的機器學習模型。"""
@@ -0,0 +1,188 @@
+# models/ml_models/anomaly_detector.py - 異常行為學習模型（Agent 029）
+# 以歷史批次特徵學習「正常」基線（每個特徵的平均與標準差），
+# 對新批次做向量化評分並給出各特徵的貢獻度；新資料到來時以合併統計量增量更新，不需重新訓練。
+# 只以評為正常的批次更新基線，同一份資料只學一次，避免異常資料或重複上傳污染所有人的基線。
+# 基線可依租戶或資料集分開存檔（model_path(baseline)）；新資料多出的特徵會加入模型，累積足夠樣本後才參與評分。
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2
+
+DEFAULT_MODEL_PATH = "data/models/anomaly_detector.npz"
+MODEL_DIR = "data/models/anomaly_detector"     # 各租戶 / 資料集的基線
+ANOMALY_THRESHOLD = 0.99      # 異常機率 ≥ 0.99 視為異常批次
+LEARN_MAX_ANOMALY_RATE = 0.05  # 異常批次比例超過 5% 的資料整份不用於更新基線
+MAX_LEARNED = 1000             # 記錄已學過的資料集摘要數量上限
+MIN_BASELINE_COUNT = 2         # 特徵至少要有幾筆歷史值才參與評分（新加入的特徵還沒有基線）
+
+# 各特徵的最小尺度，避免歷史資料幾乎不變時微小差異被放大（單位與特徵相同）
+MIN_SCALE: Dict[str, float] = {"temp_excursion_max": 0.5, "temp_excursion_rate": 0.05}
+DEFAULT_MIN_SCALE = 1e-6
+
+
+def model_path(baseline: Optional[str] = None) -> str:
+    """基線檔路徑：baseline（租戶或資料集 id）各自一份，None 為共用的預設基線"""
+    if baseline is None:
+        return DEFAULT_MODEL_PATH
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in baseline)[:40]
+    digest = hashlib.sha1(baseline.encode("utf-8")).hexdigest()[:8]    # 清理後同名的 id 不共用基線
+    return os.path.join(MODEL_DIR, f"{safe}-{digest}.npz")
+
+
+class AnomalyDetector:
+    """
+    對角高斯基線模型
+
+    score = P(χ²_k ≤ Σ z²)，z 為各特徵的標準化偏差、k 為該列有值的特徵數；
+    attribution = z² / Σ z²，說明哪些特徵造成異常。
+    """
+
+    def __init__(self, features: Optional[List[str]] = None):
+        self._reset(list(features or []))
+
+    def _reset(self, features: List[str]) -> None:
+        self.features = features
+        self.learned: List[str] = []      # 已納入基線的資料集摘要（dataset_digest）
+        self.count = np.zeros(len(features))
+        self.mean = np.zeros(len(features))
+        self.m2 = np.zeros(len(features))
+
+    def _extend(self, features: List[str]) -> None:
+        """加入新特徵（尚無歷史值）；既有特徵的基線不變"""
+        self.features = self.features + features
+        pad = np.zeros(len(features))
+        self.count = np.concatenate([self.count, pad])
+        self.mean = np.concatenate([self.mean, pad])
+        self.m2 = np.concatenate([self.m2, pad])
+
+    # ---------- 訓練 ----------
+    def fit(self, X: pd.DataFrame) -> "AnomalyDetector":
+        self._reset(list(X.select_dtypes(include="number").columns))
+        return self.partial_fit(X)
+
+    def partial_fit(self, X: pd.DataFrame) -> "AnomalyDetector":
+        """以新資料更新平均與變異數（Chan 合併公式），缺值不計入"""
+        values = self._matrix(X)
+        n_b = (~np.isnan(values)).sum(0).astype(float)
+        mean_b = np.where(n_b > 0, np.nansum(values, 0) / np.maximum(n_b, 1), 0.0)
+        m2_b = np.nansum((values - mean_b) ** 2, 0)
+        n = self.count + n_b
+        delta = mean_b - self.mean
+        safe_n = np.maximum(n, 1)
+        self.m2 = self.m2 + m2_b + delta ** 2 * self.count * n_b / safe_n
+        self.mean = self.mean + delta * n_b / safe_n
+        self.count = n
+        return self
+
+    def learn(self, X: pd.DataFrame, scored: pd.DataFrame, digest: str) -> bool:
+        """
+        以評分結果為閘門更新基線：只納入 is_anomaly 為 False 的批次；
+        已學過的資料集（相同 digest）或異常比例超過 LEARN_MAX_ANOMALY_RATE 的資料不更新；
+        X 有模型沒有的數值特徵時先加入模型，之後的資料才能以它評分
+
+        Returns:
+            是否有更新（False 時不需要存檔）
+        """
+        anomalous = scored["is_anomaly"].to_numpy(dtype=bool)
+        if digest in self.learned or not len(X) or anomalous.mean() > LEARN_MAX_ANOMALY_RATE:
+            return False
+        clean = X[~anomalous]
+        new = [c for c in clean.select_dtypes(include="number").columns if c not in self.features]
+        if clean.empty or not (self.features or new):
+            return False
+        self._extend(new)
+        self.partial_fit(clean)
+        self.learned = (self.learned + [digest])[-MAX_LEARNED:]
+        return True
+
+    @staticmethod
+    def dataset_digest(X: pd.DataFrame) -> str:
+        """特徵表內容（含批次索引）的摘要，用來辨識重複上傳的資料"""
+        hashed = pd.util.hash_pandas_object(X, index=True).to_numpy()
+        return hashlib.sha256(hashed.tobytes() + json.dumps(list(map(str, X.columns))).encode()).hexdigest()[:16]
+
+    # ---------- 評分 ----------
+    def trained(self) -> np.ndarray:
+        """各特徵是否已有足夠的歷史值"""
+        return self.count >= MIN_BASELINE_COUNT
+
+    def covers(self, X: pd.DataFrame) -> bool:
+        """X 是否至少有一個已建立基線的特徵（沒有時無法以此模型評分）"""
+        return any(f in X.columns for f, ok in zip(self.features, self.trained()) if ok)
+
+    @property
+    def scale(self) -> np.ndarray:
+        std = np.sqrt(self.m2 / np.maximum(self.count - 1, 1))
+        floor = np.array([MIN_SCALE.get(f, DEFAULT_MIN_SCALE) for f in self.features])
+        return np.maximum(std, floor)
+
+    def _matrix(self, X: pd.DataFrame) -> np.ndarray:
+        return X.reindex(columns=self.features).to_numpy(dtype=np.float64)
+
+    def zscores(self, X: pd.DataFrame) -> np.ndarray:
+        return (self._matrix(X) - self.mean) / self.scale
+
+    def score(self, X: pd.DataFrame) -> pd.DataFrame:
+        """
+        向量化評分
+
+        Returns:
+            與 X 同索引的 DataFrame：anomaly_score（0-1）、is_anomaly、top_feature
+        """
+        if not self.trained().any():
+            raise ValueError("模型尚未訓練")
+        z2 = np.square(self.zscores(X))
+        present = ~np.isnan(z2) & self.trained()
+        z2 = np.where(present, z2, 0.0)
+        total = z2.sum(1)
+        dof = present.sum(1)
+        scores = np.where(dof > 0, chi2.cdf(total, np.maximum(dof, 1)), 0.0)
+        top = np.array(self.features, dtype=object)[z2.argmax(1)]
+        return pd.DataFrame({
+            "anomaly_score": scores,
+            "is_anomaly": scores >= ANOMALY_THRESHOLD,
+            "top_feature": np.where(total > 0, top, None),
+        }, index=X.index)
+
+    def attributions(self, X: pd.DataFrame) -> pd.DataFrame:
+        """各特徵對異常分數的貢獻比例（每列加總為 1）"""
+        z2 = np.where(self.trained(), np.nan_to_num(np.square(self.zscores(X))), 0.0)
+        total = z2.sum(1, keepdims=True)
+        return pd.DataFrame(np.divide(z2, total, out=np.zeros_like(z2), where=total > 0),
+                            index=X.index, columns=self.features)
+
+    # ---------- 持久化 ----------
+    def save(self, path: str = DEFAULT_MODEL_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # 先寫暫存檔再替換，多個 worker 同時讀取時不會讀到寫到一半的檔案
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, count=self.count, mean=self.mean, m2=self.m2,
+                     features=np.array(json.dumps(self.features, ensure_ascii=False)),
+                     learned=np.array(json.dumps(self.learned)))
+        os.replace(tmp, path)
+
+    @staticmethod
+    def version(path: str = DEFAULT_MODEL_PATH) -> str:
+        """已存檔模型的內容摘要（沒有模型時為 "untrained"）；評分結果依賴基線，作為快取鍵的一部分"""
+        if not os.path.exists(path):
+            return "untrained"
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()[:12]
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH) -> Optional["AnomalyDetector"]:
+        """讀取已存檔的模型，檔案不存在時回傳 None"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            model = cls(json.loads(str(data["features"])))
+            model.count, model.mean, model.m2 = data["count"], data["mean"], data["m2"]
+            if "learned" in data.files:
+                model.learned = json.loads(str(data["learned"]))
+        return model
@@ -0,0 +1 @@
+"""本地運算服務：讓代理在本機執行可精確計算的部分，只把精簡結果交給 LLM。"""
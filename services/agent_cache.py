@@ -0,0 +1,189 @@
+# services/agent_cache.py - 代理輸出記憶化（依輸入欄位指紋快取）
+# 每個代理宣告自己讀取的欄位（local_compute.AGENT_INPUTS），輸出以「這些欄位內容的指紋」為鍵存在 SQLite。
+# 重新上傳時只改了無關欄位（例如 retailer），溫度、統計等代理的鍵不變，直接沿用上次的輸出；
+# 報告代理（LLM）以送出的提示詞為鍵，上游輸出都沒變時也不再重複呼叫 LLM。
+#
+#   cache = AgentCache()
+#   fingerprints = ColumnFingerprints(df)
+#   key = fingerprints.key(resolve_inputs(df, AGENT_INPUTS["agent_011"]), code_version(root_cause_breakdown))
+#   output = cache.get("agent_011", key)     # None 表示輸入有變動，重算後 cache.put("agent_011", key, output)
+
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+from utils.features import ENTITY_COLUMNS, STAGE_DATE_COLUMNS, find_quantity_column, find_temp_column
+from utils.hashing import hash_values
+
+DEFAULT_CACHE_PATH = "data/models/agent_cache.db"
+MAX_ENTRIES_PER_AGENT = 4096  # 每個代理保留最近使用的輸出筆數（map-reduce 每個區塊各佔一筆）
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    agent_id   TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    output     TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    used_at    REAL NOT NULL,
+    PRIMARY KEY (agent_id, key)
+);
+"""
+
+# ==================== 輸入宣告 ====================
+# 宣告中的 "@xxx" 是依資料內容決定的欄位群組，其餘為欄名（資料中沒有的欄位略過）
+_COLUMN_GROUPS: Dict[str, Callable[[pd.DataFrame], List[str]]] = {
+    "*": lambda df: list(df.columns),
+    "@numeric": lambda df: list(df.select_dtypes(include="number").columns),
+    "@temperature": lambda df: [c for c in [find_temp_column(df)] if c],
+    "@quantity": lambda df: [c for c in [find_quantity_column(df)] if c],
+    "@stage_dates": lambda df: [c for c in STAGE_DATE_COLUMNS if c in df.columns],
+    "@entities": lambda df: [c for c in ENTITY_COLUMNS if c in df.columns],
+}
+
+
+def resolve_inputs(df: pd.DataFrame, spec: Iterable[str]) -> List[str]:
+    """把代理的輸入宣告展開成資料中實際存在的欄位（保持順序、去除重複）"""
+    columns: List[str] = []
+    for item in spec:
+        columns.extend(_COLUMN_GROUPS[item](df) if item in _COLUMN_GROUPS else [item] if item in df.columns else [])
+    return list(dict.fromkeys(columns))
+
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@lru_cache(maxsize=None)
+def _module_digest(module: str) -> str:
+    path = getattr(sys.modules.get(module), "__file__", None)
+    if not path or not os.path.exists(path):
+        return module
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def _project_module(obj: Any) -> Optional[str]:
+    """物件（模組、函式、類別）屬於本專案原始碼時回傳其模組名稱，第三方套件與內建回傳 None"""
+    name = obj.__name__ if inspect.ismodule(obj) else getattr(obj, "__module__", None)
+    if not isinstance(name, str) or not (inspect.ismodule(obj) or inspect.isfunction(obj) or inspect.isclass(obj)):
+        return None
+    path = getattr(sys.modules.get(name), "__file__", None)
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    return name if path.startswith(_ROOT + os.sep) and "site-packages" not in path else None
+
+
+@lru_cache(maxsize=None)
+def _module_closure(module: str) -> frozenset:
+    """模組本身加上它（遞迴）匯入的本專案模組（含以 from ... import 匯入的函式、類別所在模組）"""
+    seen = {module}
+    stack = [module]
+    while stack:
+        for value in vars(sys.modules[stack.pop()]).values():
+            dep = _project_module(value)
+            if dep and dep not in seen:
+                seen.add(dep)
+                stack.append(dep)
+    return frozenset(seen)
+
+
+def code_version(*funcs: Callable) -> str:
+    """
+    代理實作（函式或類別）所在模組及其匯入的所有本專案模組的原始碼指紋；
+    代理本身或它用到的模組（例如 forecasting、utils.features）修改後舊的快取自然失效。
+    以模組為單位（同模組的常數、輔助函式都涵蓋在內），寧可多失效也不沿用過期的輸出。
+    """
+    modules = sorted(set().union(*(_module_closure(f.__module__) for f in funcs)))
+    digest = hashlib.sha1(",".join(f"{m}@{_module_digest(m)}" for m in modules).encode("utf-8")).hexdigest()[:12]
+    return ",".join(f"{f.__module__}.{f.__qualname__}" for f in funcs) + f"@{digest}"
+
+
+class ColumnFingerprints:
+    """逐欄計算內容指紋（欄名、型別與值，不含 index），同一次執行中每欄只雜湊一次"""
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._digests: Dict[str, str] = {}
+
+    def column(self, col: str) -> str:
+        if col not in self._digests:
+            s = self.df[col]
+            h = hashlib.sha1(f"{col}|{s.dtype}|{len(s)}".encode("utf-8"))
+            h.update(hash_values(s).tobytes())
+            self._digests[col] = h.hexdigest()
+        return self._digests[col]
+
+    def key(self, columns: Iterable[str], *extra: Any) -> str:
+        """欄位指紋 + 額外依賴（程式版本、上游輸出的鍵等）組成的快取鍵"""
+        h = hashlib.sha256()
+        for col in columns:
+            h.update(f"{col}={self.column(col)};".encode("utf-8"))
+        for item in extra:
+            h.update(json.dumps(item, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+        return h.hexdigest()
+
+
+def text_key(*parts: Any) -> str:
+    """非表格輸入（例如報告提示詞 + 模型）的快取鍵"""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+# ==================== 快取存放 ====================
+class AgentCache:
+    """
+    代理輸出的 SQLite 快取；只保存路徑，可 pickle 給 process pool 的 worker 使用
+
+    output 一律可 json.dumps；每個代理只保留最近使用的 MAX_ENTRIES_PER_AGENT 筆。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = MAX_ENTRIES_PER_AGENT):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get(self, agent_id: str, key: str) -> Optional[Any]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT output FROM outputs WHERE agent_id = ? AND key = ?",
+                               (agent_id, key)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE outputs SET used_at = ? WHERE agent_id = ? AND key = ?",
+                         (time.time(), agent_id, key))
+        return json.loads(row[0])
+
+    def put(self, agent_id: str, key: str, output: Any) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO outputs (agent_id, key, output, created_at, used_at) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         (agent_id, key, json.dumps(output, ensure_ascii=False, default=str), now, now))
+            conn.execute("DELETE FROM outputs WHERE agent_id = ? AND key NOT IN "
+                         "(SELECT key FROM outputs WHERE agent_id = ? ORDER BY used_at DESC LIMIT ?)",
+                         (agent_id, agent_id, self.max_entries))
+
+    def clear(self, agent_id: Optional[str] = None) -> int:
+        with self._connect() as conn:
+            if agent_id:
+                return conn.execute("DELETE FROM outputs WHERE agent_id = ?", (agent_id,)).rowcount
+            return conn.execute("DELETE FROM outputs").rowcount
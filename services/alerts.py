@@ -0,0 +1,353 @@
+# services/alerts.py - 告警去重與限流通知（agents5.yaml 的 monitoring.alerts 與 alert_notification 範本）
+# 感測器每筆讀數都可能觸發規則，若逐筆通知，感測器異常時值班人員會被洗版。這裡分三層收斂：
+#   1. 分組：同一批次、同一規則、同一時間視窗（預設 1 小時）的事件視為同一告警
+#   2. 去重：分組鍵放進 TTL 快取，TTL 內重複出現只累計「已抑制」筆數
+#   3. 批次通知：待送告警依（規則、嚴重度）合併成一則通知，定期 flush；token bucket 限制每分鐘通知數，
+#      額度用完時留在待送區繼續合併，下次 flush 再送
+# 不論事件量多大，每次 flush 最多送出「規則數 × 嚴重度數」則通知，記憶體也只保留有上限的分組鍵。
+#
+#   dispatcher = AlertDispatcher(NdjsonSink("data/stream/alerts.ndjson")).start()
+#   monitor = Monitor(on_event=dispatcher.submit)
+#
+# 通知格式（output_formats.templates.alert_notification）：
+#   {"timestamp": "...", "severity": "critical", "message": "...", "affected_batches": ["B001", ...]}
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+GROUP_WINDOW_SECONDS = 3600     # 同一批次同一規則在此視窗內視為同一告警
+DEDUP_TTL_SECONDS = 4 * 3600    # 已通知的分組鍵保留時間
+MAX_DEDUP_KEYS = 100_000        # TTL 快取上限，超過時淘汰最舊的鍵
+FLUSH_INTERVAL = 30.0           # 待送告警的合併時間（秒）
+MAX_NOTIFICATIONS_PER_MINUTE = 6
+MAX_AFFECTED_BATCHES = 50       # 單則通知列出的批次上限；超過的只計數（總數另外註明）
+ALERT_RULES_PATH = "agents5.yaml"
+
+# Monitor 的燈號 → 通知範本的 severity
+SEVERITY = {"red": "critical", "yellow": "warning", "green": "info"}
+_SEVERITY_RANK = {"info": 0, "warning": 1, "critical": 2}
+
+RULE_TITLES = {
+    "cold_chain_break": "冷鏈中斷（超出 2-8°C 持續 2 小時）",
+    "temperature_range": "溫度超出 2-8°C",
+    "temperature_spike": "溫度突變（3σ）",
+    "packing_delay": "產蛋到包裝超過 24 小時",
+    "stage_order": "階段時間倒退",
+    "recovered": "溫度恢復正常",
+}
+
+Sink = Callable[[List[Dict[str, Any]]], None]
+
+
+# ==================== 通知輸出 ====================
+class NdjsonSink:
+    """把通知附加到本地 NDJSON 檔（webhook 的本地替代，也方便事後稽核）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def __call__(self, notifications: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for n in notifications:
+                f.write(json.dumps(n, ensure_ascii=False) + "\n")
+
+
+class WebhookSink:
+    """以 JSON 陣列 POST 到 webhook（例如 python -m services.alerts serve 啟動的本地接收端）"""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, notifications: List[Dict[str, Any]]) -> None:
+        body = json.dumps(notifications, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+# ==================== 去重與限流 ====================
+class TTLCache:
+    """有容量上限的 TTL 集合；時間由呼叫端提供（事件時間），重播歷史事件時結果一致"""
+
+    def __init__(self, ttl: float = DEDUP_TTL_SECONDS, max_keys: int = MAX_DEDUP_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._expiry: "OrderedDict[Any, float]" = OrderedDict()
+
+    def seen(self, key: Any, now: float) -> bool:
+        """key 在 TTL 內出現過回傳 True；否則記錄並回傳 False"""
+        expiry = self._expiry.get(key)
+        if expiry is not None and expiry > now:
+            return True
+        self._expiry[key] = now + self.ttl
+        self._expiry.move_to_end(key)
+        while len(self._expiry) > self.max_keys:
+            self._expiry.popitem(last=False)
+        return False
+
+    def prune(self, now: float) -> None:
+        for key in [k for k, expiry in self._expiry.items() if expiry <= now]:
+            del self._expiry[key]
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float = MAX_NOTIFICATIONS_PER_MINUTE, burst: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class AlertDispatcher:
+    """
+    規則事件 → 分組去重 → 合併通知；submit 可直接作為 Monitor 的 on_event
+
+    min_severity 以下的事件（預設 info，即溫度恢復）不通知。sink 失敗時告警留在待送區，下次 flush 重試。
+    """
+
+    def __init__(self, sink: Sink, flush_interval: float = FLUSH_INTERVAL,
+                 group_window: float = GROUP_WINDOW_SECONDS, dedup_ttl: float = DEDUP_TTL_SECONDS,
+                 per_minute: float = MAX_NOTIFICATIONS_PER_MINUTE, min_severity: str = "warning"):
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.group_window = group_window
+        self.min_severity = min_severity
+        self.dedup = TTLCache(dedup_ttl)
+        self.bucket = TokenBucket(per_minute)
+        self.pending: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.stats = {"received": 0, "suppressed": 0, "notifications": 0, "failed": 0}
+        self.last_error: Optional[str] = None
+        self.sent: List[Dict[str, Any]] = []       # 最近送出的通知（介面顯示用）
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, event: Any) -> None:
+        """接受 monitoring.RuleEvent 或同欄位的 dict"""
+        e = event.to_dict() if hasattr(event, "to_dict") else event
+        severity = SEVERITY.get(e["severity"], e["severity"])
+        with self._lock:
+            self.stats["received"] += 1
+            if _SEVERITY_RANK[severity] < _SEVERITY_RANK[self.min_severity]:
+                return
+            ts = float(e["ts"])
+            if self.dedup.seen((e["rule"], e["batch_id"], int(ts // self.group_window)), ts):
+                self.stats["suppressed"] += 1
+                group = self.pending.get((e["rule"], severity))
+                if group is not None:
+                    group["duplicates"] += 1
+                return
+            group = self.pending.get((e["rule"], severity))
+            if group is None:
+                group = self.pending[(e["rule"], severity)] = {
+                    "rule": e["rule"], "severity": severity, "batches": {}, "overflow": 0, "duplicates": 0,
+                    "first_ts": ts, "last_ts": ts, "example": e["message"]}
+            _add_batch(group, e["batch_id"], e["message"])
+            group["last_ts"] = max(group["last_ts"], ts)
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """把待送告警合併成通知送出；限流額度不足的分組留到下次（繼續合併新事件）"""
+        with self._lock:
+            groups = sorted(self.pending.values(), key=lambda g: -_SEVERITY_RANK[g["severity"]])
+            ready = []
+            for group in groups:
+                if not self.bucket.take():
+                    break
+                ready.append(group)
+                del self.pending[(group["rule"], group["severity"])]
+            self.dedup.prune(max((g["last_ts"] for g in ready), default=0.0))
+        if not ready:
+            return []
+        notifications = [self._notification(g) for g in ready]
+        try:
+            self.sink(notifications)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            with self._lock:
+                self.stats["failed"] += len(notifications)
+                for group in ready:
+                    self._requeue(group)
+            return []
+        with self._lock:
+            self.stats["notifications"] += len(notifications)
+            self.sent = (notifications + self.sent)[:20]
+        return notifications
+
+    def _requeue(self, group: Dict[str, Any]) -> None:
+        key = (group["rule"], group["severity"])
+        current = self.pending.get(key)
+        if current is None:
+            self.pending[key] = group
+            return
+        for batch_id, message in group["batches"].items():
+            _add_batch(current, batch_id, message)
+        current["overflow"] += group["overflow"]
+        current["duplicates"] += group["duplicates"]
+        current["first_ts"] = min(current["first_ts"], group["first_ts"])
+
+    @staticmethod
+    def _notification(group: Dict[str, Any]) -> Dict[str, Any]:
+        batches = sorted(group["batches"])
+        total = len(batches) + group["overflow"]
+        title = RULE_TITLES.get(group["rule"], group["rule"])
+        if total == 1:
+            message = f"{title}：{batches[0]} {group['batches'][batches[0]]}"
+        else:
+            message = f"{title}：{total} 個批次（例：{group['example']}）"
+        if group["duplicates"]:
+            message += f"；另有 {group['duplicates']} 筆重複告警已合併"
+        if group["overflow"]:
+            message += f"；僅列出前 {len(batches)} 個批次"
+        return {
+            "timestamp": datetime.fromtimestamp(group["last_ts"]).isoformat(timespec="seconds"),
+            "severity": group["severity"],
+            "message": message,
+            "affected_batches": batches,
+            "rule": group["rule"],
+            "total_batches": total,
+        }
+
+    # ---------- 背景 flush ----------
+    def start(self) -> "AlertDispatcher":
+        self._thread = threading.Thread(target=self._loop, name="alert-dispatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+def _add_batch(group: Dict[str, Any], batch_id: str, message: str) -> None:
+    """分組只保留前 MAX_AFFECTED_BATCHES 個批次；限流或 sink 故障時待送區才不會隨事件量無限成長"""
+    if batch_id in group["batches"]:
+        return
+    if len(group["batches"]) < MAX_AFFECTED_BATCHES:
+        group["batches"][batch_id] = message
+    else:
+        group["overflow"] += 1
+
+
+# ==================== monitoring.alerts（系統效能告警） ====================
+_CONDITION = re.compile(r"^\s*(\w+)\s*(>=|<=|>|<)\s*([\d.]+)\s*(s|%)?\s*$")
+
+
+def load_alert_rules(path: str = ALERT_RULES_PATH) -> List[Dict[str, Any]]:
+    """讀取 agents5.yaml 的 monitoring.alerts，例如 {"condition": "execution_time > 30s", "action": ...}"""
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    return (config.get("monitoring") or {}).get("alerts") or []
+
+
+def pipeline_metrics(results: Dict[str, Any]) -> Dict[str, float]:
+    """由 run_all_agents 的結果取出規則會用到的指標（本地代理的執行時間與失敗率）"""
+    runs = list((results.get("local_analysis") or {}).values())
+    if not runs:
+        return {}
+    return {
+        "execution_time": max(r.get("elapsed_s", 0.0) for r in runs),
+        "error_rate": sum(r.get("status") != "ok" for r in runs) / len(runs),
+    }
+
+
+def evaluate_metrics(metrics: Dict[str, float], rules: Optional[List[Dict[str, Any]]] = None,
+                     batches: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """依 monitoring.alerts 的條件檢查指標，回傳 alert_notification 格式的通知（附 action）"""
+    rules = load_alert_rules() if rules is None else rules
+    notifications = []
+    for rule in rules:
+        m = _CONDITION.match(str(rule.get("condition", "")))
+        if not m or m.group(1) not in metrics:
+            continue
+        name, op, threshold, unit = m.groups()
+        limit = float(threshold) / 100 if unit == "%" else float(threshold)
+        value = metrics[name]
+        if {">": value > limit, ">=": value >= limit, "<": value < limit, "<=": value <= limit}[op]:
+            shown = f"{value:.1%}" if unit == "%" else f"{value:.1f}{unit or ''}"
+            notifications.append({
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "severity": "warning",
+                "message": f"{rule['condition']}（目前 {shown}）",
+                "affected_batches": list(batches or []),
+                "action": rule.get("action"),
+            })
+    return notifications
+
+
+# ==================== 本地 webhook 接收端 ====================
+def serve_webhook(port: int = 8765, path: Optional[str] = None) -> None:
+    """webhook 的本地替代：接收 POST 的通知並印出（可選擇另存 NDJSON）"""
+    sink = NdjsonSink(path) if path else None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            notifications = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"[]")
+            for n in notifications:
+                print(f"[{n['severity'].upper():<8}] {n['timestamp']} {n['message']}", flush=True)
+            if sink is not None:
+                sink(notifications)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    print(f"webhook 接收端：http://127.0.0.1:{port}/（Ctrl+C 結束）")
+    try:
+        ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def make_sink(target: str) -> Sink:
+    """http(s):// 開頭為 webhook，其餘視為 NDJSON 檔案路徑"""
+    return WebhookSink(target) if target.startswith(("http://", "https://")) else NdjsonSink(target)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="告警通知工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="啟動本地 webhook 接收端")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--save", help="另存收到的通知（NDJSON）")
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        serve_webhook(args.port, args.save)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# services/association_rules.py - 關聯規則挖掘（Agent 010）
+# 批次屬性（農場、包裝廠、季節、溫度異常、延遲…）one-hot 後壓成 bitset，
+# 相同的交易合併計數，再以 FP-Growth 挖掘頻繁項目集，產生具精確支持度/信心度/提升度的規則。
+
+from collections import defaultdict
+from itertools import combinations
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.features import ENTITY_COLUMNS, find_temp_column, stage_delays
+
+MIN_SUPPORT = 0.02
+MIN_CONFIDENCE = 0.7          # agent_010：強關聯規則（信心度>0.7）
+MAX_ITEMSET_SIZE = 4
+MAX_RULES = 50
+REGULATORY_DELAY_H = {"laying_date→packing_date": 24.0}   # 產蛋到包裝不得超過 24 小時
+DELAY_QUANTILE = 0.9          # 其他階段以 P90 為延遲門檻
+
+SEASONS = {12: "冬", 1: "冬", 2: "冬", 3: "春", 4: "春", 5: "春",
+           6: "夏", 7: "夏", 8: "夏", 9: "秋", 10: "秋", 11: "秋"}
+
+
+# ==================== 交易編碼 ====================
+def batch_items(df: pd.DataFrame) -> pd.DataFrame:
+    """把每個批次轉成 one-hot 布林表，欄名即項目名稱（例：farm_name=快樂農場、溫度異常）"""
+    items = {}
+    for col in [c for c in ENTITY_COLUMNS if c in df.columns and c != "retailer"]:
+        for value, mask in pd.get_dummies(df[col].astype("string"), dtype=bool).items():
+            items[f"{col}={value}"] = mask.to_numpy()
+    if "laying_date" in df.columns:
+        season = pd.to_datetime(df["laying_date"], errors="coerce").dt.month.map(SEASONS)
+        for value, mask in pd.get_dummies(season, dtype=bool).items():
+            items[f"季節={value}"] = mask.to_numpy()
+    temp_col = find_temp_column(df)
+    if "temperature_violation" in df.columns:
+        items["溫度異常"] = df["temperature_violation"].fillna(False).astype(bool).to_numpy()
+    elif temp_col:
+        items["溫度異常"] = ((df[temp_col] > 8) | (df[temp_col] < 2)).to_numpy()
+    delays = stage_delays(df)
+    for col in delays.columns:
+        threshold = REGULATORY_DELAY_H.get(col, delays[col].quantile(DELAY_QUANTILE))
+        if pd.notna(threshold):
+            items[f"延遲:{col}"] = (delays[col] > threshold).to_numpy()
+    return pd.DataFrame(items, index=df.index)
+
+
+def encode_transactions(one_hot: pd.DataFrame, min_count: int) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    只保留達最小支持度的項目，每列編成 uint64 bitset，並合併相同交易
+
+    Returns:
+        (項目名稱（依頻率遞減）, 唯一 bitset 陣列 (m, words), 每個唯一交易的筆數)
+    """
+    counts = one_hot.sum(axis=0)
+    frequent = counts[counts >= min_count].sort_values(ascending=False, kind="stable")
+    names = list(frequent.index)
+    words = max(1, -(-len(names) // 64))
+    bits = np.zeros((len(one_hot), words), dtype=np.uint64)
+    for j, name in enumerate(names):
+        bits[:, j // 64] |= one_hot[name].to_numpy(dtype=np.uint64) << np.uint64(j % 64)
+    unique, weights = np.unique(bits, axis=0, return_counts=True)
+    return names, unique, weights
+
+
+def _decode(row: np.ndarray, n_items: int) -> List[int]:
+    return [j for j in range(n_items) if (int(row[j // 64]) >> (j % 64)) & 1]
+
+
+# ==================== FP-Growth ====================
+class _FPNode:
+    __slots__ = ("item", "count", "parent", "children")
+
+    def __init__(self, item: Optional[int], parent: Optional["_FPNode"]):
+        self.item = item
+        self.count = 0
+        self.parent = parent
+        self.children: Dict[int, "_FPNode"] = {}
+
+
+def _build_tree(transactions: Iterable[Tuple[List[int], int]]) -> Dict[int, List[_FPNode]]:
+    """transactions 內的項目須已依全域頻率排序；回傳 header table（項目 → 節點列表）"""
+    root = _FPNode(None, None)
+    header: Dict[int, List[_FPNode]] = defaultdict(list)
+    for items, weight in transactions:
+        node = root
+        for item in items:
+            child = node.children.get(item)
+            if child is None:
+                child = node.children[item] = _FPNode(item, node)
+                header[item].append(child)
+            child.count += weight
+            node = child
+    return header
+
+
+def _fp_growth(header: Dict[int, List[_FPNode]], min_count: int, suffix: Tuple[int, ...],
+               max_size: int, out: Dict[FrozenSet[int], int]) -> None:
+    # 項目編號越大頻率越低，由低頻項目開始挖掘條件樹
+    for item in sorted(header, reverse=True):
+        support = sum(node.count for node in header[item])
+        if support < min_count:
+            continue
+        itemset = suffix + (item,)
+        out[frozenset(itemset)] = support
+        if len(itemset) >= max_size:
+            continue
+        base = []
+        for node in header[item]:
+            path, parent = [], node.parent
+            while parent is not None and parent.item is not None:
+                path.append(parent.item)
+                parent = parent.parent
+            if path:
+                base.append((path[::-1], node.count))
+        if not base:
+            continue
+        local = defaultdict(int)
+        for path, count in base:
+            for i in path:
+                local[i] += count
+        keep = {i for i, c in local.items() if c >= min_count}
+        conditional = [([i for i in path if i in keep], count) for path, count in base]
+        sub_header = _build_tree((p, c) for p, c in conditional if p)
+        if sub_header:
+            _fp_growth(sub_header, min_count, itemset, max_size, out)
+
+
+def frequent_itemsets(names: List[str], unique: np.ndarray, weights: np.ndarray,
+                      min_count: int, max_size: int = MAX_ITEMSET_SIZE) -> Dict[FrozenSet[int], int]:
+    transactions = [(_decode(row, len(names)), int(w)) for row, w in zip(unique, weights)]
+    header = _build_tree((t, w) for t, w in transactions if t)
+    out: Dict[FrozenSet[int], int] = {}
+    _fp_growth(header, min_count, (), max_size, out)
+    return out
+
+
+def generate_rules(itemsets: Dict[FrozenSet[int], int], n: int,
+                   min_confidence: float) -> List[Dict[str, Any]]:
+    rules = []
+    for itemset, count in itemsets.items():
+        if len(itemset) < 2:
+            continue
+        for size in range(1, len(itemset)):
+            for antecedent in map(frozenset, combinations(itemset, size)):
+                consequent = itemset - antecedent
+                confidence = count / itemsets[antecedent]
+                if confidence < min_confidence:
+                    continue
+                rules.append({
+                    "antecedent": antecedent, "consequent": consequent, "count": count,
+                    "support": count / n, "confidence": confidence,
+                    "lift": confidence / (itemsets[consequent] / n),
+                })
+    rules.sort(key=lambda r: (r["lift"], r["confidence"], r["support"]), reverse=True)
+    return rules
+
+
+def mine_batch_rules(df: pd.DataFrame, min_support: float = MIN_SUPPORT,
+                     min_confidence: float = MIN_CONFIDENCE, max_size: int = MAX_ITEMSET_SIZE,
+                     max_rules: int = MAX_RULES) -> Dict[str, Any]:
+    """Agent 010：對批次資料挖掘關聯規則，回傳前 max_rules 條（依提升度排序）"""
+    n = len(df)
+    if n == 0:
+        return {"transactions": 0, "rules": []}
+    one_hot = batch_items(df)
+    min_count = max(1, int(np.ceil(min_support * n)))
+    names, unique, weights = encode_transactions(one_hot, min_count)
+    itemsets = frequent_itemsets(names, unique, weights, min_count, max_size)
+    rules = [r for r in generate_rules(itemsets, n, min_confidence) if r["lift"] > 1.0][:max_rules]
+    for rule in rules:
+        rule["antecedent"] = sorted(names[i] for i in rule["antecedent"])
+        rule["consequent"] = sorted(names[i] for i in rule["consequent"])
+    return {
+        "transactions": n,
+        "distinct_transactions": len(unique),
+        "frequent_items": len(names),
+        "frequent_itemsets": len(itemsets),
+        "min_support": min_support,
+        "min_confidence": min_confidence,
+        "rules": rules,
+    }
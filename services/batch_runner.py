@@ -0,0 +1,444 @@
+# services/batch_runner.py - 完整審計（usage_examples.full_audit）的離線批次模式
+# 每月 / 每晚的完整審計不需要即時回應：所有資料集的代理請求打包成供應商批次檔（OpenAI Batch API JSONL），
+# 以批次價格送出，不佔用互動式介面的速率限制。流程分兩階段：
+#   1. 本地代理（001-002、005-013）在本機計算；其餘 LLM 代理每個資料集一筆請求，一起送出
+#   2. 階段 1 完成後，每個資料集再送一筆 Agent 031 彙整報告（上下文為階段 1 的全部輸出）
+# 進度寫在 manifest.json，中斷後重新執行會接續輪詢已送出的批次，不會重複送出。
+
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from agents.pipeline import clean_dataset, load_datasets, safe_name
+from services.local_compute import run_local_agents
+from utils.prompt_engine import PromptEngine, get_prompt_engine, render_value
+from utils.serialization import to_jsonable
+from utils.token_budget import PromptTooLargeError, fit_prompt
+
+DEFAULT_WORKDIR = "data/batches"
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+BATCH_DISCOUNT = 0.5                 # 批次價格為即時價格的一半
+MAX_REQUESTS_PER_FILE = 50_000       # OpenAI 單一批次檔上限
+MAX_BYTES_PER_FILE = 190 * 1024 ** 2  # 上限 200 MB，保留餘裕
+POLL_INTERVAL_S = 30.0
+MAX_POLL_INTERVAL_S = 600.0
+PREPARE_POOL_MIN = 8                 # 資料集數量達此值才用 process pool 前處理
+TERMINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+# 本地計算的代理（輸出直接放入報告，不送 LLM）與需要使用者輸入、不適合批次的互動式代理
+LOCAL_AUDIT_AGENTS = {"agent_001", "agent_002", "agent_005", "agent_006", "agent_007", "agent_008",
+                      "agent_009", "agent_010", "agent_011", "agent_012", "agent_013"}
+INTERACTIVE_AGENTS = {"agent_027"}
+REPORT_AGENT = "agent_031"
+SEPARATOR = "::"                     # custom_id = 資料集 id + SEPARATOR + 代理 id
+
+REPORT_QUERY = "請根據以上各代理的輸出，為此資料集生成完整的審計與合規性檢查報告（繁體中文）。"
+
+
+# ==================== 前處理（本地代理） ====================
+def prepare_dataset(item: Tuple[str, pd.DataFrame]) -> Tuple[str, Dict[str, Any]]:
+    """
+    單一資料集的本地審計：結構概況、實體合併、完整性驗證、統計分析
+
+    Returns:
+        (dataset_id, {"summary", "local": {agent_id: output}})，皆可直接 json.dumps
+    """
+    dataset_id, df = item
+    df = df.copy()
+    cleaning = clean_dataset(df)
+    validation = cleaning["validation"]
+    local: Dict[str, Any] = {
+        "agent_001": cleaning["profile"],
+        "agent_002": cleaning["profile"],
+        "agent_005": cleaning["entity_merges"],
+        "agent_006": {"passed": validation["passed"],
+                      "violated": [r for r in validation["rules"] if r["status"] == "violated"]},
+    }
+    for agent_id, result in run_local_agents(df, max_workers=1).items():
+        local[agent_id] = result["output"]
+
+    temp_col = cleaning["temp_column"]
+    summary = {
+        "資料集": dataset_id,
+        "總批次數": len(df),
+        "欄位": list(map(str, df.columns)),
+        "平均溫度": pd.to_numeric(df[temp_col], errors="coerce").mean() if temp_col else None,
+        "溫度異常批次": int(df["temperature_violation"].sum()) if temp_col else 0,
+    }
+    return dataset_id, to_jsonable({"summary": summary, "local": local})
+
+
+def prepare_datasets(datasets: Dict[str, pd.DataFrame],
+                     max_workers: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+    items = list(datasets.items())
+    workers = min(max_workers or os.cpu_count() or 1, len(items))
+    if workers <= 1 or len(items) < PREPARE_POOL_MIN:
+        return dict(prepare_dataset(item) for item in items)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(prepare_dataset, items))
+
+
+# ==================== 批次檔 ====================
+def batch_request(custom_id: str, prompt: str, model: str, temperature: float, max_tokens: int,
+                  system_prompt: str = "") -> Dict[str, Any]:
+    messages = ([{"role": "system", "content": system_prompt}] if system_prompt else []) + \
+               [{"role": "user", "content": prompt}]
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT,
+            "body": {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}}
+
+
+def write_batch_files(requests: Iterable[Dict[str, Any]], directory: str, prefix: str) -> List[str]:
+    """依供應商上限（請求數 / 檔案大小）切成多個 JSONL 檔"""
+    os.makedirs(directory, exist_ok=True)
+    paths: List[str] = []
+    f, count, size = None, 0, 0
+    try:
+        for request in requests:
+            line = (json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8")
+            if f is None or count >= MAX_REQUESTS_PER_FILE or size + len(line) > MAX_BYTES_PER_FILE:
+                if f is not None:
+                    f.close()
+                paths.append(os.path.join(directory, f"{prefix}_{len(paths):03d}.jsonl"))
+                f, count, size = open(paths[-1], "wb"), 0, 0
+            f.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if f is not None:
+            f.close()
+    return paths
+
+
+def parse_output_line(line: str) -> Tuple[str, Dict[str, Any]]:
+    """批次輸出的一行 → (custom_id, {"status": "ok", "output", "usage"} 或 {"status": "error", "error"})"""
+    record = json.loads(line)
+    response = record.get("response") or {}
+    body = response.get("body") or {}
+    if record.get("error") or response.get("status_code", 200) >= 400:
+        error = record.get("error") or body.get("error") or f"HTTP {response.get('status_code')}"
+        return record["custom_id"], {"status": "error", "error": error}
+    return record["custom_id"], {"status": "ok", "output": body["choices"][0]["message"]["content"],
+                                 "usage": body.get("usage", {})}
+
+
+# ==================== 批次後端 ====================
+class OpenAIBatchBackend:
+    """OpenAI Batch API（xAI 等相容端點可傳入 base_url）"""
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+
+    def submit(self, path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        with open(path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT,
+                                           completion_window=COMPLETION_WINDOW, metadata=metadata)
+        return batch.id
+
+    def status(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {"status": batch.status, "total": counts.total if counts else 0,
+                "completed": counts.completed if counts else 0, "failed": counts.failed if counts else 0}
+
+    def results(self, batch_id: str) -> Dict[str, Dict[str, Any]]:
+        batch = self.client.batches.retrieve(batch_id)
+        parsed: Dict[str, Dict[str, Any]] = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                for line in self.client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        custom_id, result = parse_output_line(line)
+                        parsed[custom_id] = result
+        return parsed
+
+
+def _placeholder_responder(prompt: str, model: str) -> str:
+    return f"（本地批次模擬：{model}，提示詞 {len(prompt):,} 字元）"
+
+
+class LocalBatchBackend:
+    """
+    本地批次模擬伺服器：讀取同樣格式的 JSONL，在背景執行緒處理並寫出 OpenAI 格式的輸出檔
+
+    responder 沿用 llm_call(prompt, model) 介面：預設回傳模擬文字（測試用），
+    也可傳入 LLMProvider，用一般 API 消化批次（無批次折扣，但流程相同）。
+    """
+
+    def __init__(self, responder: Optional[Callable[[str, str], str]] = None,
+                 root: str = os.path.join(DEFAULT_WORKDIR, "local_server"), max_workers: int = 4):
+        self.responder = responder or _placeholder_responder
+        self.root = root
+        self.max_workers = max_workers
+        self._batches: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def submit(self, path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        with open(path, "r", encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        state = {"status": "in_progress", "total": len(requests), "completed": 0, "failed": 0,
+                 "output": os.path.join(self.root, f"{batch_id}_output.jsonl"), "metadata": metadata or {}}
+        with self._lock:
+            self._batches[batch_id] = state
+        threading.Thread(target=self._process, args=(batch_id, requests), daemon=True).start()
+        return batch_id
+
+    def _answer(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        body = request["body"]
+        prompt = "\n\n".join(m["content"] for m in body["messages"])
+        record = {"id": f"req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"], "error": None}
+        try:
+            content = self.responder(prompt, body["model"])
+            record["response"] = {"status_code": 200, "body": {
+                "model": body["model"], "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                "usage": {}}}
+        except Exception as e:
+            record["response"] = None
+            record["error"] = {"code": type(e).__name__, "message": str(e)}
+        return record
+
+    def _process(self, batch_id: str, requests: List[Dict[str, Any]]) -> None:
+        state = self._batches[batch_id]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool, \
+                open(state["output"], "w", encoding="utf-8") as out:
+            for record in pool.map(self._answer, requests):
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                with self._lock:
+                    state["failed" if record["error"] else "completed"] += 1
+        with self._lock:
+            state["status"] = "completed"
+
+    def status(self, batch_id: str) -> Dict[str, Any]:
+        with self._lock:
+            state = self._batches.get(batch_id)
+            if state is None:
+                # 模擬伺服器重啟：輸出檔已存在即視為完成
+                output = os.path.join(self.root, f"{batch_id}_output.jsonl")
+                if not os.path.exists(output):
+                    return {"status": "expired", "total": 0, "completed": 0, "failed": 0}
+                state = self._batches[batch_id] = {"status": "completed", "total": 0, "completed": 0,
+                                                   "failed": 0, "output": output}
+            return {k: state[k] for k in ("status", "total", "completed", "failed")}
+
+    def results(self, batch_id: str) -> Dict[str, Dict[str, Any]]:
+        path = self._batches[batch_id]["output"]
+        with open(path, "r", encoding="utf-8") as f:
+            return dict(parse_output_line(line) for line in f if line.strip())
+
+
+def wait_for_batches(backend, batch_ids: List[str], poll_interval: float = POLL_INTERVAL_S,
+                     timeout: Optional[float] = None,
+                     on_poll: Optional[Callable[[Dict[str, Dict[str, Any]]], None]] = None,
+                     sleep: Callable[[float], None] = time.sleep) -> Dict[str, Dict[str, Any]]:
+    """輪詢到所有批次進入終止狀態；間隔逐次加長（上限 MAX_POLL_INTERVAL_S）"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    interval = poll_interval
+    while True:
+        statuses = {b: backend.status(b) for b in batch_ids}
+        if on_poll is not None:
+            on_poll(statuses)
+        if all(s["status"] in TERMINAL_STATES for s in statuses.values()):
+            return statuses
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(f"批次未在 {timeout:.0f} 秒內完成：{statuses}")
+        sleep(interval)
+        interval = min(interval * 1.5, MAX_POLL_INTERVAL_S)
+
+
+# ==================== 完整審計 ====================
+class BatchAuditRunner:
+    """
+    多資料集完整審計
+
+    runner = BatchAuditRunner(LocalBatchBackend())
+    reports = runner.run({"farm_a": df_a, "farm_b": df_b})
+    """
+
+    def __init__(self, backend, model: str = "gpt-4o", system_prompt: str = "",
+                 engine: Optional[PromptEngine] = None, workdir: str = DEFAULT_WORKDIR,
+                 poll_interval: float = POLL_INTERVAL_S, timeout: Optional[float] = None,
+                 on_poll: Optional[Callable[[Dict[str, Dict[str, Any]]], None]] = None):
+        self.backend = backend
+        self.model = model
+        self.system_prompt = system_prompt
+        self.engine = engine or get_prompt_engine()
+        self.workdir = workdir
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.on_poll = on_poll
+
+    @property
+    def batch_agents(self) -> List[str]:
+        """階段 1 送出的 LLM 代理"""
+        skip = LOCAL_AUDIT_AGENTS | INTERACTIVE_AGENTS | {REPORT_AGENT}
+        return [a for a in self.engine.agents if a not in skip]
+
+    # ---------- 請求 ----------
+    def _request(self, dataset_id: str, agent_id: str, query: str,
+                 context: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        agent = self.engine.get(agent_id)
+        prompt, estimate = fit_prompt(
+            lambda c: self.engine.build_prompt(agent_id, query, c), context, self.model,
+            max_output_tokens=agent.max_tokens, system_prompt=self.system_prompt,
+            agent_id=agent_id, render=render_value)
+        request = batch_request(f"{dataset_id}{SEPARATOR}{agent_id}", prompt, self.model,
+                                agent.temperature, estimate.max_output_tokens, self.system_prompt)
+        return request, estimate.to_dict()
+
+    def _phase_requests(self, phase: str, prepared: Dict[str, Dict[str, Any]],
+                        outputs: Dict[str, Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        requests, skipped, tokens, cost = [], {}, 0, 0.0
+        for dataset_id, data in prepared.items():
+            context = {"資料摘要": data["summary"],
+                       "本地代理輸出（Agent 001-002、005-013）": data["local"]}
+            if phase == "agents":
+                jobs = [(a, f"請依你的職責分析資料集「{dataset_id}」，輸出該代理的完整結果。", context)
+                        for a in self.batch_agents]
+            else:
+                llm_outputs = {a: r.get("output", r.get("error")) for a, r in outputs.get(dataset_id, {}).items()}
+                jobs = [(REPORT_AGENT, REPORT_QUERY, {**context, "LLM 代理輸出": llm_outputs})]
+            for agent_id, query, ctx in jobs:
+                try:
+                    request, estimate = self._request(dataset_id, agent_id, query, ctx)
+                except PromptTooLargeError as e:
+                    skipped[f"{dataset_id}{SEPARATOR}{agent_id}"] = str(e)
+                    continue
+                requests.append(request)
+                tokens += estimate["prompt_tokens"]
+                cost += estimate["cost_usd"]
+        return requests, {"requests": len(requests), "prompt_tokens": tokens,
+                          "cost_usd": round(cost * BATCH_DISCOUNT, 4), "skipped": skipped}
+
+    # ---------- 執行 ----------
+    def _run_phase(self, phase: str, run_dir: str, manifest: Dict[str, Any],
+                   prepared: Dict[str, Dict[str, Any]],
+                   outputs: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        manifest_path = os.path.join(run_dir, "manifest.json")
+        state = manifest["phases"].setdefault(phase, {})
+        if "files" not in state:
+            requests, estimate = self._phase_requests(phase, prepared, outputs)
+            state.update(estimate=estimate, files=write_batch_files(requests, run_dir, phase), batch_ids=[])
+            _save_json(manifest_path, manifest)
+        # 每送出一個檔案就記錄 batch id：中途失敗後接續時只送出尚未送出的檔案，已送出的不重複計費
+        for path in state["files"][len(state["batch_ids"]):]:
+            state["batch_ids"].append(self.backend.submit(path, {"run_id": manifest["run_id"], "phase": phase}))
+            _save_json(manifest_path, manifest)
+
+        statuses = wait_for_batches(self.backend, state["batch_ids"], self.poll_interval,
+                                    self.timeout, self.on_poll)
+        results: Dict[str, Dict[str, Any]] = {}
+        for batch_id, status in statuses.items():
+            if status["status"] == "completed":
+                results.update(self.backend.results(batch_id))
+        for custom_id, error in state["estimate"]["skipped"].items():
+            results[custom_id] = {"status": "error", "error": error}
+        state["statuses"] = statuses
+        _save_json(manifest_path, manifest)
+
+        grouped: Dict[str, Dict[str, Any]] = {}
+        for custom_id, result in results.items():
+            dataset_id, agent_id = custom_id.rsplit(SEPARATOR, 1)
+            grouped.setdefault(dataset_id, {})[agent_id] = result
+        return grouped
+
+    def run(self, datasets: Dict[str, pd.DataFrame], run_id: Optional[str] = None,
+            max_workers: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Args:
+            datasets: {dataset_id: DataFrame}，dataset_id 不可包含 "::"
+            run_id: 指定既有的 run_id 可接續中斷的執行
+
+        Returns:
+            {dataset_id: {"final_report", "agents": {agent_id: {"source", "status", "output"}}}}；
+            報告同時寫到 <workdir>/<run_id>/reports/
+        """
+        bad = [d for d in datasets if SEPARATOR in d]
+        if bad:
+            raise ValueError(f"資料集 id 不可包含 {SEPARATOR!r}：{bad}")
+        run_id = run_id or datetime.now().strftime("audit_%Y%m%d_%H%M%S")
+        run_dir = os.path.join(self.workdir, run_id)
+        manifest_path = os.path.join(run_dir, "manifest.json")
+        prepared_path = os.path.join(run_dir, "prepared.json")
+        if os.path.exists(manifest_path):
+            manifest = _load_json(manifest_path)
+            prepared = _load_json(prepared_path)
+        else:
+            os.makedirs(run_dir, exist_ok=True)
+            prepared = prepare_datasets(datasets, max_workers)
+            _save_json(prepared_path, prepared)
+            manifest = {"run_id": run_id, "model": self.model, "datasets": list(prepared), "phases": {}}
+            _save_json(manifest_path, manifest)
+
+        agent_outputs = self._run_phase("agents", run_dir, manifest, prepared, {})
+        report_outputs = self._run_phase("report", run_dir, manifest, prepared, agent_outputs)
+
+        reports: Dict[str, Dict[str, Any]] = {}
+        os.makedirs(os.path.join(run_dir, "reports"), exist_ok=True)
+        for dataset_id, data in prepared.items():
+            agents = {a: {"source": "local", "status": "ok", "output": out} for a, out in data["local"].items()}
+            for agent_id, result in agent_outputs.get(dataset_id, {}).items():
+                agents[agent_id] = {"source": "batch", **result}
+            report = report_outputs.get(dataset_id, {}).get(REPORT_AGENT, {})
+            final = report.get("output") or f"⚠️ 報告生成失敗：{report.get('error', '批次未完成')}"
+            reports[dataset_id] = {"final_report": final, "agents": agents}
+            with open(os.path.join(run_dir, "reports", f"{safe_name(dataset_id)}.md"), "w", encoding="utf-8") as f:
+                f.write(final)
+        _save_json(os.path.join(run_dir, "reports.json"), reports)
+        return reports
+
+
+def _save_json(path: str, data: Any) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+
+
+def _load_json(path: str) -> Any:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="完整審計批次模式（usage_examples.full_audit）")
+    parser.add_argument("paths", nargs="+", help="資料檔（CSV / Excel / JSON）")
+    parser.add_argument("--split-by", help="依欄位拆成多個資料集，例如 farm_name")
+    parser.add_argument("--backend", choices=["openai", "local"], default="openai")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR)
+    parser.add_argument("--run-id", help="接續既有的執行")
+    parser.add_argument("--poll", type=float, default=POLL_INTERVAL_S, help="輪詢間隔（秒）")
+    args = parser.parse_args(argv)
+
+    if args.backend == "openai":
+        backend = OpenAIBatchBackend(os.environ["OPENAI_API_KEY"])
+    else:
+        backend = LocalBatchBackend(root=os.path.join(args.workdir, "local_server"))
+
+    def on_poll(statuses: Dict[str, Dict[str, Any]]) -> None:
+        done = sum(s["completed"] + s["failed"] for s in statuses.values())
+        total = sum(s["total"] for s in statuses.values())
+        print(f"[{datetime.now():%H:%M:%S}] {done}/{total} 筆請求完成")
+
+    runner = BatchAuditRunner(backend, model=args.model, workdir=args.workdir,
+                              poll_interval=args.poll, on_poll=on_poll)
+    datasets = load_datasets(args.paths, args.split_by)
+    reports = runner.run(datasets, run_id=args.run_id)
+    failed = [d for d, r in reports.items() if r["final_report"].startswith("⚠️")]
+    print(f"完成 {len(reports)} 個資料集的審計報告（失敗 {len(failed)} 個），輸出於 {args.workdir}")
+
+
+if __name__ == "__main__":
+    main()
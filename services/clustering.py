@@ -0,0 +1,184 @@
+# services/clustering.py - 批次 / 農場分群（Agent 009）
+# 特徵標準化後以 mini-batch K-means 分群；K 值掃描在 process pool 平行執行，
+# Silhouette 只在抽樣上計算，因此百萬筆資料也能在數秒內選出群數。
+# 交給報告代理的是每群的特徵摘要，而不是原始資料。
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.features import batch_features
+from utils.shared_frame import SharedFrame, default_workers
+
+K_RANGE = range(2, 9)
+BATCH_SIZE = 2048
+N_ITER = 100
+SILHOUETTE_SAMPLE = 3000
+ASSIGN_CHUNK = 200_000
+TOP_K = 3
+
+# 分群使用的特徵（存在者才使用）；temp_max/min 在單筆批次時與 temp_mean 相同，故不納入
+TEMP_FEATURES = ["temp_mean", "temp_excursion_max", "quantity"]
+
+# worker 端的特徵欄位（共享記憶體 view）
+_COLUMNS: Optional[List[np.ndarray]] = None
+
+
+def _rows(columns: Sequence[np.ndarray], idx) -> np.ndarray:
+    return np.column_stack([c[idx] for c in columns])
+
+
+def _sq_dist(X: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    return (X * X).sum(1)[:, None] - 2 * X @ centers.T + (centers * centers).sum(1)[None, :]
+
+
+def _kmeans_pp(X: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    centers = [X[rng.integers(len(X))]]
+    closest = _sq_dist(X, centers[0][None, :])[:, 0]
+    for _ in range(1, k):
+        probs = np.clip(closest, 0, None)
+        total = probs.sum()
+        idx = rng.choice(len(X), p=probs / total) if total > 0 else rng.integers(len(X))
+        centers.append(X[idx])
+        closest = np.minimum(closest, _sq_dist(X, X[idx][None, :])[:, 0])
+    return np.array(centers)
+
+
+def minibatch_kmeans(columns: Sequence[np.ndarray], k: int, seed: int = 0,
+                     batch_size: int = BATCH_SIZE, n_iter: int = N_ITER) -> np.ndarray:
+    """Mini-batch K-means（Sculley 2010），回傳群中心"""
+    n = len(columns[0])
+    rng = np.random.default_rng(seed)
+    centers = _kmeans_pp(_rows(columns, rng.integers(0, n, min(n, 10 * batch_size))), k, rng)
+    counts = np.zeros(k)
+    for _ in range(n_iter):
+        batch = _rows(columns, rng.integers(0, n, min(n, batch_size)))
+        labels = _sq_dist(batch, centers).argmin(1)
+        sizes = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, batch)
+        hit = sizes > 0
+        counts[hit] += sizes[hit]
+        rate = (sizes[hit] / counts[hit])[:, None]
+        centers[hit] += rate * (sums[hit] / sizes[hit][:, None] - centers[hit])
+    return centers
+
+
+def assign(columns: Sequence[np.ndarray], centers: np.ndarray) -> Tuple[np.ndarray, float]:
+    """分批指派所有資料列，回傳 (labels, inertia)"""
+    n = len(columns[0])
+    labels = np.empty(n, dtype=np.int32)
+    inertia = 0.0
+    for start in range(0, n, ASSIGN_CHUNK):
+        d = _sq_dist(_rows(columns, slice(start, start + ASSIGN_CHUNK)), centers)
+        labels[start:start + ASSIGN_CHUNK] = d.argmin(1)
+        inertia += float(np.clip(d.min(1), 0, None).sum())
+    return labels, inertia
+
+
+def silhouette_sample(X: np.ndarray, labels: np.ndarray) -> float:
+    """在抽樣上計算平均 silhouette 分數"""
+    k = labels.max() + 1
+    if len(np.unique(labels)) < 2:
+        return float("nan")
+    d = np.sqrt(np.clip(_sq_dist(X, X), 0, None))
+    one_hot = np.eye(k)[labels]
+    sizes = one_hot.sum(0)
+    mean_to = (d @ one_hot) / np.maximum(sizes, 1)
+    own = labels
+    a = (d @ one_hot)[np.arange(len(X)), own] / np.maximum(sizes[own] - 1, 1)
+    mean_to[np.arange(len(X)), own] = np.inf
+    mean_to[:, sizes == 0] = np.inf
+    b = mean_to.min(1)
+    s = (b - a) / np.maximum(a, b)
+    s[sizes[own] <= 1] = 0
+    return float(s.mean())
+
+
+def _evaluate_k(k: int, seed: int = 0, columns: Optional[Sequence[np.ndarray]] = None) -> Dict[str, Any]:
+    columns = _COLUMNS if columns is None else columns
+    centers = minibatch_kmeans(columns, k, seed=seed)
+    labels, inertia = assign(columns, centers)
+    rng = np.random.default_rng(seed)
+    n = len(labels)
+    sample = rng.choice(n, min(n, SILHOUETTE_SAMPLE), replace=False)
+    return {"k": k, "inertia": inertia, "silhouette": silhouette_sample(_rows(columns, sample), labels[sample]),
+            "centers": centers}
+
+
+def _init_worker(shared: SharedFrame) -> None:
+    global _COLUMNS
+    frame = shared.to_dataframe()
+    _COLUMNS = [frame[c].to_numpy() for c in frame.columns]
+
+
+def sweep_k(X: pd.DataFrame, k_range=K_RANGE, max_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """對每個 K 值分群並評分；K 值平行執行，特徵矩陣經共享記憶體傳給 worker（已在 pool 內時依序執行）"""
+    ks = [k for k in k_range if k < len(X)]
+    workers = min(default_workers(max_workers), len(ks))
+    if workers <= 1:
+        columns = [X[c].to_numpy() for c in X.columns]
+        return [_evaluate_k(k, columns=columns) for k in ks]
+    with SharedFrame.from_dataframe(X) as shared:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared,)) as pool:
+            return list(pool.map(_evaluate_k, ks))
+
+
+def cluster_batches(df: pd.DataFrame, k_range=K_RANGE, max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Agent 009：批次分群
+
+    Returns:
+        K 值掃描（inertia / silhouette，供 Elbow 與 Silhouette 判斷）、
+        選定的 K，以及每群的大小、特徵平均與主要農場
+    """
+    features = batch_features(df)
+    cols = [c for c in features.columns if "→" in c or c in TEMP_FEATURES]
+    features = features[cols].dropna(axis=1, how="all")
+    features = features.fillna(features.median())
+    features = features.loc[:, features.std() > 0]
+    if features.shape[1] == 0 or len(features) < 3:
+        return {"error": "可用於分群的數值特徵不足"}
+
+    scaled = (features - features.mean()) / features.std()
+    results = sweep_k(scaled.astype(np.float64), k_range, max_workers)
+    if not results:
+        return {"error": "資料筆數不足以分群"}
+    best = max(results, key=lambda r: (np.nan_to_num(r["silhouette"], nan=-1), -r["k"]))
+    labels, _ = assign([scaled[c].to_numpy() for c in scaled.columns], best["centers"])
+
+    farms = None
+    if "farm_name" in df.columns:
+        if len(features) == len(df):
+            farms = df["farm_name"].to_numpy()
+        else:
+            farms = df.groupby(df["batch_id"].astype(str), sort=False)["farm_name"].first()
+            farms = farms.reindex(features.index).to_numpy()
+
+    clusters = []
+    for label in range(best["k"]):
+        members = labels == label
+        if not members.any():
+            continue
+        summary = {"cluster": label, "size": int(members.sum()), "share": float(members.mean()),
+                   "feature_means": features[members].mean().round(3).to_dict()}
+        if farms is not None:
+            top = pd.Series(farms[members]).value_counts().head(TOP_K)
+            summary["top_farms"] = {str(k): int(v) for k, v in top.items()}
+        clusters.append(summary)
+    if "temp_excursion_max" in features.columns:
+        # 依溫度超標程度排序，標記高/中/低風險群
+        clusters.sort(key=lambda c: c["feature_means"]["temp_excursion_max"], reverse=True)
+        for i, c in enumerate(clusters):
+            c["risk_group"] = "高" if i == 0 else "低" if i == len(clusters) - 1 else "中"
+
+    return {
+        "features": list(features.columns),
+        "rows": len(features),
+        "sweep": [{"k": r["k"], "inertia": round(r["inertia"], 2), "silhouette": round(r["silhouette"], 4)}
+                  for r in results],
+        "best_k": best["k"],
+        "clusters": clusters,
+    }
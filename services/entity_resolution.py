@@ -0,0 +1,216 @@
+# services/entity_resolution.py - 實體名稱模糊比對與正規化（Agent 005 / Entity_Resolution_Agent）
+# 「快樂農場」與「快樂農場有限公司」這類重複實體會把 Sankey 與各農場統計拆散。
+# 兩兩比對是 O(n²)；這裡先正規化名稱，再以 MinHash + LSH 分桶找候選配對，
+# 只對候選配對計算精確 Jaccard，接近線性時間即可完成。
+# 名稱中的編號（Farm 1 / Farm 2、一廠 / 二廠）不同時一律視為不同實體，不論字面多相似。
+
+import re
+import unicodedata
+import zlib
+from collections import Counter, defaultdict
+from itertools import combinations
+from typing import Dict, Iterable, List, Set
+
+import numpy as np
+import pandas as pd
+
+CANONICAL_COLUMNS = ["farm_name", "packing_facility", "retailer"]
+
+NUM_PERM = 128
+BANDS = 21                    # 21 band × 6 row：Jaccard 0.8 的配對成為候選的機率 > 99.8%，0.4 約 8%
+MATCH_THRESHOLD = 0.8         # 候選配對的精確 Jaccard 須達此值才合併
+_PRIME = (1 << 31) - 1
+
+# 名稱尾端的公司型態字樣：中日文以字尾比對，英文以整個單字比對
+CJK_SUFFIXES = ["股份有限公司", "有限公司", "有限會社", "株式會社", "企業社", "企業", "公司", "商行"]
+LATIN_SUFFIXES = {"co", "ltd", "limited", "inc", "corp", "corporation", "company", "llc"}
+
+_CJK = re.compile(r"[぀-ヿ㐀-鿿豈-﫿]")
+_TOKEN = re.compile(r"[぀-ヿ㐀-鿿豈-﫿]+|[a-z0-9]+")
+_NUMBER = re.compile(r"[0-9]+|[〇零一二三四五六七八九十百千]+")
+
+_rng = np.random.default_rng(20251121)
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.int64)
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.int64)
+
+
+# ==================== 正規化與分詞 ====================
+def normalize_name(name: str) -> str:
+    """NFKC（全形轉半形）、小寫、去除標點與尾端公司型態字樣；相鄰的中日文片段接回一起"""
+    parts: List[str] = []
+    for token in _TOKEN.findall(unicodedata.normalize("NFKC", str(name)).lower()):
+        if parts and _CJK.match(token) and _CJK.match(parts[-1]):
+            parts[-1] += token
+        else:
+            parts.append(token)
+    while len(parts) > 1 and parts[-1] in LATIN_SUFFIXES:
+        parts.pop()
+    if parts and _CJK.match(parts[-1]):
+        last = parts[-1]
+        for suffix in CJK_SUFFIXES:
+            if last.endswith(suffix) and len(last) > len(suffix):
+                last = last[:-len(suffix)]
+        parts[-1] = last
+    return " ".join(parts)
+
+
+def shingles(name: str) -> Set[str]:
+    """中日文取字元 bigram，英數取前後補空白的字元 trigram（容許拼字小錯）"""
+    tokens: Set[str] = set()
+    for token in _TOKEN.findall(name):
+        if _CJK.match(token):
+            tokens.update(token[i:i + 2] for i in range(max(len(token) - 1, 1)))
+        else:
+            padded = f" {token} "
+            tokens.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return tokens
+
+
+def numbers(name: str) -> tuple:
+    """名稱中依序出現的編號（阿拉伯數字去掉前導零、中文數字原樣），編號不同的名稱不得合併"""
+    return tuple(str(int(n)) if n.isdigit() else n for n in _NUMBER.findall(name))
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+# ==================== MinHash + LSH ====================
+def minhash_signatures(token_sets: List[Set[str]]) -> np.ndarray:
+    """每個名稱的 MinHash 簽章 (n, NUM_PERM)；h(x) = (a·x + b) mod p"""
+    sigs = np.full((len(token_sets), NUM_PERM), _PRIME, dtype=np.int64)
+    for i, tokens in enumerate(token_sets):
+        if tokens:
+            x = np.array([zlib.crc32(t.encode("utf-8")) & _PRIME for t in tokens], dtype=np.int64)
+            sigs[i] = ((np.outer(x, _A) + _B) % _PRIME).min(0)
+    return sigs
+
+
+def candidate_pairs(signatures: np.ndarray, bands: int = BANDS) -> Set[tuple]:
+    """LSH 分桶：任一 band 完全相同的名稱成為候選配對"""
+    rows = signatures.shape[1] // bands
+    pairs: Set[tuple] = set()
+    for b in range(bands):
+        band = signatures[:, b * rows:(b + 1) * rows].astype(np.uint64)
+        keys = np.zeros(len(band), dtype=np.uint64)
+        for col in band.T:
+            keys = keys * np.uint64(0x100000001B3) + col
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        bounds = np.flatnonzero(np.diff(sorted_keys)) + 1
+        for members in np.split(order, bounds):
+            if len(members) > 1:
+                members = sorted(members.tolist())
+                pairs.update(combinations(members, 2))
+    return pairs
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+
+# ==================== 對外介面 ====================
+def resolve_entities(names: Iterable[str], counts: Dict[str, int] = None,
+                     threshold: float = MATCH_THRESHOLD) -> Dict[str, str]:
+    """
+    找出同一實體的不同寫法
+
+    Args:
+        names: 不重複的原始名稱
+        counts: 各名稱出現次數，用來選出代表名稱（最常出現者，同次數取較短者）
+
+    Returns:
+        {原始名稱: 代表名稱}，只包含需要改寫的名稱
+    """
+    names = [n for n in dict.fromkeys(names) if isinstance(n, str) and n.strip()]
+    counts = counts or {}
+    # 正規化後相同者直接合併，MinHash 只需處理不同的正規化名稱
+    keys = [normalize_name(n) for n in names]
+    distinct = list(dict.fromkeys(keys))
+    key_index = {k: i for i, k in enumerate(distinct)}
+    token_sets = [shingles(k) for k in distinct]
+    number_keys = [numbers(k) for k in distinct]
+
+    def similar(i: int, j: int) -> bool:
+        return number_keys[i] == number_keys[j] and jaccard(token_sets[i], token_sets[j]) >= threshold
+
+    uf = _UnionFind(len(distinct))
+    for i, j in candidate_pairs(minhash_signatures(token_sets)):
+        if similar(i, j):
+            uf.union(i, j)
+
+    # 連通分量可能經由中間名稱串接出不相似的名稱，
+    # 故只保留與分量代表（出現次數最多者）本身相似的正規化名稱
+    key_counts: Counter = Counter()
+    for name, key in zip(names, keys):
+        key_counts[key] += counts.get(name, 0)
+    components: Dict[int, List[int]] = defaultdict(list)
+    for i in range(len(distinct)):
+        components[uf.find(i)].append(i)
+    cluster = list(range(len(distinct)))
+    for members in components.values():
+        if len(members) < 2:
+            continue
+        head = min(members, key=lambda i: (-key_counts[distinct[i]], len(distinct[i]), distinct[i]))
+        for i in members:
+            if i == head or similar(i, head):
+                cluster[i] = head
+
+    groups: Dict[int, List[str]] = defaultdict(list)
+    for name, key in zip(names, keys):
+        groups[cluster[key_index[key]]].append(name)
+    mapping = {}
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        canonical = min(members, key=lambda n: (-counts.get(n, 0), len(n), n))
+        mapping.update({n: canonical for n in members if n != canonical})
+    return mapping
+
+
+def canonicalize_entities(df: pd.DataFrame, columns: Iterable[str] = CANONICAL_COLUMNS,
+                          threshold: float = MATCH_THRESHOLD) -> Dict[str, Dict[str, str]]:
+    """
+    就地把實體欄位改寫成代表名稱（須在任何彙總之前執行）
+
+    Returns:
+        {欄位: {原始名稱: 代表名稱}}，供報告列出合併了哪些實體
+    """
+    merged = {}
+    for col in [c for c in columns if c in df.columns]:
+        codes, uniques = pd.factorize(df[col])
+        if len(uniques) < 2:
+            continue
+        uniques = pd.Index(uniques).astype(str)
+        counts = Counter(dict(zip(uniques, np.bincount(codes[codes >= 0], minlength=len(uniques)).tolist())))
+        mapping = resolve_entities(uniques, counts, threshold)
+        if not mapping:
+            continue
+        resolved = np.array([mapping.get(u, u) for u in uniques], dtype=object)
+        values = resolved.take(np.where(codes >= 0, codes, 0))
+        df[col] = pd.Series(np.where(codes >= 0, values, None), index=df.index, dtype=object)
+        merged[col] = mapping
+    return merged
+
+
+def apply_entity_merges(df: pd.DataFrame, merges: Dict[str, Dict[str, str]]) -> None:
+    """就地套用先前 canonicalize_entities 算出的對照表（從 checkpoint 續跑時不必重新比對）"""
+    for col, mapping in merges.items():
+        if col not in df.columns:
+            continue
+        codes, uniques = pd.factorize(df[col])
+        resolved = np.array([mapping.get(u, u) for u in pd.Index(uniques).astype(str)], dtype=object)
+        values = resolved.take(np.where(codes >= 0, codes, 0)) if len(resolved) else np.full(len(df), None)
+        df[col] = pd.Series(np.where(codes >= 0, values, None), index=df.index, dtype=object)
@@ -0,0 +1,232 @@
+# services/forecasting.py - 產量 / 需求預測（Agent 008）
+# 每個農場的每日出貨量各自擬合輕量模型（季節性 naive、Holt 線性趨勢 ETS(A,A,N)），
+# 農場之間以 process pool 平行計算（已在 pool 內時依序執行）；擬合參數與狀態快取在 SQLite，
+# 新日期到來時只用新資料更新狀態，不必整段重新擬合。
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.features import find_quantity_column
+from utils.shared_frame import default_workers
+
+DEFAULT_CACHE_PATH = "data/models/forecast_cache.db"
+HORIZONS = (7, 30, 90)
+SEASON = 7                       # 週季節性
+MIN_HISTORY = 2 * SEASON
+PARALLEL_MIN_FARMS = 32          # 農場數少於此值時不值得啟動 process pool
+REFIT_GROWTH = 0.5               # 新增資料超過既有 50% 時整段重新擬合
+TOP_FARMS = 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS states (
+    farm       TEXT PRIMARY KEY,
+    state      TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+_GRID = np.array([(a, b) for a in np.linspace(0.05, 0.95, 10) for b in (0.0, 0.01, 0.05, 0.1, 0.2, 0.3)])
+
+
+# ==================== 序列準備 ====================
+def daily_series(df: pd.DataFrame, group_col: str = "farm_name",
+                 date_col: str = "laying_date") -> Dict[str, pd.Series]:
+    """每個農場的每日出貨量（缺日補 0）"""
+    if group_col not in df.columns or date_col not in df.columns:
+        return {}
+    qty_col = find_quantity_column(df)
+    day = pd.to_datetime(df[date_col], errors="coerce").dt.floor("D")
+    frame = pd.DataFrame({"group": df[group_col].astype(str), "day": day,
+                          "qty": df[qty_col] if qty_col else 1}).dropna(subset=["day"])
+    daily = frame.groupby(["group", "day"])["qty"].sum()
+    out = {}
+    for name, s in daily.groupby(level=0):
+        s = s.droplevel(0)
+        out[name] = s.reindex(pd.date_range(s.index.min(), s.index.max(), freq="D"), fill_value=0).astype(float)
+    return out
+
+
+def _fingerprint(values: np.ndarray) -> str:
+    return hashlib.sha1(np.round(values, 6).tobytes()).hexdigest()
+
+
+# ==================== 模型 ====================
+def _holt_grid(y: np.ndarray, level: np.ndarray, trend: np.ndarray,
+               params: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """對每組 (alpha, beta) 同時跑 Holt 遞迴，回傳 (level, trend, 一步預測絕對誤差總和)"""
+    alpha, beta = params[:, 0], params[:, 1]
+    abs_err = np.zeros(len(params))
+    for value in y:
+        forecast = level + trend
+        abs_err += np.abs(value - forecast)
+        new_level = alpha * value + (1 - alpha) * forecast
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        level = new_level
+    return level, trend, abs_err
+
+
+def fit_series(y: np.ndarray) -> Dict[str, Any]:
+    """網格搜尋 Holt 的 (alpha, beta)，再與季節性 naive 比較一步預測 MAE 選擇模型"""
+    n = len(y)
+    start = SEASON        # 以第一週初始化 level、前兩週差距初始化 trend（n ≥ MIN_HISTORY）
+    init_level = np.full(len(_GRID), y[:start].mean())
+    init_trend = np.full(len(_GRID), (y[start:2 * start].mean() - y[:start].mean()) / start)
+    level, trend, abs_err = _holt_grid(y[start:], init_level, init_trend, _GRID)
+    best = int(abs_err.argmin())
+    holt_mae = abs_err[best] / (n - start)
+    snaive_err = float(np.abs(y[SEASON:] - y[:-SEASON]).sum())
+    snaive_mae = snaive_err / (n - SEASON)
+    return {
+        "model": "seasonal_naive" if snaive_mae < holt_mae else "holt",
+        "alpha": float(_GRID[best, 0]), "beta": float(_GRID[best, 1]),
+        "level": float(level[best]), "trend": float(trend[best]),
+        "season": y[-SEASON:].tolist(),
+        "mae": float(min(holt_mae, snaive_mae)), "holt_mae": float(holt_mae),
+        "snaive_mae": snaive_mae, "snaive_err": snaive_err, "n_obs": n, "abs_err": float(abs_err[best]),
+    }
+
+
+def update_state(state: Dict[str, Any], new_values: np.ndarray) -> Dict[str, Any]:
+    """以已擬合的 alpha/beta 只對新觀測值更新狀態（不重新選參數）"""
+    params = np.array([[state["alpha"], state["beta"]]])
+    level, trend, abs_err = _holt_grid(new_values, np.array([state["level"]]), np.array([state["trend"]]), params)
+    recent = np.concatenate([state["season"], new_values])
+    snaive_err = state["snaive_err"] + float(np.abs(recent[SEASON:] - recent[:-SEASON]).sum())
+    n_obs = state["n_obs"] + len(new_values)
+    holt_err = state["abs_err"] + float(abs_err[0])
+    holt_mae = holt_err / (n_obs - SEASON)
+    snaive_mae = snaive_err / (n_obs - SEASON)
+    return {**state, "level": float(level[0]), "trend": float(trend[0]), "season": recent[-SEASON:].tolist(),
+            "n_obs": n_obs, "abs_err": holt_err, "holt_mae": holt_mae, "snaive_err": snaive_err,
+            "snaive_mae": snaive_mae, "mae": min(holt_mae, snaive_mae)}
+
+
+def forecast(state: Dict[str, Any], horizon: int) -> np.ndarray:
+    steps = np.arange(1, horizon + 1)
+    if state["model"] == "seasonal_naive":
+        season = np.asarray(state["season"], dtype=float)
+        path = season[(steps - 1) % len(season)]
+    else:
+        path = state["level"] + steps * state["trend"]
+    return np.clip(path, 0, None)
+
+
+# ==================== 快取 + 平行 ====================
+def _fit_or_update(item: Tuple[str, List[str], List[float], Optional[Dict[str, Any]]]) -> Tuple[str, Dict[str, Any]]:
+    name, dates, values, cached = item
+    y = np.asarray(values, dtype=float)
+    if cached and cached.get("first_date") == dates[0] and cached.get("last_date") in dates:
+        known = dates.index(cached["last_date"]) + 1
+        growth = (len(y) - known) / max(known, 1)
+        if _fingerprint(y[:known]) == cached.get("history") and growth <= REFIT_GROWTH:
+            state = update_state(cached, y[known:]) if known < len(y) else cached
+            return name, {**state, "last_date": dates[-1], "history": _fingerprint(y), "refit": False}
+    state = fit_series(y)
+    return name, {**state, "first_date": dates[0], "last_date": dates[-1],
+                  "history": _fingerprint(y), "refit": True, "fitted_at": datetime.now().isoformat()}
+
+
+class ForecastCache:
+    """
+    每個農場的擬合參數與狀態，存在 SQLite（每個農場一列）
+
+    多個 process 同時更新時各自只寫入自己擬合的農場，不會互相覆蓋；
+    檔案損毀時視為空快取重建（只是需要重新擬合），不讓 Agent 008 失敗。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        try:
+            self._init_db()
+        except sqlite3.DatabaseError:
+            os.remove(path)
+            self._init_db()
+
+    def _init_db(self) -> None:
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, names: List[str]) -> Dict[str, Dict[str, Any]]:
+        states: Dict[str, Dict[str, Any]] = {}
+        try:
+            with self._connect() as conn:
+                for i in range(0, len(names), 500):
+                    chunk = names[i:i + 500]
+                    rows = conn.execute(f"SELECT farm, state FROM states WHERE farm IN ({','.join('?' * len(chunk))})",
+                                        chunk).fetchall()
+                    for farm, state in rows:
+                        try:
+                            states[farm] = json.loads(state)
+                        except ValueError:
+                            continue
+        except sqlite3.DatabaseError:
+            return {}
+        return states
+
+    def put_many(self, items: List[Tuple[str, Dict[str, Any]]]) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO states (farm, state, updated_at) VALUES (?, ?, ?)",
+                             [(name, json.dumps(state, ensure_ascii=False), now) for name, state in items])
+
+
+def forecast_farms(df: pd.DataFrame, horizons=HORIZONS, cache: Optional[ForecastCache] = None,
+                   max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Agent 008：預測每個農場未來 7/30/90 天的出貨量
+
+    Returns:
+        各期間總預測量，以及出貨量前 TOP_FARMS 個農場的模型、MAE 與各期間預測
+    """
+    series = daily_series(df)
+    series = {k: s for k, s in series.items() if len(s) >= MIN_HISTORY}
+    if not series:
+        return {"farms": 0, "error": f"沒有農場具備至少 {MIN_HISTORY} 天的資料"}
+    cache = cache or ForecastCache()
+    states = cache.get_many(list(series))
+    items = [(name, [d.strftime("%Y-%m-%d") for d in s.index], s.tolist(), states.get(name))
+             for name, s in series.items()]
+
+    workers = min(default_workers(max_workers), len(items))
+    if workers <= 1 or len(items) < PARALLEL_MIN_FARMS:
+        fitted = [_fit_or_update(item) for item in items]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            fitted = list(pool.map(_fit_or_update, items, chunksize=max(1, len(items) // (workers * 4))))
+    cache.put_many(fitted)
+
+    rows = []
+    for name, state in fitted:
+        row = {"farm": name, "model": state["model"], "mae": round(state["mae"], 2),
+               "last_date": state["last_date"], "refit": state["refit"]}
+        for h in horizons:
+            row[f"next_{h}d"] = round(float(forecast(state, h).sum()), 1)
+        rows.append(row)
+    rows.sort(key=lambda r: r[f"next_{horizons[-1]}d"], reverse=True)
+    return {
+        "farms": len(rows),
+        "refitted": sum(r["refit"] for r in rows),
+        "totals": {f"next_{h}d": round(sum(r[f"next_{h}d"] for r in rows), 1) for h in horizons},
+        "by_farm": rows[:TOP_FARMS],
+    }
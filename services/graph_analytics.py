@@ -0,0 +1,293 @@
+# services/graph_analytics.py - 供應鏈網絡分析（Agent 015 網絡圖專家：PageRank 關鍵節點與瓶頸）
+# 把批次資料轉成 農場 → 包裝廠 → 分銷商 → 零售商 的加權有向圖（邊權重為流經的數量），以 scipy 稀疏矩陣計算：
+#   - PageRank：稀疏矩陣冪次迭代（每次迭代 O(邊數)），全國規模的圖也在數秒內收斂
+#   - 介數中心性：Brandes 演算法，隨機抽樣來源節點、多個來源以稀疏 × 稠密矩陣一起做 BFS（估計值）
+#   - 流量集中度：各層節點的流量占比與 HHI（Herfindahl-Hirschman 指數）
+#   - 單點故障：農場的全部出貨、或零售商的全部進貨只經過同一個節點
+# 結果供 app.py 的 Sankey 圖上色（綠 / 黃 / 紅），並以本地代理輸出送進風險評估與最終報告。
+#
+#   graph, metrics = node_metrics(df)        # metrics 每列一個節點：tier, name, pagerank, betweenness, status ...
+#   summary = supply_network_analysis(df)    # 可 json.dumps 的摘要（Agent 015 輸出）
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    from scipy import sparse
+except ImportError:  # 與 Agent 013 相同：scipy 未安裝時代理回傳錯誤說明，不影響其他代理
+    sparse = None
+
+from utils.features import ENTITY_COLUMNS, SAFE_TEMP_RANGE, find_quantity_column, find_temp_column
+
+DAMPING = 0.85
+PAGERANK_TOL = 1e-6           # 相鄰兩次迭代的 L1 差
+PAGERANK_MAX_ITER = 200
+BETWEENNESS_SAMPLES = 256      # 節點數超過此值時抽樣來源節點估計介數
+BETWEENNESS_CHUNK = 32         # 一次一起 BFS 的來源數（記憶體約 節點數 × 32 × 8 bytes × 4）
+TOP_K = 10
+RED_VIOLATION_RATE = 0.2       # 節點溫度異常率達此值為紅燈
+YELLOW_VIOLATION_RATE = 0.05
+RED_FLOW_SHARE = 0.25          # 單點故障且占該層流量 25% 以上為紅燈
+
+SPARSE_DENSITY = 0.05         # 前沿矩陣非零比例低於此值時改用稀疏 × 稀疏乘法
+
+GREEN, YELLOW, RED = "green", "yellow", "red"
+STATUS_COLORS = {GREEN: "#2E8B57", YELLOW: "#FFC107", RED: "#DC3545"}
+
+
+@dataclass
+class SupplyGraph:
+    """節點表（index 為節點編號）與邊陣列；同一名稱在不同層是不同節點"""
+    nodes: pd.DataFrame          # tier, name, throughput, batches
+    src: np.ndarray
+    dst: np.ndarray
+    weight: np.ndarray
+
+    @property
+    def n(self) -> int:
+        return len(self.nodes)
+
+    def adjacency(self, weighted: bool = True) -> "sparse.csr_matrix":
+        data = self.weight if weighted else np.ones(len(self.src))
+        A = sparse.csr_matrix((data, (self.src, self.dst)), shape=(self.n, self.n))
+        if not weighted:
+            A.data[:] = 1.0
+        return A
+
+
+def _weights(df: pd.DataFrame) -> pd.Series:
+    qty_col = find_quantity_column(df)
+    if qty_col is None:
+        return pd.Series(1.0, index=df.index)
+    return pd.to_numeric(df[qty_col], errors="coerce").fillna(0).clip(lower=0).astype(float)
+
+
+def _violations(df: pd.DataFrame) -> Optional[pd.Series]:
+    if "temperature_violation" in df.columns:
+        return df["temperature_violation"].fillna(False).astype(bool)
+    temp_col = find_temp_column(df)
+    if temp_col:
+        low, high = SAFE_TEMP_RANGE
+        return (df[temp_col] > high) | (df[temp_col] < low)
+    return None
+
+
+def build_graph(df: pd.DataFrame) -> Tuple[SupplyGraph, pd.DataFrame]:
+    """回傳 (圖, 每列批次在各層的節點編號)；缺值的層為 -1"""
+    tiers = [c for c in ENTITY_COLUMNS if c in df.columns]
+    weight = _weights(df)
+    codes = pd.DataFrame(index=df.index)
+    frames, offset = [], 0
+    for tier in tiers:
+        values, names = pd.factorize(df[tier].astype("string"), use_na_sentinel=True)
+        codes[tier] = np.where(values >= 0, values + offset, -1)
+        frames.append(pd.DataFrame({"tier": tier, "name": names.astype(str)}, index=range(offset, offset + len(names))))
+        offset += len(names)
+    nodes = pd.concat(frames) if frames else pd.DataFrame(columns=["tier", "name"])
+    nodes["throughput"] = 0.0
+    nodes["batches"] = 0
+    for tier in tiers:
+        c = codes[tier]
+        valid = c >= 0
+        nodes.loc[:, "throughput"] += np.bincount(c[valid], weights=weight[valid], minlength=len(nodes))
+        nodes.loc[:, "batches"] += np.bincount(c[valid], minlength=len(nodes))
+
+    src, dst, w = [], [], []
+    for a, b in zip(tiers, tiers[1:]):
+        pair = pd.DataFrame({"s": codes[a], "t": codes[b], "w": weight})
+        pair = pair[(pair["s"] >= 0) & (pair["t"] >= 0)].groupby(["s", "t"], sort=False)["w"].sum()
+        src.append(pair.index.get_level_values(0).to_numpy())
+        dst.append(pair.index.get_level_values(1).to_numpy())
+        w.append(pair.to_numpy())
+    cat = lambda parts, dtype: np.concatenate(parts).astype(dtype) if parts else np.array([], dtype=dtype)
+    graph = SupplyGraph(nodes, cat(src, np.int64), cat(dst, np.int64), cat(w, float))
+    return graph, codes
+
+
+# ==================== 中心性 ====================
+def pagerank(graph: SupplyGraph, damping: float = DAMPING, directed: bool = False,
+             tol: float = PAGERANK_TOL, max_iter: int = PAGERANK_MAX_ITER) -> np.ndarray:
+    """
+    加權 PageRank（稀疏矩陣冪次迭代）
+
+    預設把流向視為雙向：有向圖中所有分數都會流向下游的零售商；雙向時上下游都有大量往來的樞紐節點分數最高。
+    沒有出邊的節點（dangling）把分數平均分給所有節點。
+    """
+    n = graph.n
+    if n == 0:
+        return np.zeros(0)
+    A = graph.adjacency()
+    if not directed:
+        A = A + A.T
+    out = np.asarray(A.sum(axis=1)).ravel()
+    dangling = out == 0
+    inv = np.divide(1.0, out, out=np.zeros(n), where=~dangling)
+    PT = (sparse.diags(inv) @ A).T.tocsr()
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        x_new = damping * (PT @ x + x[dangling].sum() / n) + (1.0 - damping) / n
+        if np.abs(x_new - x).sum() < tol:
+            return x_new
+        x = x_new
+    return x
+
+
+def _spmm(A: "sparse.csr_matrix", X: np.ndarray) -> np.ndarray:
+    """A @ X；X 大多為 0 時（BFS 前幾層、回推時只有單一層的節點非零）轉成稀疏矩陣只計算非零項"""
+    if np.count_nonzero(X) < SPARSE_DENSITY * X.size:
+        return (A @ sparse.csr_matrix(X)).toarray()
+    return A @ X
+
+
+def sampled_betweenness(graph: SupplyGraph, samples: int = BETWEENNESS_SAMPLES, seed: int = 0,
+                        chunk: int = BETWEENNESS_CHUNK) -> Tuple[np.ndarray, int]:
+    """
+    有向、不加權的介數中心性（正規化到 0-1），回傳 (分數, 實際使用的來源數)
+
+    來源數少於節點數時為 Brandes 抽樣估計（乘上 n / 來源數）。同一批來源的 BFS 與依賴度回推
+    都以「稀疏鄰接矩陣 × 稠密 (節點 × 來源) 矩陣」進行，迭代次數只等於圖的層數。
+    """
+    n = graph.n
+    if n < 3:
+        return np.zeros(n), n
+    B = graph.adjacency(weighted=False)
+    BT = B.T.tocsr()
+    rng = np.random.default_rng(seed)
+    sources = np.arange(n) if n <= samples else rng.choice(n, samples, replace=False)
+    bc = np.zeros(n)
+    for start in range(0, len(sources), chunk):
+        src = sources[start:start + chunk]
+        cols = np.arange(len(src))
+        dist = np.full((n, len(src)), -1, dtype=np.int32)
+        sigma = np.zeros((n, len(src)))
+        dist[src, cols] = 0
+        sigma[src, cols] = 1.0
+        frontier, depth = sigma.copy(), 0
+        while True:
+            nxt = _spmm(BT, frontier)    # 最短路徑數往下一層傳遞
+            nxt[dist >= 0] = 0.0
+            if not nxt.any():
+                break
+            depth += 1
+            dist[nxt > 0] = depth
+            sigma += nxt
+            frontier = nxt
+        delta = np.zeros_like(sigma)
+        safe_sigma = np.where(sigma > 0, sigma, 1.0)
+        for level in range(depth, 0, -1):
+            coef = np.where(dist == level, (1.0 + delta) / safe_sigma, 0.0)
+            mask = dist == level - 1
+            delta[mask] = (sigma * _spmm(B, coef))[mask]
+        delta[src, cols] = 0.0
+        bc += delta.sum(axis=1)
+    bc *= n / len(sources)
+    return bc / ((n - 1) * (n - 2)), len(sources)
+
+
+# ==================== 集中度與單點故障 ====================
+def flow_concentration(nodes: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """各層的 HHI（0-1，越高越集中）、等效節點數與最大節點占比"""
+    out = {}
+    for tier, group in nodes.groupby("tier", sort=False):
+        total = group["throughput"].sum()
+        if total <= 0:
+            continue
+        shares = group["throughput"] / total
+        hhi = float((shares ** 2).sum())
+        top = shares.idxmax()
+        out[tier] = {"nodes": len(group), "hhi": hhi, "effective_nodes": 1.0 / hhi,
+                     "top_node": group.at[top, "name"], "top_share": float(shares[top])}
+    return out
+
+
+def single_points_of_failure(df: pd.DataFrame, codes: pd.DataFrame) -> pd.DataFrame:
+    """
+    每個節點是多少農場 / 零售商的唯一通路
+
+    農場的所有批次都交給同一家包裝廠（或同一分銷商、零售商）時，該節點是這個農場的單點故障；
+    零售商的所有進貨都來自同一節點時亦同。回傳 index 為節點編號，欄位 dependents、dependent_quantity。
+    """
+    tiers = list(codes.columns)
+    weight = _weights(df)
+    parts = []
+    for endpoint in (list(dict.fromkeys([tiers[0], tiers[-1]])) if len(tiers) >= 2 else []):
+        ep = codes[endpoint]
+        for tier in tiers:
+            if tier == endpoint:
+                continue
+            frame = pd.DataFrame({"ep": ep, "node": codes[tier], "w": weight})
+            frame = frame[(frame["ep"] >= 0) & (frame["node"] >= 0)]
+            stats = frame.groupby("ep").agg(unique=("node", "nunique"), node=("node", "first"), w=("w", "sum"))
+            sole = stats[stats["unique"] == 1]
+            parts.append(sole[["node", "w"]])
+    if not parts:
+        return pd.DataFrame(columns=["dependents", "dependent_quantity"])
+    sole = pd.concat(parts)
+    return sole.groupby("node").agg(dependents=("w", "size"), dependent_quantity=("w", "sum"))
+
+
+# ==================== 彙整 ====================
+def node_metrics(df: pd.DataFrame, samples: int = BETWEENNESS_SAMPLES,
+                 seed: int = 0) -> Tuple[SupplyGraph, pd.DataFrame]:
+    """每個節點的 PageRank、介數、流量占比、溫度異常率、單點故障依賴數與燈號"""
+    graph, codes = build_graph(df)
+    nodes = graph.nodes.copy()
+    nodes["pagerank"] = pagerank(graph)
+    nodes["betweenness"], graph_samples = sampled_betweenness(graph, samples, seed)
+    tier_total = nodes.groupby("tier")["throughput"].transform("sum")
+    nodes["flow_share"] = np.divide(nodes["throughput"], tier_total, out=np.zeros(len(nodes)),
+                                    where=tier_total.to_numpy() > 0)
+
+    violations = _violations(df)
+    nodes["violation_rate"] = 0.0
+    if violations is not None:
+        hits = np.zeros(graph.n)
+        for tier in codes.columns:
+            c = codes[tier]
+            valid = (c >= 0).to_numpy()
+            hits += np.bincount(c[valid], weights=violations[valid].astype(float), minlength=graph.n)
+        nodes["violation_rate"] = np.divide(hits, nodes["batches"], out=np.zeros(graph.n),
+                                            where=nodes["batches"].to_numpy() > 0)
+
+    spof = single_points_of_failure(df, codes)
+    nodes["dependents"] = spof["dependents"].reindex(nodes.index, fill_value=0).astype(int)
+    nodes["dependent_quantity"] = spof["dependent_quantity"].reindex(nodes.index, fill_value=0.0)
+
+    red = (nodes["violation_rate"] >= RED_VIOLATION_RATE) | (
+        (nodes["dependents"] > 0) & (nodes["flow_share"] >= RED_FLOW_SHARE))
+    yellow = (nodes["violation_rate"] >= YELLOW_VIOLATION_RATE) | (nodes["dependents"] > 0)
+    nodes["status"] = np.where(red, RED, np.where(yellow, YELLOW, GREEN))
+    nodes.attrs["betweenness_samples"] = graph_samples
+    return graph, nodes
+
+
+def _records(frame: pd.DataFrame, columns: List[str]) -> List[Dict[str, Any]]:
+    return frame[["tier", "name"] + columns].round(6).to_dict(orient="records")
+
+
+def supply_network_analysis(df: pd.DataFrame) -> Dict[str, Any]:
+    """Agent 015：關鍵節點（PageRank）、瓶頸（介數）、流量集中度與單點故障"""
+    if sparse is None:
+        return {"error": "scipy 未安裝，無法計算網絡指標"}
+    if sum(c in df.columns for c in ENTITY_COLUMNS) < 2:
+        return {"error": "資料缺少供應鏈節點欄位（至少需要兩層，例如 farm_name 與 retailer）"}
+    graph, nodes = node_metrics(df)
+    spof = nodes[nodes["dependents"] > 0].sort_values(["dependents", "dependent_quantity"], ascending=False)
+    critical = nodes[nodes["status"] == RED].sort_values("pagerank", ascending=False)
+    return {
+        "nodes": graph.n, "edges": len(graph.src),
+        "tiers": nodes["tier"].value_counts(sort=False).to_dict(),
+        "pagerank_top": _records(nodes.nlargest(TOP_K, "pagerank"), ["pagerank", "flow_share"]),
+        "bottlenecks": _records(nodes[nodes["betweenness"] > 0].nlargest(TOP_K, "betweenness"),
+                                ["betweenness", "flow_share"]),
+        "betweenness_samples": nodes.attrs["betweenness_samples"],
+        "concentration": flow_concentration(nodes),
+        "single_points_of_failure": _records(spof.head(TOP_K * 2), ["dependents", "dependent_quantity",
+                                                                     "flow_share"]),
+        "critical_nodes": _records(critical.head(TOP_K * 2), ["pagerank", "violation_rate", "dependents",
+                                                             "flow_share"]),
+        "status_counts": nodes["status"].value_counts().to_dict(),
+    }
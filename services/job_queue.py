@@ -0,0 +1,365 @@
+# services/job_queue.py - 本地背景工作佇列（SQLite）
+# 31 個代理的完整流程可能跑好幾分鐘；放在 Streamlit script thread 裡執行時，瀏覽器重新整理就會中斷、浪費 token。
+# 這裡把流程改成「送出工作 → 背景 worker 執行 → 介面輪詢 / 重新連上」：
+#   - 工作與每個代理（階段）的輸出都寫在 SQLite，worker 每完成一個代理就寫一次 checkpoint
+#   - worker 以 heartbeat 表示存活；逾時未更新的工作會被重新排入佇列，從最後完成的代理接續
+#   - worker 可以是 Streamlit process 內的背景執行緒（JobWorkerPool），也可以是獨立 process：
+#       python -m services.job_queue worker --workers 2
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from agents.pipeline import Checkpoint, keys_from_env, make_llm, run_all_agents
+from services.agent_cache import AgentCache
+from services.alerts import evaluate_metrics, pipeline_metrics
+
+DEFAULT_DB_PATH = "data/jobs/jobs.db"
+DEFAULT_QUEUE = "default"
+HEARTBEAT_S = 5.0
+STALE_AFTER_S = 60.0          # heartbeat 超過此時間未更新，視為 worker 已中斷
+MAX_ATTEMPTS = 3              # worker 中斷達此次數的工作標記為失敗（例如 OOM），不再自動重試
+POLL_S = 1.0
+ACTIVE_STATES = ("queued", "running")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    queue       TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    params      TEXT NOT NULL,
+    input_path  TEXT NOT NULL,
+    progress    INTEGER NOT NULL DEFAULT 0,
+    message     TEXT NOT NULL DEFAULT '',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    result      TEXT,
+    worker      TEXT,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL,
+    heartbeat   REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue_status ON jobs (queue, status, created_at);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    job_id      TEXT NOT NULL,
+    stage       TEXT NOT NULL,
+    output      TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (job_id, stage)
+);
+"""
+
+
+class JobCancelled(Exception):
+    """工作已被取消，worker 停止執行"""
+
+
+class JobQueue:
+    """SQLite 工作佇列；每次操作開新連線，可在多個執行緒 / process 間共用同一個檔案"""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        self.data_dir = os.path.join(os.path.dirname(path) or ".", "inputs")
+        os.makedirs(self.data_dir, exist_ok=True)
+        with self._connect() as conn:
+            # WAL：worker 寫入 checkpoint 時介面仍可同時讀取進度
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # ---------- 送出與查詢 ----------
+    def submit(self, df: pd.DataFrame, kind: str = "pipeline", params: Optional[Dict[str, Any]] = None,
+               queue: str = DEFAULT_QUEUE) -> str:
+        """保存輸入資料並排入佇列，回傳 job_id"""
+        job_id = uuid.uuid4().hex[:16]
+        input_path = os.path.join(self.data_dir, f"{job_id}.pkl")
+        df.to_pickle(input_path)
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (id, queue, kind, status, params, input_path, created_at) "
+                         "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                         (job_id, queue, kind, json.dumps(params or {}, ensure_ascii=False), input_path, time.time()))
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            stages = [r["stage"] for r in conn.execute(
+                "SELECT stage FROM checkpoints WHERE job_id = ? ORDER BY finished_at", (job_id,))]
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["completed_stages"] = stages
+        return job
+
+    def list_jobs(self, queue: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        sql = "SELECT id, queue, kind, status, progress, message, attempts, created_at, finished_at FROM jobs"
+        args: tuple = ()
+        if queue:
+            sql, args = sql + " WHERE queue = ?", (queue,)
+        with self._connect() as conn:
+            return [dict(r) for r in conn.execute(sql + " ORDER BY created_at DESC LIMIT ?", args + (limit,))]
+
+    def cancel(self, job_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                         "WHERE id = ? AND status IN ('queued', 'running')", (time.time(), job_id))
+
+    def resume(self, job_id: str) -> None:
+        """把失敗或取消的工作重新排入佇列（已完成的代理沿用 checkpoint）"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'queued', error = NULL, finished_at = NULL, attempts = 0 "
+                         "WHERE id = ? AND status IN ('failed', 'cancelled')", (job_id,))
+
+    # ---------- worker 端 ----------
+    def requeue_stale(self, stale_after: float = STALE_AFTER_S, max_attempts: int = MAX_ATTEMPTS) -> int:
+        """
+        heartbeat 逾時的 running 工作重新排入佇列（worker 被終止、伺服器重啟）
+
+        已執行 max_attempts 次仍中斷的工作多半是工作本身讓 worker 當掉（OOM、pool 子程序 segfault），
+        標記為失敗而不再重排，否則會無限重試並佔住該租戶唯一的 worker；使用者仍可手動 resume。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'failed', worker = NULL, finished_at = ?, error = ? "
+                         "WHERE status = 'running' AND heartbeat < ? AND attempts >= ?",
+                         (now, f"worker 執行此工作時中斷 {max_attempts} 次（可能記憶體不足），已停止自動重試",
+                          now - stale_after, max_attempts))
+            return conn.execute("UPDATE jobs SET status = 'queued', worker = NULL "
+                                "WHERE status = 'running' AND heartbeat < ? AND attempts < ?",
+                                (now - stale_after, max_attempts)).rowcount
+
+    def claim(self, worker: str, queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+        """原子地取出最早排入的工作並標記為 running"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, heartbeat = ?, "
+                "started_at = COALESCE(started_at, ?) "
+                "WHERE id = (SELECT id FROM jobs WHERE queue = ? AND status = 'queued' ORDER BY created_at LIMIT 1) "
+                "AND status = 'queued' RETURNING id", (worker, now, now, queue)).fetchone()
+        return self.get(row["id"]) if row else None
+
+    def heartbeat(self, job_id: str, progress: Optional[int] = None, message: Optional[str] = None) -> None:
+        """更新進度；工作已被取消時丟出 JobCancelled"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET heartbeat = ?, progress = COALESCE(?, progress), "
+                         "message = COALESCE(?, message) WHERE id = ?", (time.time(), progress, message, job_id))
+            status = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()["status"]
+        if status == "cancelled":
+            raise JobCancelled(job_id)
+
+    def finish(self, job_id: str, result: Any) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'done', progress = 100, result = ?, finished_at = ? "
+                         "WHERE id = ? AND status = 'running'",
+                         (json.dumps(result, ensure_ascii=False, default=str), time.time(), job_id))
+
+    def fail(self, job_id: str, error: str) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+                         "WHERE id = ? AND status = 'running'", (error, time.time(), job_id))
+
+    # ---------- checkpoint ----------
+    def load_checkpoint(self, job_id: str, stage: str) -> Optional[Any]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT output FROM checkpoints WHERE job_id = ? AND stage = ?",
+                               (job_id, stage)).fetchone()
+        return json.loads(row["output"]) if row else None
+
+    def save_checkpoint(self, job_id: str, stage: str, output: Any) -> None:
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO checkpoints (job_id, stage, output, finished_at) VALUES (?, ?, ?, ?)",
+                         (job_id, stage, json.dumps(output, ensure_ascii=False, default=str), time.time()))
+
+    def purge(self, older_than_days: float = 30) -> int:
+        """刪除已結束且超過保存期限的工作、checkpoint 與輸入檔"""
+        cutoff = time.time() - older_than_days * 86400
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, input_path FROM jobs WHERE status NOT IN ('queued', 'running') "
+                                "AND finished_at < ?", (cutoff,)).fetchall()
+            for row in rows:
+                conn.execute("DELETE FROM checkpoints WHERE job_id = ?", (row["id"],))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+                if os.path.exists(row["input_path"]):
+                    os.remove(row["input_path"])
+        return len(rows)
+
+
+class JobCheckpoint(Checkpoint):
+    """把 pipeline 各階段的輸出寫進工作佇列的 checkpoints 資料表"""
+
+    def __init__(self, queue: JobQueue, job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+
+    def load(self, stage: str) -> Optional[Any]:
+        return self.queue.load_checkpoint(self.job_id, stage)
+
+    def save(self, stage: str, output: Any) -> None:
+        self.queue.save_checkpoint(self.job_id, stage, output)
+
+
+# ==================== 工作執行 ====================
+def _run_pipeline_job(queue: JobQueue, job: Dict[str, Any], llm_call) -> Dict[str, Any]:
+    df = pd.read_pickle(job["input_path"])
+
+    def on_progress(percent: int, message: str) -> None:
+        queue.heartbeat(job["id"], percent, message)
+
+    # 預設沿用輸入欄位未變的代理輸出；params={"memoize": False} 時全部重算
+    params = job["params"]
+    memo = AgentCache() if params.get("memoize", True) else None
+    # 異常偵測基線依佇列（介面上每組金鑰一個佇列，即租戶）分開保存，不會被其他租戶的資料更新
+    result = run_all_agents(df, llm_call, params.get("model", "gpt-4o"), progress=on_progress,
+                            checkpoint=JobCheckpoint(queue, job["id"]), memo=memo,
+                            map_reduce=params.get("map_reduce", False),
+                            baseline=params.get("baseline", job["queue"]))
+    # agents5.yaml monitoring.alerts：代理執行過慢或失敗率過高時附上通知
+    result["alerts"] = evaluate_metrics(pipeline_metrics(result))
+    return result
+
+
+# 工作類型 → 執行函式 (queue, job, llm_call) -> 可 json.dumps 的結果
+JOB_HANDLERS: Dict[str, Callable[[JobQueue, Dict[str, Any], Any], Any]] = {
+    "pipeline": _run_pipeline_job,
+}
+
+
+class JobWorkerPool:
+    """
+    背景 worker 執行緒
+
+    pool = JobWorkerPool(JobQueue(), llm_call=provider, workers=2).start()
+    job_id = pool.queue.submit(df, params={"model": "gpt-4o"}, queue=pool.name)
+    """
+
+    def __init__(self, queue: JobQueue, llm_call=None, workers: int = 2, name: str = DEFAULT_QUEUE,
+                 poll_s: float = POLL_S):
+        self.queue = queue
+        self.llm_call = llm_call
+        self.workers = workers
+        self.name = name
+        self.poll_s = poll_s
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> "JobWorkerPool":
+        self.queue.requeue_stale()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, args=(f"{self.name}-{os.getpid()}-{i}",),
+                                      name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _loop(self, worker: str) -> None:
+        while not self._stop.is_set():
+            job = self.queue.claim(worker, self.name)
+            if job is None:
+                self.queue.requeue_stale()
+                self._stop.wait(self.poll_s)
+                continue
+            self.run_job(job)
+
+    def run_job(self, job: Dict[str, Any]) -> None:
+        # 長時間沒有進度回報的階段（例如等待 LLM）也要持續更新 heartbeat，避免被誤判為中斷
+        beating = threading.Event()
+
+        def beat() -> None:
+            while not beating.wait(HEARTBEAT_S):
+                try:
+                    self.queue.heartbeat(job["id"])
+                except JobCancelled:
+                    return
+
+        threading.Thread(target=beat, daemon=True).start()
+        try:
+            handler = JOB_HANDLERS[job["kind"]]
+            self.queue.finish(job["id"], handler(self.queue, job, self.llm_call))
+        except JobCancelled:
+            pass
+        except Exception as e:
+            self.queue.fail(job["id"], f"{type(e).__name__}: {e}")
+        finally:
+            beating.set()
+
+
+def wait_for_job(queue: JobQueue, job_id: str, timeout: Optional[float] = None,
+                 poll_s: float = POLL_S) -> Dict[str, Any]:
+    """阻塞等待工作結束（CLI / 測試用；介面端應改用 get() 輪詢）"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        job = queue.get(job_id)
+        if job is None or job["status"] not in ACTIVE_STATES:
+            return job
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(f"工作 {job_id} 未在 {timeout:.0f} 秒內完成（{job['status']}，{job['progress']}%）")
+        time.sleep(poll_s)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="31 個代理背景工作佇列")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    worker = sub.add_parser("worker", help="執行背景 worker（API Key 取自環境變數）")
+    worker.add_argument("--workers", type=int, default=2)
+    worker.add_argument("--queue", default=DEFAULT_QUEUE)
+    submit = sub.add_parser("submit", help="送出資料檔")
+    submit.add_argument("path")
+    submit.add_argument("--model", default="gpt-4o")
+    submit.add_argument("--queue", default=DEFAULT_QUEUE)
+    submit.add_argument("--map-reduce", action="store_true", help="溫度異常批次以 map-reduce 完整分析")
+    status = sub.add_parser("status", help="列出最近的工作")
+    status.add_argument("job_id", nargs="?")
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(args.db)
+    if args.command == "worker":
+        pool = JobWorkerPool(queue, make_llm(keys_from_env()), args.workers, args.queue).start()
+        print(f"worker 已啟動（{args.workers} 個執行緒，佇列 {args.queue}），Ctrl+C 結束")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pool.stop()
+    elif args.command == "submit":
+        df = pd.read_csv(args.path) if args.path.endswith(".csv") else pd.read_json(args.path)
+        print(queue.submit(df, params={"model": args.model, "map_reduce": args.map_reduce}, queue=args.queue))
+    elif args.job_id:
+        job = queue.get(args.job_id)
+        print(json.dumps({k: v for k, v in (job or {}).items() if k != "result"}, ensure_ascii=False, indent=2))
+    else:
+        for job in queue.list_jobs():
+            created = datetime.fromtimestamp(job["created_at"]).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{job['id']}  {job['status']:<9} {job['progress']:>3}%  {created}  {job['message']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# services/local_compute.py - 統計分析代理（Agent 007-013）與供應鏈網絡分析（Agent 015）本地運算後端
+# 這些代理的工作都是 CPU 運算，直接在本機以 process pool 平行計算，
+# 回傳結構化 JSON 給報告代理，不再請 LLM 口述數字。
+
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from services.association_rules import mine_batch_rules
+from services.clustering import cluster_batches
+from services.forecasting import forecast_farms
+from services.graph_analytics import supply_network_analysis
+from utils.features import (
+    ENTITY_COLUMNS,
+    find_quantity_column,
+    find_temp_column,
+    stage_delays,
+)
+from utils.hashing import jsonify_nested
+from utils.serialization import to_jsonable
+from utils.shared_frame import SharedFrame
+
+TOP_K = 5
+ALPHA = 0.05
+
+# worker 端的資料集（initializer attach 共享記憶體，不複製資料）
+_FRAME: Optional[pd.DataFrame] = None
+
+
+def _numeric_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """數值欄位 + 階段間隔（小時），布林欄位不列入"""
+    numeric = df.select_dtypes(include="number")
+    return pd.concat([numeric, stage_delays(df)], axis=1)
+
+
+def _violation_mask(df: pd.DataFrame) -> Optional[pd.Series]:
+    if "temperature_violation" in df.columns:
+        return df["temperature_violation"].fillna(False).astype(bool)
+    temp_col = find_temp_column(df)
+    if temp_col:
+        return (df[temp_col] > 8) | (df[temp_col] < 2)
+    return None
+
+
+# ==================== 各代理的本地計算 ====================
+def descriptive_statistics(df: pd.DataFrame) -> Dict[str, Any]:
+    """Agent 007：描述性統計"""
+    numeric = _numeric_frame(df)
+    numeric_stats = {}
+    for col in numeric.columns:
+        s = numeric[col].dropna()
+        if s.empty:
+            continue
+        q = s.quantile([0.25, 0.5, 0.75])
+        numeric_stats[col] = {
+            "count": len(s), "mean": s.mean(), "std": s.std(), "min": s.min(),
+            "q25": q[0.25], "median": q[0.5], "q75": q[0.75], "max": s.max(),
+            "skew": s.skew(), "kurtosis": s.kurt(),
+        }
+    categorical = {}
+    for col in df.select_dtypes(exclude=["number", "datetime", "bool"]).columns:
+        # 巢狀 JSON 讀入的 dict / list 值以 JSON 文字計數
+        counts = jsonify_nested(df[col]).value_counts()
+        categorical[col] = {"unique": len(counts), "top": counts.head(TOP_K).to_dict()}
+    return {"rows": len(df), "numeric": numeric_stats, "categorical": categorical}
+
+
+def stage_interval_analysis(df: pd.DataFrame, max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """Agent 008：產蛋→包裝→運輸等階段間隔、每日產量趨勢與各農場 7/30/90 天預測（max_workers 為預測的 process 數）"""
+    delays = stage_delays(df)
+    intervals = {}
+    for col in delays.columns:
+        s = delays[col].dropna()
+        if s.empty:
+            continue
+        intervals[col] = {
+            "mean_h": s.mean(), "median_h": s.median(), "p95_h": s.quantile(0.95),
+            "negative": int((s < 0).sum()), "over_24h": int((s > 24).sum()),
+        }
+    trend = {}
+    qty_col = find_quantity_column(df)
+    if "laying_date" in df.columns:
+        daily = (df.groupby(df["laying_date"].dt.floor("D"))[qty_col].sum() if qty_col
+                 else df.groupby(df["laying_date"].dt.floor("D")).size())
+        if len(daily) >= 2:
+            x = (daily.index - daily.index[0]).days.to_numpy(dtype=float)
+            slope = np.polyfit(x, daily.to_numpy(dtype=float), 1)[0]
+            trend = {"days": len(daily), "daily_mean": daily.mean(), "slope_per_day": slope}
+    return {"intervals": intervals, "daily_trend": trend, "forecast": forecast_farms(df, max_workers=max_workers)}
+
+
+def root_cause_breakdown(df: pd.DataFrame) -> Dict[str, Any]:
+    """Agent 011：依供應鏈節點拆解溫度異常率，找出高於整體的節點"""
+    mask = _violation_mask(df)
+    if mask is None or mask.sum() == 0:
+        return {"overall_rate": 0.0, "by_node": {}}
+    overall = mask.mean()
+    by_node = {}
+    for col in [c for c in ENTITY_COLUMNS if c in df.columns]:
+        grouped = mask.groupby(df[col], observed=True).agg(["mean", "sum", "size"])
+        grouped = grouped[grouped["sum"] > 0].sort_values("mean", ascending=False).head(TOP_K)
+        by_node[col] = [
+            {"node": name, "rate": row["mean"], "violations": row["sum"],
+             "batches": row["size"], "lift": row["mean"] / overall}
+            for name, row in grouped.iterrows()
+        ]
+    return {"overall_rate": overall, "violations": int(mask.sum()), "by_node": by_node}
+
+
+def correlation_analysis(df: pd.DataFrame) -> Dict[str, Any]:
+    """Agent 012：Pearson / Spearman 相關係數，列出 |r| 最高的變數組合"""
+    numeric = _numeric_frame(df).dropna(axis=1, how="all")
+    numeric = numeric.loc[:, numeric.nunique() > 1]
+    if numeric.shape[1] < 2:
+        return {"pairs": []}
+    pearson = numeric.corr(method="pearson")
+    spearman = numeric.corr(method="spearman")
+    cols = list(numeric.columns)
+    pairs = [
+        {"x": a, "y": b, "pearson": pearson.loc[a, b], "spearman": spearman.loc[a, b]}
+        for i, a in enumerate(cols) for b in cols[i + 1:]
+        if pd.notna(pearson.loc[a, b])
+    ]
+    pairs.sort(key=lambda p: abs(p["pearson"]), reverse=True)
+    return {"pairs": pairs[:TOP_K * 2], "strong": [p for p in pairs if abs(p["pearson"]) > 0.5]}
+
+
+def hypothesis_tests(df: pd.DataFrame) -> Dict[str, Any]:
+    """Agent 013：農場間差異檢定（ANOVA、Welch t、卡方獨立性）"""
+    try:
+        from scipy import stats
+    except ImportError:
+        return {"error": "scipy 未安裝，無法計算 p 值"}
+
+    tests = {}
+    if "farm_name" not in df.columns:
+        return tests
+    metric = find_temp_column(df) or find_quantity_column(df)
+    if metric:
+        groups = [g.dropna().to_numpy(dtype=float) for _, g in df.groupby("farm_name", observed=True)[metric]]
+        groups = [g for g in groups if len(g) >= 2]
+        if len(groups) >= 2:
+            f_stat, p = stats.f_oneway(*groups)
+            tests["anova"] = {"metric": metric, "farms": len(groups), "f": f_stat, "p_value": p,
+                              "significant": bool(p < ALPHA)}
+            a, b = sorted(groups, key=len, reverse=True)[:2]
+            t_stat, p = stats.ttest_ind(a, b, equal_var=False)
+            pooled = math.sqrt((a.var(ddof=1) + b.var(ddof=1)) / 2) or float("nan")
+            tests["welch_t"] = {"metric": metric, "t": t_stat, "p_value": p,
+                                "cohens_d": (a.mean() - b.mean()) / pooled, "significant": bool(p < ALPHA)}
+    mask = _violation_mask(df)
+    if mask is not None and mask.any() and not mask.all():
+        table = pd.crosstab(df["farm_name"], mask)
+        if table.shape[0] >= 2:
+            chi2, p, dof, _ = stats.chi2_contingency(table)
+            tests["chi_square"] = {"variables": ["farm_name", "temperature_violation"], "chi2": chi2,
+                                   "dof": dof, "p_value": p, "significant": bool(p < ALPHA)}
+    return tests
+
+
+LOCAL_AGENTS: Dict[str, Callable[[pd.DataFrame], Dict[str, Any]]] = {
+    "agent_007": descriptive_statistics,
+    "agent_008": stage_interval_analysis,
+    "agent_009": cluster_batches,
+    "agent_010": mine_batch_rules,
+    "agent_011": root_cause_breakdown,
+    "agent_012": correlation_analysis,
+    "agent_013": hypothesis_tests,
+    "agent_015": supply_network_analysis,
+}
+
+# 內部會再開 process pool 的代理（接受 max_workers）；在 process pool 的 worker 內一律傳 1，
+# 依序執行時傳入呼叫端的 max_workers，外層設 1（避免超額訂閱）時內層也不會再平行
+NESTED_PARALLEL = {"agent_008", "agent_009"}
+
+# 各代理讀取的欄位（services/agent_cache.py 的 resolve_inputs 展開 "@" 群組）；
+# 只有這些欄位的內容變動時才需要重算，修改其他欄位會直接沿用快取的輸出
+AGENT_INPUTS: Dict[str, Tuple[str, ...]] = {
+    "agent_007": ("*",),
+    "agent_008": ("@stage_dates", "@quantity", "farm_name"),
+    "agent_009": ("@stage_dates", "@temperature", "@quantity", "batch_id", "farm_name"),
+    "agent_010": ("farm_name", "packing_facility", "distributor", "@stage_dates",
+                  "temperature_violation", "@temperature"),
+    "agent_011": ("@entities", "temperature_violation", "@temperature"),
+    "agent_012": ("@numeric", "@stage_dates"),
+    "agent_013": ("farm_name", "@temperature", "@quantity", "temperature_violation"),
+    "agent_015": ("@entities", "@quantity", "temperature_violation", "@temperature"),
+}
+
+
+# ==================== Process pool 執行 ====================
+def _init_worker(shared: SharedFrame) -> None:
+    global _FRAME
+    _FRAME = shared.to_dataframe()
+
+
+def _run_agent(agent_id: str, df: Optional[pd.DataFrame] = None, max_workers: Optional[int] = 1) -> Dict[str, Any]:
+    start = time.perf_counter()
+    kwargs = {"max_workers": max_workers} if agent_id in NESTED_PARALLEL else {}
+    try:
+        output = LOCAL_AGENTS[agent_id](_FRAME if df is None else df, **kwargs)
+        status = "ok"
+    except Exception as e:
+        output, status = {"error": str(e)}, "error"
+    return {"agent_id": agent_id, "status": status,
+            "elapsed_s": round(time.perf_counter() - start, 3), "output": to_jsonable(output)}
+
+
+def run_local_agents(data: Union[pd.DataFrame, SharedFrame], agent_ids: Optional[Iterable[str]] = None,
+                     max_workers: Optional[int] = None,
+                     on_result: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    平行執行本地統計代理
+
+    Args:
+        data: 已清理的批次資料，或已建立的 SharedFrame（多個階段共用同一份共享記憶體）
+        agent_ids: 要執行的代理（預設為全部已註冊的本地代理）
+        max_workers: process 數量，1 表示在目前 process 依序執行（代理內部也不再平行）
+        on_result: 每個代理完成時立即呼叫（例如寫入 checkpoint），不必等整批結束
+
+    Returns:
+        {agent_id: {"status", "elapsed_s", "output"}}，output 可直接 json.dumps
+    """
+    ids: List[str] = [a for a in (LOCAL_AGENTS if agent_ids is None else agent_ids) if a in LOCAL_AGENTS]
+    if not ids:
+        return {}
+    on_result = on_result or (lambda result: None)
+    workers = min(max_workers or os.cpu_count() or 1, len(ids))
+    results: Dict[str, Dict[str, Any]] = {}
+    if workers <= 1:
+        df = data.to_dataframe() if isinstance(data, SharedFrame) else data
+        for a in ids:
+            results[a] = _run_agent(a, df, max_workers)
+            on_result(results[a])
+        return results
+
+    shared = data if isinstance(data, SharedFrame) else SharedFrame.from_dataframe(data)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared,)) as pool:
+            for future in as_completed([pool.submit(_run_agent, a) for a in ids]):
+                result = future.result()
+                results[result["agent_id"]] = result
+                on_result(result)
+        return {a: results[a] for a in ids}
+    finally:
+        if shared is not data:
+            shared.unlink()
@@ -0,0 +1,255 @@
+# services/map_reduce.py - 超過上下文視窗的資料集：分區 map-reduce 分析
+# 報告提示詞原本只放得下前幾百筆異常批次（app.py 則把整份 JSON 壓縮到視窗內），資料一大就有批次被省略。
+# 這裡改成分層彙整，任意大小的資料都完整涵蓋：
+#   1. 分區：依「農場 × 產蛋月份」分組，小分區依序打包、過大的分區依列切開，每個區塊不超過固定 token 預算
+#   2. map：每個區塊各送一次代理提示詞（並行數有上限），得到部分報告
+#   3. reduce：部分報告依上下文視窗分組彙整，逐層合併到只剩一份
+# 每次呼叫都以「提示詞 + 模型」為鍵寫入 AgentCache，重跑或中斷後只補送缺少的區塊。
+#
+#   result = map_reduce(violations, llm, map_prompt=lambda label, text: ..., reduce_prompt=lambda parts: ...)
+#   result["summary"], result["coverage"]
+
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from services.agent_cache import AgentCache, text_key
+from utils.features import ENTITY_COLUMNS
+from utils.llm import MAX_TOKENS
+from utils.token_budget import PromptTooLargeError, compact_text, count_tokens, estimate, model_spec
+
+CHUNK_TOKENS = 6_000        # 每個 map 區塊的資料 token 上限（小區塊注意力較集中，也能多開並行）
+MAX_CONCURRENCY = 4         # 同時送出的 LLM 請求上限
+REDUCE_FANIN = 8            # 每次 reduce 最多合併幾份部分報告
+MIN_PART_TOKENS = 200       # reduce 時每份部分報告至少保留的 token 數
+
+# 分區標籤 + 區塊資料 → map 提示詞；[(標籤, 部分報告)] → reduce 提示詞
+MapPrompt = Callable[[str, str], str]
+ReducePrompt = Callable[[List[Tuple[str, str]]], str]
+
+
+@dataclass
+class Chunk:
+    label: str
+    partitions: List[str]
+    rows: int
+    text: str
+
+
+def _silent(percent: int, message: str) -> None:
+    pass
+
+
+# ==================== 分區與打包 ====================
+def partition_keys(df: pd.DataFrame) -> List[pd.Series]:
+    """預設分區鍵：最上游的供應鏈節點（通常是 farm_name）與產蛋月份"""
+    keys = []
+    entity = next((c for c in ENTITY_COLUMNS if c in df.columns), None)
+    if entity:
+        keys.append(df[entity].astype("string").fillna("（未知）").rename(entity))
+    if "laying_date" in df.columns:
+        month = pd.to_datetime(df["laying_date"], errors="coerce").dt.to_period("M").astype("string")
+        keys.append(month.fillna("（無日期）").rename("month"))
+    return keys
+
+
+def partition_frame(df: pd.DataFrame, by: Optional[Sequence[str]] = None) -> List[Tuple[str, pd.DataFrame]]:
+    """依 by 欄位（預設 partition_keys）分組，回傳 [(標籤, 分區)]，標籤如「快樂農場 / 2025-11」"""
+    keys = [df[c] for c in by if c in df.columns] if by else partition_keys(df)
+    if not keys:
+        return [("全部", df)]
+    return [(" / ".join(str(k) for k in (key if isinstance(key, tuple) else (key,))), part)
+            for key, part in df.groupby(keys, sort=True, observed=True, dropna=False)]
+
+
+def build_chunks(df: pd.DataFrame, model: str = "gpt-4o", chunk_tokens: int = CHUNK_TOKENS,
+                 by: Optional[Sequence[str]] = None) -> List[Chunk]:
+    """
+    分區後打包成不超過 chunk_tokens 的區塊（CSV，每個分區各有標題列）
+
+    相鄰的小分區合併成同一個區塊以減少呼叫次數；單一分區超過預算時依列平均切開。
+    """
+    header = ",".join(str(c) for c in df.columns)
+    chunks: List[Chunk] = []
+    pending: List[Tuple[str, str, int]] = []
+    pending_tokens = 0
+
+    def flush() -> None:
+        nonlocal pending, pending_tokens
+        if pending:
+            label = pending[0][0] if len(pending) == 1 else f"{pending[0][0]} … {pending[-1][0]}"
+            text = "\n\n".join(f"### {lbl}（{rows} 筆）\n{header}\n{body}" for lbl, body, rows in pending)
+            chunks.append(Chunk(label, [p[0] for p in pending], sum(p[2] for p in pending), text))
+        pending, pending_tokens = [], 0
+
+    for label, part in partition_frame(df, by):
+        body = part.to_csv(index=False, header=False).rstrip("\n")
+        tokens = count_tokens(body, model)
+        if tokens > chunk_tokens:
+            flush()
+            lines = body.splitlines()
+            n = math.ceil(tokens / chunk_tokens)
+            size = math.ceil(len(lines) / n)
+            for i, start in enumerate(range(0, len(lines), size), 1):
+                piece = lines[start:start + size]
+                chunks.append(Chunk(f"{label}（{i}/{n}）", [label], len(piece),
+                                    f"### {label}（第 {i}/{n} 段，{len(piece)} 筆）\n{header}\n" + "\n".join(piece)))
+            continue
+        if pending_tokens + tokens > chunk_tokens:
+            flush()
+        pending.append((label, body, len(part)))
+        pending_tokens += tokens
+    flush()
+    return chunks
+
+
+# ==================== LLM 呼叫 ====================
+def _complete(llm_call, prompt: str, model: str, cache_model: str, memo: Optional[AgentCache],
+              stage: str) -> Tuple[str, bool]:
+    """回傳 (回應, 是否來自快取)"""
+    key = text_key(prompt, cache_model)
+    cached = memo.get(stage, key) if memo else None
+    if cached is not None:
+        return cached, True
+    text = llm_call(prompt, model)
+    if memo:
+        memo.put(stage, key, text)
+    return text, False
+
+
+def _run_all(llm_call, prompts: List[str], model: str, cache_model: str, memo: Optional[AgentCache],
+             stage: str, max_concurrency: int,
+             on_done: Callable[[int], None]) -> Tuple[List[Optional[str]], List[Tuple[int, str]], int]:
+    """並行送出（最多 max_concurrency 個），回傳 (依序的回應（失敗為 None）, [(索引, 錯誤)], 快取命中數)"""
+    outputs: List[Optional[str]] = [None] * len(prompts)
+    errors: List[Tuple[int, str]] = []
+    hits = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(prompts)))) as pool:
+        futures = {pool.submit(_complete, llm_call, p, model, cache_model, memo, stage): i
+                   for i, p in enumerate(prompts)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                outputs[i], cached = future.result()
+                hits += cached
+            except Exception as e:
+                errors.append((i, f"{type(e).__name__}: {e}"))
+            on_done(i)
+    return outputs, sorted(errors), hits
+
+
+def _reduce_groups(parts: List[Tuple[str, str]], budget: int, model: str) -> List[List[Tuple[str, str]]]:
+    """相鄰的部分報告依 token 預算分組，每組至少 2 份（放不下時壓縮各份），才能保證每層都變少"""
+    groups: List[List[Tuple[str, str]]] = []
+    current: List[Tuple[str, str]] = []
+    used = 0
+    for label, text in parts:
+        tokens = count_tokens(text, model)
+        if current and (len(current) >= REDUCE_FANIN or (used + tokens > budget and len(current) >= 2)):
+            groups.append(current)
+            current, used = [], 0
+        current.append((label, text))
+        used += tokens
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
+    fitted = []
+    for group in groups:
+        if sum(count_tokens(text, model) for _, text in group) > budget:
+            share = max(budget // len(group), MIN_PART_TOKENS)
+            group = [(label, compact_text(text, share, model)) for label, text in group]
+        fitted.append(group)
+    return fitted
+
+
+def map_reduce(df: pd.DataFrame, llm_call, map_prompt: MapPrompt, reduce_prompt: ReducePrompt,
+               model: str = "gpt-4o", by: Optional[Sequence[str]] = None, chunk_tokens: int = CHUNK_TOKENS,
+               max_concurrency: int = MAX_CONCURRENCY, max_output_tokens: Optional[int] = None,
+               memo: Optional[AgentCache] = None, stage: str = "map_reduce",
+               progress: Optional[Callable[[int, str], None]] = None) -> Dict[str, Any]:
+    """
+    分區 map-reduce 分析
+
+    Args:
+        llm_call: llm_call(prompt, model) 介面
+        map_prompt: (分區標籤, 區塊 CSV) → 提示詞
+        reduce_prompt: [(標籤, 部分報告)] → 提示詞
+        by: 分區欄位（預設為農場 × 產蛋月份）
+        memo: 區塊與彙整結果的快取；stage 為快取中的代理名稱（例如 "agent_021:map"）
+        progress: callback(百分比, 說明)
+
+    Returns:
+        {"summary", "coverage", "chunks", "partitions", "rows", "calls", "cached", "levels", "failed", "estimate"}
+
+    Raises:
+        PromptTooLargeError: 提示詞本身（不含資料）就放不下模型上下文視窗
+    """
+    progress = progress or _silent
+    target_model = llm_call.resolve_model(model) if hasattr(llm_call, "resolve_model") else model
+    spec = model_spec(target_model)
+    output_tokens = min(max_output_tokens or getattr(llm_call, "max_tokens", None) or MAX_TOKENS, spec["max_output"])
+    overhead = count_tokens(map_prompt("", ""), target_model)
+    budget = min(chunk_tokens, spec["context"] - overhead - output_tokens)
+    if budget < MIN_PART_TOKENS:
+        raise PromptTooLargeError(f"{stage} 提示詞約 {overhead:,} tokens，{target_model} 上下文視窗放不下資料區塊")
+
+    chunks = build_chunks(df, target_model, budget, by)
+    prompts = [map_prompt(c.label, c.text) for c in chunks]
+    # 送出前估算：map 並行執行，每層 reduce 也並行，牆鐘時間約為「批數 × 單次延遲」
+    estimates = [estimate(p, target_model, output_tokens) for p in prompts]
+    reduce_levels = math.ceil(math.log(len(chunks), REDUCE_FANIN)) if len(chunks) > 1 else 0
+    rounds = math.ceil(len(chunks) / max(max_concurrency, 1)) + reduce_levels
+    plan = {"map_calls": len(chunks), "reduce_levels": reduce_levels,
+            "prompt_tokens": sum(e.prompt_tokens for e in estimates),
+            "cost_usd": round(sum(e.cost_usd for e in estimates), 4),
+            "wall_s": round(rounds * max((e.latency_s for e in estimates), default=0.0), 1)}
+
+    done = [0]
+
+    def on_map(i: int) -> None:
+        done[0] += 1
+        progress(int(done[0] / len(chunks) * 80), f"🗂️ map {done[0]}/{len(chunks)}：{chunks[i].label}")
+
+    outputs, errors, hits = _run_all(llm_call, prompts, model, target_model, memo, f"{stage}:map",
+                                     max_concurrency, on_map)
+    failed = [{"label": chunks[i].label, "rows": chunks[i].rows, "error": e} for i, e in errors]
+    parts = [(c.label, text) for c, text in zip(chunks, outputs) if text is not None]
+    calls = len(chunks)
+    if not parts:
+        raise RuntimeError(f"{stage} 所有區塊皆失敗：{failed[0]['error'] if failed else '沒有資料'}")
+
+    # reduce：每層合併成更少份，直到只剩一份
+    reduce_budget = spec["context"] - count_tokens(reduce_prompt([("", "")]), target_model) - output_tokens
+    level = 0
+    while len(parts) > 1:
+        level += 1
+        groups = _reduce_groups(parts, reduce_budget, target_model)
+        progress(80 + min(level * 5, 15), f"🧩 reduce 第 {level} 層：{len(parts)} → {len(groups)} 份")
+        merged, errors, level_hits = _run_all(llm_call, [reduce_prompt(g) for g in groups], model, target_model,
+                                              memo, f"{stage}:reduce", max_concurrency, lambda i: None)
+        if errors:
+            raise RuntimeError(f"{stage} reduce 第 {level} 層失敗：{errors[0][1]}")
+        hits += level_hits
+        calls += len(groups)
+        parts = [(g[0][0] if len(g) == 1 else f"{g[0][0]} … {g[-1][0]}", text) for g, text in zip(groups, merged)]
+    progress(100, "✅ map-reduce 完成")
+
+    rows = sum(c.rows for c in chunks)
+    missing = sum(f["rows"] for f in failed)
+    return {
+        "summary": parts[0][1],
+        "coverage": round((rows - missing) / rows, 4) if rows else 1.0,
+        "chunks": len(chunks),
+        "partitions": len({p for c in chunks for p in c.partitions}),
+        "rows": rows,
+        "calls": calls,
+        "cached": hits,
+        "levels": level,
+        "failed": failed,
+        "estimate": plan,
+    }
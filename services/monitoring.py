@@ -0,0 +1,482 @@
+# services/monitoring.py - 即時冷鏈監控（Agent 003 / 019 / 021，real_time_monitoring 使用情境）
+# 追蹤本地 NDJSON 檔案或 socket 的事件流（感測器讀數與批次階段事件），每筆事件只做 O(1) 的增量更新：
+# 每個批次一個時間視窗 ring buffer（累計和、平方和、單調佇列維護最小/最大值），
+# 事件到達時立即檢查 2-8°C 安全範圍、溫度超標持續 2 小時（冷鏈中斷）、3σ 溫度跳變與包裝延遲。
+# 每次變動遞增版本號，儀表板只取回上次輪詢後有變動的批次圖塊（changes(since)）。
+#
+#   monitor = Monitor()
+#   MonitorRunner(monitor, "data/stream/events.ndjson").start()    # 或 "tcp://127.0.0.1:9000"
+#   version, tiles = monitor.changes(since=0)
+#   python -m services.monitoring data/stream/events.ndjson --alerts http://127.0.0.1:8765/   # 告警見 services/alerts.py
+#
+# 事件格式（每行一個 JSON）：
+#   {"type": "reading", "batch_id": "B001", "ts": "2025-11-01T08:00:00", "temperature": 4.2, "humidity": 60}
+#   {"type": "batch", "batch_id": "B001", "stage": "packing_date", "ts": 1761984000, "farm_name": "快樂農場"}
+
+import argparse
+import json
+import math
+import os
+import socket
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from services.alerts import AlertDispatcher, make_sink
+from utils.features import SAFE_TEMP_RANGE, STAGE_DATE_COLUMNS
+
+WINDOW_SECONDS = 24 * 3600       # 趨勢小圖：過去 24 小時
+WINDOW_CAPACITY = 1440           # 每批次最多保留的讀數（約每分鐘一筆）
+EXCURSION_LIMIT_SECONDS = 2 * 3600   # 超出 2-8°C 持續 2 小時視為冷鏈中斷
+PACKING_DELAY_HOURS = 24         # 產蛋 → 包裝
+SPIKE_SIGMA = 3.0
+SPIKE_MIN_SAMPLES = 10
+RECENT_EVENTS = 10               # 異常事件流保留最新 10 筆
+POLL_INTERVAL = 0.2              # 追蹤檔案時沒有新資料的等待秒數
+
+GREEN, YELLOW, RED = "green", "yellow", "red"
+_STATUS_RANK = {GREEN: 0, YELLOW: 1, RED: 2}
+
+
+# ==================== 時間視窗 ====================
+class RingWindow:
+    """
+    固定時間跨度與容量的滑動視窗；新增與淘汰皆為攤銷 O(1)
+
+    平均與標準差由累計和/平方和求得，最小/最大值由單調佇列維護，不需每次重掃整個視窗。
+    """
+
+    __slots__ = ("span", "capacity", "_items", "_min", "_max", "_sum", "_sumsq", "_seq")
+
+    def __init__(self, span: float = WINDOW_SECONDS, capacity: int = WINDOW_CAPACITY):
+        self.span = span
+        self.capacity = capacity
+        self._items: Deque[Tuple[int, float, float]] = deque()   # (序號, 時間, 值)
+        self._min: Deque[Tuple[int, float]] = deque()
+        self._max: Deque[Tuple[int, float]] = deque()
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._seq = 0
+
+    def push(self, ts: float, value: float) -> None:
+        seq = self._seq = self._seq + 1
+        self._items.append((seq, ts, value))
+        self._sum += value
+        self._sumsq += value * value
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((seq, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((seq, value))
+        self.evict(ts)
+
+    def evict(self, now: float) -> None:
+        items = self._items
+        cutoff = now - self.span
+        while items and (len(items) > self.capacity or items[0][1] < cutoff):
+            seq, _, value = items.popleft()
+            self._sum -= value
+            self._sumsq -= value * value
+            if self._min[0][0] == seq:
+                self._min.popleft()
+            if self._max[0][0] == seq:
+                self._max.popleft()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self._sum / len(self._items) if self._items else None
+
+    @property
+    def std(self) -> float:
+        n = len(self._items)
+        if n < 2:
+            return 0.0
+        return max(self._sumsq / n - (self._sum / n) ** 2, 0.0) ** 0.5
+
+    @property
+    def min(self) -> Optional[float]:
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self) -> Optional[float]:
+        return self._max[0][1] if self._max else None
+
+    def series(self, points: int = 48) -> List[float]:
+        """趨勢小圖用的降採樣序列"""
+        values = [v for _, _, v in self._items]
+        step = max(len(values) // points, 1)
+        return values[::step][-points:]
+
+
+# ==================== 批次狀態與規則事件 ====================
+@dataclass
+class RuleEvent:
+    """規則觸發（狀態轉換）事件；同一段超標只在開始、達 2 小時、恢復時各發一次"""
+    ts: float
+    batch_id: str
+    rule: str          # temperature_range / cold_chain_break / temperature_spike / packing_delay / stage_order / recovered
+    severity: str      # YELLOW / RED / GREEN
+    message: str
+    value: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"ts": self.ts, "time": _fmt_ts(self.ts), "batch_id": self.batch_id, "rule": self.rule,
+                "severity": self.severity, "message": self.message, "value": self.value}
+
+
+@dataclass
+class BatchState:
+    batch_id: str
+    window: RingWindow = field(default_factory=RingWindow)
+    farm_name: Optional[str] = None
+    stage: Optional[str] = None
+    stages: Dict[str, float] = field(default_factory=dict)
+    temperature: Optional[float] = None
+    humidity: Optional[float] = None
+    last_ts: float = 0.0
+    excursion_start: Optional[float] = None
+    cold_chain_break: bool = False
+    spike: bool = False
+    stage_violation: bool = False
+    status: str = GREEN
+    events: int = 0
+    version: int = 0
+
+    def tile(self) -> Dict[str, Any]:
+        """儀表板圖塊（Agent 019：即時指標、燈號、趨勢小圖）"""
+        w = self.window
+        return {
+            "batch_id": self.batch_id, "farm_name": self.farm_name, "stage": self.stage, "status": self.status,
+            "temperature": self.temperature, "humidity": self.humidity, "updated": _fmt_ts(self.last_ts),
+            "excursion_minutes": round((self.last_ts - self.excursion_start) / 60) if self.excursion_start else 0,
+            "mean": w.mean, "min": w.min, "max": w.max, "readings": len(w), "trend": w.series(),
+            "version": self.version,
+        }
+
+
+def _fmt_ts(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else ""
+
+
+def _parse_ts(value: Any) -> float:
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        ts = float(value)
+    else:
+        try:
+            ts = datetime.fromisoformat(str(value)).timestamp()
+        except ValueError:
+            ts = float(value)
+    if not math.isfinite(ts):
+        raise ValueError(f"非有限的時間戳記：{value}")
+    return ts
+
+
+# ==================== 監控器 ====================
+class Monitor:
+    """
+    增量式監控狀態；ingest 由讀取執行緒呼叫，changes / summary 由儀表板呼叫（以鎖保護）
+
+    on_event 會收到每個規則事件（例如交給告警通知），在持有鎖的情況下呼叫，應盡快返回。
+    """
+
+    def __init__(self, window_seconds: float = WINDOW_SECONDS, capacity: int = WINDOW_CAPACITY,
+                 on_event: Optional[Callable[[RuleEvent], None]] = None):
+        self.window_seconds = window_seconds
+        self.capacity = capacity
+        self.on_event = on_event
+        self.batches: Dict[str, BatchState] = {}
+        self.recent: Deque[RuleEvent] = deque(maxlen=RECENT_EVENTS)
+        self.version = 0
+        self.ingested = 0
+        self.rejected = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    # ---------- 寫入 ----------
+    def ingest_line(self, line: str) -> List[RuleEvent]:
+        line = line.strip()
+        if not line:
+            return []
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            self.rejected += 1
+            return []
+        return self.ingest(event)
+
+    def ingest(self, event: Dict[str, Any]) -> List[RuleEvent]:
+        # 合法 JSON 不一定是物件（5、[1, 2]）；batch_id 也可能是 list / dict 而無法當作鍵
+        batch_id = event.get("batch_id") if isinstance(event, dict) else None
+        if isinstance(batch_id, bool) or not isinstance(batch_id, (str, int)) or batch_id == "":
+            self.rejected += 1
+            return []
+        batch_id = str(batch_id)
+        try:
+            ts = _parse_ts(event.get("ts"))
+        except (TypeError, ValueError):
+            self.rejected += 1
+            return []
+        with self._lock:
+            state = self.batches.get(batch_id)
+            if state is None:
+                state = self.batches[batch_id] = BatchState(batch_id, RingWindow(self.window_seconds,
+                                                                                 self.capacity))
+            fired: List[RuleEvent] = []
+            if event.get("farm_name"):
+                state.farm_name = event["farm_name"]
+            if event.get("type") == "batch" or "stage" in event:
+                self._on_stage(state, event.get("stage"), ts, fired)
+            if event.get("temperature") is not None:
+                try:
+                    temp = float(event["temperature"])
+                    if not math.isfinite(temp):
+                        # json.loads 接受 NaN / Infinity；一筆進入視窗就會讓累計和永久變成 nan
+                        raise ValueError(temp)
+                    self._on_reading(state, ts, temp, fired)
+                except (TypeError, ValueError):
+                    self.rejected += 1
+            if event.get("humidity") is not None:
+                state.humidity = event["humidity"]
+            state.last_ts = max(state.last_ts, ts)
+            state.events += 1
+            state.status = self._status(state)
+            self.version += 1
+            state.version = self.version
+            self.ingested += 1
+            for rule_event in fired:
+                self.recent.append(rule_event)
+                if self.on_event is not None:
+                    self.on_event(rule_event)
+        return fired
+
+    def _on_reading(self, state: BatchState, ts: float, temp: float, fired: List[RuleEvent]) -> None:
+        window = state.window
+        low, high = SAFE_TEMP_RANGE
+        # 3σ 跳變以加入本筆之前的視窗判斷，避免異常值稀釋自己
+        if len(window) >= SPIKE_MIN_SAMPLES and window.std > 0:
+            spike = abs(temp - window.mean) > SPIKE_SIGMA * window.std
+            if spike and not state.spike:
+                fired.append(RuleEvent(ts, state.batch_id, "temperature_spike", YELLOW,
+                                       f"溫度突變 {temp:.1f}°C（視窗平均 {window.mean:.1f}°C）", temp))
+            state.spike = spike
+        window.push(ts, temp)
+        state.temperature = temp
+
+        if temp < low or temp > high:
+            if state.excursion_start is None:
+                state.excursion_start = ts
+                fired.append(RuleEvent(ts, state.batch_id, "temperature_range", YELLOW,
+                                       f"溫度 {temp:.1f}°C 超出 {low:g}-{high:g}°C", temp))
+            elif not state.cold_chain_break and ts - state.excursion_start >= EXCURSION_LIMIT_SECONDS:
+                state.cold_chain_break = True
+                fired.append(RuleEvent(ts, state.batch_id, "cold_chain_break", RED,
+                                       f"溫度超標已持續 {(ts - state.excursion_start) / 3600:.1f} 小時（冷鏈中斷）",
+                                       temp))
+        elif state.excursion_start is not None:
+            minutes = (ts - state.excursion_start) / 60
+            state.excursion_start = None
+            state.cold_chain_break = False
+            fired.append(RuleEvent(ts, state.batch_id, "recovered", GREEN,
+                                   f"溫度回到安全範圍（超標 {minutes:.0f} 分鐘）", temp))
+
+    def _on_stage(self, state: BatchState, stage: Optional[str], ts: float, fired: List[RuleEvent]) -> None:
+        if stage not in STAGE_DATE_COLUMNS:
+            return
+        state.stages[stage] = ts
+        state.stage = stage
+        order = STAGE_DATE_COLUMNS.index(stage)
+        earlier = [state.stages[s] for s in STAGE_DATE_COLUMNS[:order] if s in state.stages]
+        if earlier and ts < max(earlier):
+            state.stage_violation = True
+            fired.append(RuleEvent(ts, state.batch_id, "stage_order", RED, f"{stage} 早於前一階段（時間倒退）"))
+        if stage == "packing_date" and "laying_date" in state.stages:
+            hours = (ts - state.stages["laying_date"]) / 3600
+            if hours > PACKING_DELAY_HOURS:
+                state.stage_violation = True
+                fired.append(RuleEvent(ts, state.batch_id, "packing_delay", RED,
+                                       f"產蛋到包裝 {hours:.0f} 小時（上限 {PACKING_DELAY_HOURS} 小時）", hours))
+
+    @staticmethod
+    def _status(state: BatchState) -> str:
+        if state.cold_chain_break or state.stage_violation:
+            return RED
+        if state.excursion_start is not None or state.spike:
+            return YELLOW
+        return GREEN
+
+    # ---------- 讀取 ----------
+    def changes(self, since: int = 0, limit: Optional[int] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """上次輪詢（版本 since）之後有變動的批次圖塊，依燈號嚴重度與更新時間排序"""
+        with self._lock:
+            changed = [s for s in self.batches.values() if s.version > since]
+            changed.sort(key=lambda s: (-_STATUS_RANK[s.status], -s.last_ts))
+            tiles = [s.tile() for s in (changed[:limit] if limit else changed)]
+            return self.version, tiles
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {GREEN: 0, YELLOW: 0, RED: 0}
+            for state in self.batches.values():
+                counts[state.status] += 1
+            elapsed = max(time.time() - self.started, 1e-9)
+            return {"version": self.version, "batches": len(self.batches), "events": self.ingested,
+                    "rejected": self.rejected, "events_per_sec": self.ingested / elapsed, "status": counts,
+                    "recent": [e.to_dict() for e in reversed(self.recent)]}
+
+
+# ==================== 事件來源 ====================
+def tail_ndjson(path: str, from_start: bool = True, stop: Optional[threading.Event] = None,
+                poll_interval: float = POLL_INTERVAL) -> Iterator[str]:
+    """逐行追蹤 NDJSON 檔（類似 tail -F）：等待新資料，檔案被截斷或輪替時從頭重讀"""
+    while not os.path.exists(path):
+        if stop is not None and stop.wait(poll_interval):
+            return
+        if stop is None:
+            time.sleep(poll_interval)
+    f = open(path, "r", encoding="utf-8")
+    try:
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        inode = os.fstat(f.fileno()).st_ino
+        partial = ""
+        while stop is None or not stop.is_set():
+            line = f.readline()
+            if line:
+                if not line.endswith("\n"):   # 寫入者還沒寫完這一行
+                    partial += line
+                    continue
+                yield partial + line
+                partial = ""
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                st = None
+            if st is not None and (st.st_ino != inode or st.st_size < f.tell()):
+                f.close()
+                f = open(path, "r", encoding="utf-8")
+                inode, partial = os.fstat(f.fileno()).st_ino, ""
+                continue
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+    finally:
+        f.close()
+
+
+def socket_lines(address: str, stop: Optional[threading.Event] = None) -> Iterator[str]:
+    """連線到本地 TCP 事件流（tcp://host:port）逐行讀取；連線中斷後重試"""
+    host, port = address[len("tcp://"):].rsplit(":", 1)
+    while stop is None or not stop.is_set():
+        try:
+            with socket.create_connection((host, int(port)), timeout=5) as conn:
+                conn.settimeout(1.0)
+                buffer = b""
+                while stop is None or not stop.is_set():
+                    try:
+                        data = conn.recv(65536)
+                    except socket.timeout:
+                        continue
+                    if not data:
+                        break
+                    buffer += data
+                    *lines, buffer = buffer.split(b"\n")
+                    for line in lines:
+                        yield line.decode("utf-8", errors="replace")
+        except OSError:
+            pass
+        if stop is not None:
+            stop.wait(1.0)
+        else:
+            time.sleep(1.0)
+
+
+def open_source(source: str, stop: Optional[threading.Event] = None) -> Iterator[str]:
+    return socket_lines(source, stop) if source.startswith("tcp://") else tail_ndjson(source, stop=stop)
+
+
+class MonitorRunner:
+    """在背景執行緒中把事件來源餵給 Monitor（Streamlit 以 cache_resource 保存，重新執行不會重啟）"""
+
+    def __init__(self, monitor: Monitor, source: str):
+        self.monitor = monitor
+        self.source = source
+        self.error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"monitor-{source}", daemon=True)
+
+    def start(self) -> "MonitorRunner":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @property
+    def alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self) -> None:
+        try:
+            ingest = self.monitor.ingest_line
+            for line in open_source(self.source, self._stop):
+                try:
+                    ingest(line)
+                except Exception:
+                    # 單筆格式異常只記為拒收，不能讓讀取執行緒結束、監控靜默停止
+                    self.monitor.rejected += 1
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+
+def replay(monitor: Monitor, lines: Iterable[str]) -> int:
+    """一次餵入既有事件（測試與基準測試用），回傳處理的行數"""
+    n = 0
+    for line in lines:
+        monitor.ingest_line(line)
+        n += 1
+    return n
+
+
+# ==================== CLI ====================
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="即時冷鏈監控（追蹤 NDJSON 檔或 tcp://host:port 事件流）")
+    parser.add_argument("source", help="NDJSON 檔案路徑或 tcp://host:port")
+    parser.add_argument("--interval", type=float, default=5.0, help="狀態摘要輸出間隔（秒）")
+    parser.add_argument("--alerts", help="告警經去重、合併後送到 webhook URL 或 NDJSON 檔（不指定則逐筆印出規則事件）")
+    args = parser.parse_args(argv)
+
+    def show(event: RuleEvent) -> None:
+        print(f"[{event.severity.upper():<6}] {_fmt_ts(event.ts)} {event.batch_id} {event.message}", flush=True)
+
+    dispatcher = AlertDispatcher(make_sink(args.alerts)).start() if args.alerts else None
+    monitor = Monitor(on_event=dispatcher.submit if dispatcher else show)
+    runner = MonitorRunner(monitor, args.source).start()
+    try:
+        while runner.alive:
+            time.sleep(args.interval)
+            s = monitor.summary()
+            print(f"-- {s['events']:,} 筆事件 · {s['batches']:,} 個批次 · {s['events_per_sec']:,.0f} 筆/秒 · "
+                  f"綠 {s['status'][GREEN]} 黃 {s['status'][YELLOW]} 紅 {s['status'][RED]}", flush=True)
+        if runner.error:
+            print(f"事件來源中斷：{runner.error}")
+    except KeyboardInterrupt:
+        runner.stop()
+    if dispatcher is not None:
+        dispatcher.stop()
+        print(f"告警：收到 {dispatcher.stats['received']:,} 筆 · 抑制 {dispatcher.stats['suppressed']:,} 筆 · "
+              f"送出 {dispatcher.stats['notifications']:,} 則通知")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# services/network_view.py - 大型供應鏈網絡圖的漸進式呈現（PyVis）
+# 十萬個節點直接交給 PyVis / vis.js 會讓瀏覽器卡死。這裡在伺服器端先把節點依「層級 × 地區」聚合成叢集，
+# 瀏覽器只收到目前可見的細節層級：
+#   - 預設只畫叢集（每層每個地區一個節點），邊為叢集間的流量合計
+#   - 展開的叢集才列出成員節點（依流量取前 MAX_MEMBERS 個，其餘合併為「其他」節點）
+#   - 座標在伺服器端算好（分層版面 + 重心排序減少交叉）並關閉物理模擬，開啟時不必在瀏覽器反覆迭代；
+#     版面依資料集指紋存在 AgentCache，同一份資料重新開啟不再重算
+#
+#   view = NetworkView(df)                                # 或 NetworkView(df, metrics=node_metrics(df))
+#   nodes, edges = view.view(expanded={"packing_facility|中部"})
+#   html = render_html(nodes, edges)                      # st.components.v1.html(html, height=760)
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from services.agent_cache import AgentCache, ColumnFingerprints, code_version, resolve_inputs
+from services.graph_analytics import GREEN, RED, STATUS_COLORS, YELLOW, SupplyGraph, node_metrics
+
+REGION_COLUMNS = ["region", "farm_location", "地區", "農場地點"]
+UNKNOWN_REGION = "未知地區"
+MAX_MEMBERS = 150              # 展開一個叢集時最多列出的成員節點
+MAX_VISIBLE_EDGES = 4000       # 送到瀏覽器的邊數上限（依流量保留最大的邊）
+TIER_GAP = 450                 # 層與層的水平距離（px）
+CANVAS_HEIGHT = 2400           # 每一層的總高度（px）
+MIN_SPACING = 14               # 展開成員的最小垂直間距（px）
+LAYOUT_STAGE = "network_layout"
+LAYOUT_INPUTS = ("@entities", "@quantity", *REGION_COLUMNS)
+
+TIER_LABELS = {"farm_name": "農場", "packing_facility": "包裝廠", "distributor": "分銷商", "retailer": "零售商"}
+_STATUS_RANK = {GREEN: 0, YELLOW: 1, RED: 2}
+_RANK_STATUS = {v: k for k, v in _STATUS_RANK.items()}
+
+
+def _region_column(df: pd.DataFrame) -> Optional[str]:
+    return next((c for c in REGION_COLUMNS if c in df.columns), None)
+
+
+def node_regions(df: pd.DataFrame, nodes: pd.DataFrame) -> np.ndarray:
+    """每個節點的地區：流經該節點的批次中最常見的產地（農場即為本身所在地）"""
+    regions = np.full(len(nodes), UNKNOWN_REGION, dtype=object)
+    region_col = _region_column(df)
+    if region_col is None:
+        return regions
+    region_codes, region_names = pd.factorize(df[region_col].astype("string").fillna(UNKNOWN_REGION))
+    for tier in nodes["tier"].unique():
+        members = nodes[nodes["tier"] == tier]
+        ids = pd.Index(members["name"].to_numpy()).get_indexer(df[tier].astype("string").to_numpy())
+        valid = ids >= 0
+        # 以整數配對計數（節點 × 地區），每個節點取次數最多的地區
+        pair = pd.Series(ids[valid].astype(np.int64) * len(region_names) + region_codes[valid])
+        counts = pair.value_counts()
+        node, code = np.divmod(counts.index.to_numpy(), len(region_names))
+        first = ~pd.Series(node).duplicated().to_numpy()    # value_counts 由多到少排序
+        regions[members.index.to_numpy()[node[first]]] = np.asarray(region_names, dtype=object)[code[first]]
+    return regions
+
+
+# ==================== 版面 ====================
+def compute_layout(graph: SupplyGraph, clusters: np.ndarray) -> np.ndarray:
+    """
+    分層版面：x 依層級，y 依叢集帶狀區間；各層依上游鄰居的加權平均 y（重心）排序以減少邊交叉
+
+    叢集先依成員重心的平均排序，叢集內成員再依各自的重心排序並平均分布。回傳 (n, 2) 座標。
+    """
+    n = graph.n
+    pos = np.zeros((n, 2))
+    if n == 0:
+        return pos
+    A = graph.adjacency()
+    tiers = list(dict.fromkeys(graph.nodes["tier"]))
+    tier_of = graph.nodes["tier"].to_numpy()
+    throughput = graph.nodes["throughput"].to_numpy()
+    for level, tier in enumerate(tiers):
+        idx = np.flatnonzero(tier_of == tier)
+        if level == 0:
+            bary = -throughput[idx]
+        else:
+            inflow = A[:, idx]
+            weight = np.asarray(inflow.sum(axis=0)).ravel()
+            bary = np.divide(inflow.T @ pos[:, 1], weight, out=np.full(len(idx), np.inf), where=weight > 0)
+        frame = pd.DataFrame({"node": idx, "cluster": clusters[idx], "bary": bary})
+        finite = frame["bary"].replace(np.inf, np.nan)
+        frame["cluster_bary"] = finite.groupby(frame["cluster"]).transform("mean").fillna(np.inf)
+        frame = frame.sort_values(["cluster_bary", "cluster", "bary"], kind="stable")
+        # 同一叢集的成員相鄰排列，叢集分得的帶狀區間即與成員數成正比
+        step = CANVAS_HEIGHT / len(frame)
+        pos[frame["node"].to_numpy(), 0] = level * TIER_GAP
+        pos[frame["node"].to_numpy(), 1] = (np.arange(len(frame)) + 0.5) * step
+    return pos
+
+
+# ==================== 叢集與可見層級 ====================
+class NetworkView:
+    """
+    伺服器端的網絡圖聚合；view() 依展開的叢集產生要送到瀏覽器的節點與邊
+
+    metrics 為 graph_analytics.node_metrics 的結果（介面端通常已為 Sankey 算過並快取）；
+    版面存在 cache（預設 AgentCache()），cache_layout=False 時每次重算。
+    """
+
+    def __init__(self, df: pd.DataFrame, metrics: Optional[Tuple[SupplyGraph, pd.DataFrame]] = None,
+                 cache: Optional[AgentCache] = None, cache_layout: bool = True):
+        self.graph, self.nodes = metrics if metrics is not None else node_metrics(df)
+        self.regions = node_regions(df, self.nodes)
+        keys = self.nodes["tier"].astype(str).to_numpy() + "|" + self.regions.astype(str)
+        self.cluster_of, self.cluster_keys = pd.factorize(keys)
+        self.positions = self._layout(df, (cache or AgentCache()) if cache_layout else None)
+
+        # 叢集摘要（每個叢集一列）
+        nodes = self.nodes.assign(cluster=self.cluster_of, region=self.regions,
+                                  rank=self.nodes["status"].map(_STATUS_RANK), y=self.positions[:, 1],
+                                  x=self.positions[:, 0])
+        self.clusters = nodes.groupby("cluster").agg(
+            tier=("tier", "first"), region=("region", "first"), members=("name", "size"),
+            throughput=("throughput", "sum"), rank=("rank", "max"), red=("rank", lambda r: int((r == 2).sum())),
+            x=("x", "first"), y=("y", "mean"), y_min=("y", "min"), y_max=("y", "max"))
+        self.clusters["key"] = [self.cluster_keys[i] for i in self.clusters.index]
+        self.clusters["status"] = self.clusters["rank"].map(_RANK_STATUS)
+
+    def _layout(self, df: pd.DataFrame, cache: Optional[AgentCache]) -> np.ndarray:
+        if cache is None:
+            return compute_layout(self.graph, self.cluster_of)
+        key = ColumnFingerprints(df).key(resolve_inputs(df, LAYOUT_INPUTS), code_version(compute_layout))
+        cached = cache.get(LAYOUT_STAGE, key)
+        if cached is not None and len(cached) == self.graph.n:
+            return np.asarray(cached, dtype=float).reshape(-1, 2)
+        pos = compute_layout(self.graph, self.cluster_of)
+        cache.put(LAYOUT_STAGE, key, np.round(pos, 1).tolist())
+        return pos
+
+    def cluster_options(self) -> List[Tuple[str, str]]:
+        """(叢集鍵, 顯示名稱)，依層級與流量排序，供介面選擇要展開的叢集"""
+        ordered = self.clusters.sort_values(["x", "throughput"], ascending=[True, False])
+        return [(row.key, f"{TIER_LABELS.get(row.tier, row.tier)} · {row.region}（{row.members}）")
+                for row in ordered.itertuples()]
+
+    def view(self, expanded: Iterable[str] = (), max_members: int = MAX_MEMBERS,
+             max_edges: int = MAX_VISIBLE_EDGES) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """目前細節層級的 (節點, 邊)；節點 id 為 "c:叢集"、"n:節點" 或 "o:叢集"（展開後未列出的成員）"""
+        n = self.graph.n
+        keys = list(self.cluster_keys)
+        expanded_ids = {keys.index(k) for k in expanded if k in keys}
+        # 每個節點對應到的可見節點編號：叢集 = cluster，成員 = n_clusters + 節點，其他 = n_clusters + n + cluster
+        n_clusters = len(keys)
+        visible = self.cluster_of.astype(np.int64).copy()
+        shown: Dict[int, np.ndarray] = {}
+        for c in expanded_ids:
+            members = np.flatnonzero(self.cluster_of == c)
+            top = members[np.argsort(-self.nodes["throughput"].to_numpy()[members], kind="stable")[:max_members]]
+            shown[c] = np.sort(top)
+            visible[members] = n_clusters + n + c
+            visible[top] = n_clusters + top
+
+        out_nodes: List[Dict[str, Any]] = []
+        for c, row in self.clusters.iterrows():
+            label = f"{TIER_LABELS.get(row.tier, row.tier)} · {row.region}"
+            if c not in expanded_ids:
+                out_nodes.append({
+                    "id": f"c:{c}", "cluster": row.key, "kind": "cluster", "label": f"{label}（{row.members}）",
+                    "x": row.x, "y": row.y, "size": float(12 + 4 * np.log1p(row.members)), "status": row.status,
+                    "title": f"{label}<br>{row.members} 個節點 · 流量 {row.throughput:,.0f}"
+                             f"<br>高風險節點 {row.red} 個（展開叢集以查看成員）"})
+                continue
+            out_nodes.extend(self._member_nodes(c, row, shown[c]))
+
+        src, dst = visible[self.graph.src], visible[self.graph.dst]
+        edges = pd.DataFrame({"s": src, "t": dst, "w": self.graph.weight})
+        edges = edges[edges["s"] != edges["t"]].groupby(["s", "t"], sort=False)["w"].sum()
+        edges = edges.nlargest(max_edges) if len(edges) > max_edges else edges
+        names = lambda v: f"c:{v}" if v < n_clusters else f"n:{v - n_clusters}" if v < n_clusters + n \
+            else f"o:{v - n_clusters - n}"
+        out_edges = [{"from": names(s), "to": names(t), "value": float(w)} for (s, t), w in edges.items()]
+        return out_nodes, out_edges
+
+    def _member_nodes(self, c: int, row: Any, members: np.ndarray) -> List[Dict[str, Any]]:
+        # 展開的成員在叢集的帶狀區間內重新平均分布（間距至少 MIN_SPACING，以叢集中心為準）
+        order = members[np.argsort(self.positions[members, 1], kind="stable")]
+        span = max(row.y_max - row.y_min, MIN_SPACING * len(order))
+        ys = row.y - span / 2 + (np.arange(len(order)) + 0.5) * span / max(len(order), 1)
+        nodes = self.nodes
+        out = []
+        for node, y in zip(order, ys):
+            r = nodes.loc[node]
+            out.append({
+                "id": f"n:{node}", "cluster": row.key, "kind": "node", "label": r["name"], "x": row.x, "y": float(y),
+                "size": float(6 + 3 * np.log1p(r["throughput"] / max(row.throughput / row.members, 1.0))),
+                "status": r["status"],
+                "title": f"{r['name']}（{TIER_LABELS.get(r['tier'], r['tier'])}）<br>流量 {r['throughput']:,.0f}"
+                         f" · PageRank {r['pagerank']:.4f} · 溫度異常率 {r['violation_rate']:.0%}"
+                         + (f"<br>{int(r['dependents'])} 個農場/零售商的唯一通路" if r["dependents"] else "")})
+        rest = row.members - len(members)
+        if rest > 0:
+            out.append({"id": f"o:{c}", "cluster": row.key, "kind": "other", "label": f"其他 {rest} 個",
+                        "x": row.x + 60, "y": row.y + span / 2 + MIN_SPACING * 2, "size": 8,
+                        "status": row.status, "title": f"{rest} 個流量較小的節點（未列出）"})
+        return out
+
+
+# ==================== PyVis ====================
+def render_html(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]], height: str = "750px") -> str:
+    """以固定座標、關閉物理模擬產生 PyVis HTML；叢集為方框、成員為圓點，顏色為風險燈號"""
+    from pyvis.network import Network
+
+    net = Network(height=height, width="100%", directed=True, cdn_resources="remote")
+    net.toggle_physics(False)
+    for node in nodes:
+        net.add_node(node["id"], label=node["label"], title=node["title"], x=float(node["x"]), y=float(node["y"]),
+                     size=float(node["size"]), color=STATUS_COLORS[node["status"]], physics=False,
+                     shape="box" if node["kind"] == "cluster" else "dot")
+    top = max((e["value"] for e in edges), default=1.0)
+    for edge in edges:
+        net.add_edge(edge["from"], edge["to"], value=edge["value"], title=f"流量 {edge['value']:,.0f}",
+                     color={"color": "#9AA5B1", "opacity": 0.3 + 0.6 * edge["value"] / top})
+    net.set_options('{"interaction": {"hover": true, "hideEdgesOnDrag": true, "hideEdgesOnZoom": true},'
+                    ' "edges": {"smooth": false, "arrows": {"to": {"scaleFactor": 0.4}}}}')
+    return net.generate_html()
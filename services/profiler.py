@@ -0,0 +1,192 @@
+# services/profiler.py - 資料結構與缺失值概況（Agent 001 / 002）
+# 單次掃描、逐塊（chunk）更新的欄位剖析器：型態推斷、缺失率、基數（KMV sketch）、
+# 最小/最大值與共同缺失模式。串流上傳也能邊讀邊算，
+# 交給 LLM 的只有精簡的 profile JSON，而不是原始資料。
+
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.hashing import hash_values
+
+CHUNK_ROWS = 100_000
+KMV_SIZE = 4096               # 保留最小的 4096 個雜湊值估計相異值個數（相對誤差約 1.6%）
+KEY_RATIO = 0.97              # 估計值的唯一比例達此值即列為候選主鍵（精確計數時須為 1）
+INFER_SAMPLE = 1000           # 每塊抽樣多少個非空值做型態推斷
+TOP_PATTERNS = 10
+MAX_PATTERN_COLUMNS = 64      # 缺失模式以 uint64 bitmask 編碼
+
+_HASH_SPACE = float(2 ** 64)
+
+
+class _ColumnState:
+    __slots__ = ("name", "dtypes", "count", "nulls", "kmv", "min", "max",
+                 "sampled", "numeric_like", "datetime_like", "min_len", "max_len")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.dtypes: Counter = Counter()
+        self.count = 0
+        self.nulls = 0
+        self.kmv = np.empty(0, dtype=np.uint64)
+        self.min = self.max = None
+        self.sampled = self.numeric_like = self.datetime_like = 0
+        self.min_len = self.max_len = None
+
+    def update(self, s: pd.Series, null_mask: np.ndarray) -> None:
+        self.dtypes[str(s.dtype)] += len(s)
+        self.count += len(s)
+        present = s[~null_mask] if null_mask.any() else s
+        self.nulls += len(s) - len(present)
+        if present.empty:
+            return
+        hashes = hash_values(present)
+        if len(self.kmv) >= KMV_SIZE:
+            hashes = hashes[hashes < self.kmv[-1]]
+        merged = np.sort(np.concatenate([self.kmv, hashes]))
+        self.kmv = merged[np.r_[True, merged[1:] != merged[:-1]]][:KMV_SIZE]
+
+        if pd.api.types.is_bool_dtype(s):
+            return
+        if pd.api.types.is_numeric_dtype(s) or pd.api.types.is_datetime64_any_dtype(s):
+            lo, hi = present.min(), present.max()
+            self.min = lo if self.min is None else min(self.min, lo)
+            self.max = hi if self.max is None else max(self.max, hi)
+            return
+        # 文字欄位：記錄長度範圍，並抽樣判斷是否其實是數字或日期
+        text = present.astype(str)
+        lengths = text.str.len()
+        lo, hi = int(lengths.min()), int(lengths.max())
+        self.min_len = lo if self.min_len is None else min(self.min_len, lo)
+        self.max_len = hi if self.max_len is None else max(self.max_len, hi)
+        sample = text.iloc[:INFER_SAMPLE]
+        self.sampled += len(sample)
+        self.numeric_like += int(pd.to_numeric(sample, errors="coerce").notna().sum())
+        self.datetime_like += int(pd.to_datetime(sample, errors="coerce", format="mixed").notna().sum())
+
+    def distinct(self) -> int:
+        k = len(self.kmv)
+        if k < KMV_SIZE:
+            return k
+        return int(round((KMV_SIZE - 1) / (float(self.kmv[-1]) / _HASH_SPACE)))
+
+    def inferred_type(self) -> str:
+        dtype = self.dtypes.most_common(1)[0][0] if self.dtypes else "object"
+        if dtype.startswith("bool"):
+            return "boolean"
+        if dtype.startswith(("int", "uint", "Int", "UInt")):
+            return "integer"
+        if dtype.startswith(("float", "Float")):
+            return "float"
+        if dtype.startswith("datetime"):
+            return "datetime"
+        if self.sampled:
+            if self.numeric_like / self.sampled >= 0.95:
+                return "numeric_text"
+            if self.datetime_like / self.sampled >= 0.95:
+                return "datetime_text"
+        return "text"
+
+    def summary(self) -> Dict[str, Any]:
+        distinct = self.distinct()
+        present = self.count - self.nulls
+        out = {
+            "dtype": "/".join(self.dtypes) if len(self.dtypes) > 1 else next(iter(self.dtypes), "object"),
+            "inferred": self.inferred_type(),
+            "null_rate": round(self.nulls / self.count, 4) if self.count else 0.0,
+            "distinct": distinct,
+            "unique_ratio": round(min(distinct / present, 1.0), 4) if present else 0.0,
+            "estimated": len(self.kmv) >= KMV_SIZE,
+        }
+        if self.min is not None:
+            out["min"], out["max"] = _scalar(self.min), _scalar(self.max)
+        if self.min_len is not None:
+            out["length"] = [self.min_len, self.max_len]
+        return out
+
+
+def _scalar(value: Any) -> Any:
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class DataProfiler:
+    """逐塊累積的資料剖析器；update() 每塊資料，profile() 取得精簡結果"""
+
+    def __init__(self):
+        self.rows = 0
+        self.columns: Dict[str, _ColumnState] = {}
+        self.patterns: Counter = Counter()
+        self.co_missing: Optional[np.ndarray] = None
+        self._pattern_columns: List[str] = []
+
+    def update(self, chunk: pd.DataFrame) -> "DataProfiler":
+        self.rows += len(chunk)
+        chunk = chunk.rename(columns=str)
+        null_frame = chunk.isna()
+        for col in chunk.columns:
+            self.columns.setdefault(col, _ColumnState(col)).update(chunk[col], null_frame[col].to_numpy())
+
+        if not self._pattern_columns:
+            self._pattern_columns = list(chunk.columns[:MAX_PATTERN_COLUMNS])
+            self.co_missing = np.zeros((len(self._pattern_columns),) * 2, dtype=np.int64)
+        nulls = null_frame.reindex(columns=self._pattern_columns, fill_value=True).to_numpy()
+        if nulls.any():
+            as_int = nulls.astype(np.int64)
+            self.co_missing += as_int.T @ as_int
+            weights = np.uint64(1) << np.arange(nulls.shape[1], dtype=np.uint64)
+            codes = (nulls.astype(np.uint64) * weights).sum(1)
+            values, counts = np.unique(codes[codes > 0], return_counts=True)
+            self.patterns.update(dict(zip(values.tolist(), counts.tolist())))
+        return self
+
+    def _decode(self, code: int) -> List[str]:
+        return [c for i, c in enumerate(self._pattern_columns) if (code >> i) & 1]
+
+    def profile(self) -> Dict[str, Any]:
+        """
+        Returns:
+            {"rows", "columns": {欄位: 概況}, "nested_groups", "missing_patterns", "co_missing"}，
+            可直接 json.dumps 放入 Agent 001/002 的 prompt
+        """
+        columns = {name: state.summary() for name, state in self.columns.items()}
+        nested = Counter(name.split(".")[0] for name in columns if "." in name)
+        co_pairs = []
+        if self.co_missing is not None:
+            diag = np.diag(self.co_missing)
+            for i in range(len(diag)):
+                for j in range(i + 1, len(diag)):
+                    both = int(self.co_missing[i, j])
+                    if both:
+                        co_pairs.append({"columns": [self._pattern_columns[i], self._pattern_columns[j]],
+                                         "rows": both,
+                                         "jaccard": round(float(both / (diag[i] + diag[j] - both)), 4)})
+            co_pairs.sort(key=lambda p: (p["jaccard"], p["rows"]), reverse=True)
+        return {
+            "rows": self.rows,
+            "columns": columns,
+            "candidate_keys": [n for n, c in columns.items() if c["null_rate"] == 0
+                               and c["unique_ratio"] >= (KEY_RATIO if c["estimated"] else 1.0)],
+            "nested_groups": dict(nested),
+            "complete_rows": self.rows - sum(self.patterns.values()),
+            "missing_patterns": [{"columns": self._decode(code), "rows": n, "share": round(n / self.rows, 4)}
+                                 for code, n in self.patterns.most_common(TOP_PATTERNS)],
+            "co_missing": co_pairs[:TOP_PATTERNS],
+        }
+
+
+def profile_chunks(chunks: Iterable[pd.DataFrame]) -> Dict[str, Any]:
+    """剖析串流資料（例：pd.read_csv(..., chunksize=N) 的結果）"""
+    profiler = DataProfiler()
+    for chunk in chunks:
+        profiler.update(chunk)
+    return profiler.profile()
+
+
+def profile_dataframe(df: pd.DataFrame, chunk_rows: int = CHUNK_ROWS) -> Dict[str, Any]:
+    return profile_chunks(df.iloc[i:i + chunk_rows] for i in range(0, len(df), chunk_rows))
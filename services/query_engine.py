@@ -0,0 +1,136 @@
+# services/query_engine.py - 嵌入式 SQL 查詢引擎（Agent 027 自然語言查詢解析器）
+# LLM 只負責把問題轉成 SQL，查詢在本機 SQLite 執行，回傳的只有結果列。
+# Prompt 只包含資料表結構，因此 token 用量與資料筆數無關。
+
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+TABLE_NAME = "batches"
+MAX_RESULT_ROWS = 200
+SAMPLE_VALUES_PER_COLUMN = 3
+QUERY_TIMEOUT_S = 5.0           # 單一查詢的執行時間上限（允許 WITH RECURSIVE，可能永不結束）
+PROGRESS_STEPS = 10_000         # 每執行多少個 VM 指令檢查一次時限
+
+# 只允許讀取類操作；寫入、ATTACH、PRAGMA 等一律拒絕
+_ALLOWED_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    getattr(sqlite3, "SQLITE_RECURSIVE", 33),
+}
+
+NL2SQL_PROMPT = """你是自然語言查詢解析器（Agent 027）。請把使用者的問題轉換成一條 SQLite SQL 查詢。
+
+規則：
+- 只能查詢資料表 {table}，只能使用 SELECT（可用 WITH）
+- 日期欄位以 'YYYY-MM-DD HH:MM:SS' 文字儲存，可直接比較或使用 date()/strftime()
+- 欄位名稱含中文或特殊字元時請用雙引號包住
+- 只輸出 SQL，不要解釋，不要輸出其他文字
+
+資料表結構：
+{schema}
+
+使用者問題：{question}
+"""
+
+
+class QueryError(ValueError):
+    """SQL 不合法或執行失敗"""
+
+
+def _authorizer(action, arg1, arg2, db_name, trigger):
+    return sqlite3.SQLITE_OK if action in _ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def extract_sql(text: str) -> str:
+    """從 LLM 回覆中取出 SQL（支援 ```sql 區塊或純文字）"""
+    fenced = re.search(r"```(?:sql)?\s*(.+?)```", text, re.S | re.I)
+    if fenced:
+        text = fenced.group(1)
+    match = re.search(r"\b(WITH|SELECT)\b.*", text, re.S | re.I)
+    if not match:
+        raise QueryError(f"LLM 回覆中找不到 SQL：{text[:200]}")
+    return match.group(0).strip().rstrip(";").strip()
+
+
+class BatchQueryEngine:
+    """把已載入的批次資料表放進記憶體 SQLite，執行 LLM 產生的查詢"""
+
+    def __init__(self, df: pd.DataFrame, table: str = TABLE_NAME):
+        self.table = table
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        df.to_sql(table, self.conn, index=False)
+        self._schema = self._build_schema(df)
+        self.conn.set_authorizer(_authorizer)
+        self._lock = threading.Lock()     # 介面以 cache_resource 共用引擎，時限 handler 屬於連線，一次只跑一個查詢
+
+    def _build_schema(self, df: pd.DataFrame) -> str:
+        info = self.conn.execute(f'PRAGMA table_info("{self.table}")').fetchall()
+        lines = [f'CREATE TABLE {self.table} (']
+        for i, (_, name, col_type, *_) in enumerate(info):
+            line = f'  "{name}" {col_type or "TEXT"}' + ("," if i < len(info) - 1 else "")
+            if not (pd.api.types.is_numeric_dtype(df[name]) or pd.api.types.is_datetime64_any_dtype(df[name])):
+                samples = df[name].dropna().astype(str).unique()[:SAMPLE_VALUES_PER_COLUMN]
+                if len(samples):
+                    line += "  -- 例：" + ", ".join(samples)
+            lines.append(line)
+        lines.append(");")
+        lines.append(f"-- 共 {len(df):,} 筆")
+        return "\n".join(lines)
+
+    def schema(self) -> str:
+        return self._schema
+
+    def execute(self, sql: str, max_rows: int = MAX_RESULT_ROWS,
+                timeout: float = QUERY_TIMEOUT_S) -> Dict[str, Any]:
+        """執行唯讀查詢，最多回傳 max_rows 列；超過 timeout 秒即中止"""
+        if not re.match(r"\s*(WITH|SELECT)\b", sql, re.I):
+            raise QueryError("只允許 SELECT 查詢")
+        deadline = time.perf_counter() + timeout
+        with self._lock:
+            # 回傳非 0 時 SQLite 中止查詢（OperationalError: interrupted）
+            self.conn.set_progress_handler(lambda: time.perf_counter() > deadline, PROGRESS_STEPS)
+            try:
+                cursor = self.conn.execute(sql)
+                rows = cursor.fetchmany(max_rows + 1)
+            except sqlite3.Error as e:
+                if time.perf_counter() > deadline:
+                    raise QueryError(f"查詢超過 {timeout:g} 秒，已中止") from e
+                raise QueryError(f"SQL 執行失敗：{e}") from e
+            finally:
+                self.conn.set_progress_handler(None, 0)
+        columns = [d[0] for d in cursor.description or []]
+        return {
+            "sql": sql,
+            "rows": pd.DataFrame(rows[:max_rows], columns=columns),
+            "truncated": len(rows) > max_rows,
+        }
+
+    def build_prompt(self, question: str) -> str:
+        return NL2SQL_PROMPT.format(table=self.table, schema=self._schema, question=question)
+
+    def ask(self, question: str, llm_call: Callable[[str, str], str], model: str,
+            max_rows: int = MAX_RESULT_ROWS) -> Dict[str, Any]:
+        """自然語言提問 → LLM 產生 SQL → 本地執行 → 回傳結果列"""
+        sql = extract_sql(llm_call(self.build_prompt(question), model))
+        return self.execute(sql, max_rows=max_rows)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def rows_to_markdown(result: Dict[str, Any], limit: Optional[int] = None) -> str:
+    """把查詢結果轉成 Markdown 表格，方便再交給報告代理"""
+    rows: pd.DataFrame = result["rows"]
+    if limit is not None:
+        rows = rows.head(limit)
+    header = "| " + " | ".join(map(str, rows.columns)) + " |"
+    sep = "| " + " | ".join("---" for _ in rows.columns) + " |"
+    body: List[str] = ["| " + " | ".join(map(str, r)) + " |" for r in rows.itertuples(index=False)]
+    suffix = ["", f"（僅顯示前 {len(rows)} 列）"] if result.get("truncated") else []
+    return "\n".join([header, sep, *body, *suffix])
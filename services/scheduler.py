@@ -0,0 +1,225 @@
+# services/scheduler.py - 多使用者（租戶）LLM 請求排程：公平佇列、每組金鑰的並行上限與 token 額度
+# 同一個 Space 上可能有幾十位分析師同時使用；若每個請求都直接呼叫 LLM，一個人的 31 代理完整分析
+# （加上 map-reduce 的大量呼叫）會佔滿供應商的並行數與速率限制，其他人連一次自然語言查詢都要排很久。
+# 這裡把所有 LLM 呼叫交給同一個 process 內的排程器：
+#   - 每個租戶（一組 API 金鑰）各自排隊；有空位時挑「虛擬時間」最小的租戶（start-time fair queuing，
+#     以估計 token 數為成本），不論誰送出多少請求，各租戶分到的處理量大致相同
+#   - 互動請求（儀表板上的查詢）優先於批次請求（背景完整分析），且保留 INTERACTIVE_RESERVED 個名額
+#     只給互動請求使用，批次請求再多也不會讓互動請求排隊
+#   - 每個租戶同時最多 PER_TENANT_CONCURRENCY 個呼叫、每小時最多 TOKENS_PER_HOUR 個 token（token bucket）
+#
+#   scheduler = FairScheduler()
+#   llm = ScheduledLLM(LLMProvider(...), scheduler, tenant="a1b2c3", priority=INTERACTIVE)
+#   llm(prompt, "gpt-4o")              # 介面與 LLMProvider 相同，額度用完時丟出 QuotaExceededError
+
+import functools
+import hashlib
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Optional
+
+from utils.token_budget import count_tokens
+
+INTERACTIVE, BATCH = "interactive", "batch"
+MAX_CONCURRENCY = 8            # 整個 process 同時進行的 LLM 呼叫
+INTERACTIVE_RESERVED = 2       # 只給互動請求的名額（批次請求最多使用 MAX_CONCURRENCY - 2 個）
+PER_TENANT_CONCURRENCY = 2     # 每組金鑰同時進行的呼叫
+TOKENS_PER_HOUR = 2_000_000    # 每組金鑰每小時的 token 額度（提示詞估計 + 輸出上限）
+
+
+class QuotaExceededError(RuntimeError):
+    def __init__(self, tenant: str, needed: int, retry_after: float):
+        super().__init__(f"租戶 {tenant} 的 token 額度不足（本次約需 {needed:,} tokens），約 {retry_after:.0f} 秒後可再使用")
+        self.tenant = tenant
+        self.retry_after = retry_after
+
+
+def tenant_id(*keys: str) -> str:
+    """以 API 金鑰組合的雜湊作為租戶識別（不保存金鑰本身）"""
+    return hashlib.sha256("|".join(keys).encode()).hexdigest()[:12]
+
+
+class TokenQuota:
+    """token bucket：容量為每小時額度，連續回補；charge 失敗時回傳需要等待的秒數"""
+
+    def __init__(self, per_hour: float = TOKENS_PER_HOUR):
+        self.capacity = per_hour
+        self.rate = per_hour / 3600.0
+        self.tokens = per_hour
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def charge(self, tokens: int) -> float:
+        """扣除額度並回傳 0；額度不足時不扣除，回傳約需等待的秒數"""
+        self._refill()
+        tokens = min(tokens, self.capacity)   # 單一請求超過整小時額度時以滿額計，不會永遠無法執行
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    @property
+    def remaining(self) -> int:
+        self._refill()
+        return int(self.tokens)
+
+
+@dataclass
+class _Request:
+    seq: int
+    fn: Callable[..., Any]
+    args: tuple
+    kwargs: Dict[str, Any]
+    cost: int
+    priority: str
+    future: Future = field(default_factory=Future)
+
+
+@dataclass
+class _Tenant:
+    quota: TokenQuota
+    queues: Dict[str, Deque[_Request]] = field(default_factory=lambda: {INTERACTIVE: deque(), BATCH: deque()})
+    running: int = 0
+    vtime: float = 0.0            # 已取得的服務量（token 成本累計），越小越優先
+    tokens_used: int = 0
+    requests: int = 0
+
+
+class FairScheduler:
+    """
+    公平排程器；submit 回傳 Future，run 為同步版本
+
+    排程決策只在送出請求與請求完成時進行（持有鎖，O(租戶數)），實際呼叫由執行緒池執行。
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, per_tenant: int = PER_TENANT_CONCURRENCY,
+                 interactive_reserved: int = INTERACTIVE_RESERVED, tokens_per_hour: float = TOKENS_PER_HOUR):
+        self.max_concurrency = max_concurrency
+        self.per_tenant = per_tenant
+        self.batch_slots = max(max_concurrency - interactive_reserved, 1)
+        self.tokens_per_hour = tokens_per_hour
+        self.tenants: Dict[str, _Tenant] = {}
+        self.running = {INTERACTIVE: 0, BATCH: 0}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-scheduler")
+
+    def _tenant(self, tenant: str) -> _Tenant:
+        state = self.tenants.get(tenant)
+        if state is None:
+            state = self.tenants[tenant] = _Tenant(TokenQuota(self.tokens_per_hour))
+        return state
+
+    def submit(self, tenant: str, fn: Callable[..., Any], *args: Any, cost: int = 1, priority: str = BATCH,
+               **kwargs: Any) -> Future:
+        request = _Request(next(self._seq), fn, args, kwargs, max(int(cost), 1), priority)
+        with self._lock:
+            state = self._tenant(tenant)
+            wait = state.quota.charge(request.cost)
+            if wait:
+                raise QuotaExceededError(tenant, request.cost, wait)
+            if not any(state.queues.values()) and state.running == 0:
+                # 閒置後回來的租戶從目前活躍租戶的最小虛擬時間起算，不能用閒置期間「存下」的額度插隊
+                active = [t.vtime for t in self.tenants.values()
+                          if t is not state and (t.running or any(t.queues.values()))]
+                state.vtime = max(state.vtime, min(active, default=state.vtime))
+            state.queues[priority].append(request)
+            self._dispatch()
+        return request.future
+
+    def run(self, tenant: str, fn: Callable[..., Any], *args: Any, cost: int = 1, priority: str = BATCH,
+            timeout: Optional[float] = None, **kwargs: Any) -> Any:
+        return self.submit(tenant, fn, *args, cost=cost, priority=priority, **kwargs).result(timeout)
+
+    def _pick(self, priority: str) -> Optional[str]:
+        best = None
+        for name, state in self.tenants.items():
+            queue = state.queues[priority]
+            if not queue or state.running >= self.per_tenant:
+                continue
+            key = (state.vtime, queue[0].seq)
+            if best is None or key < best[0]:
+                best = (key, name)
+        return best[1] if best else None
+
+    def _dispatch(self) -> None:
+        """在持有鎖時呼叫：依優先序與虛擬時間把請求交給執行緒池，直到沒有空位或沒有可執行的請求"""
+        while sum(self.running.values()) < self.max_concurrency:
+            priority, name = INTERACTIVE, self._pick(INTERACTIVE)
+            if name is None and self.running[BATCH] < self.batch_slots:
+                priority, name = BATCH, self._pick(BATCH)
+            if name is None:
+                return
+            state = self.tenants[name]
+            request = state.queues[priority].popleft()
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            state.running += 1
+            state.vtime += request.cost
+            state.tokens_used += request.cost
+            state.requests += 1
+            self.running[priority] += 1
+            self._pool.submit(self._execute, name, request)
+
+    def _execute(self, name: str, request: _Request) -> None:
+        try:
+            request.future.set_result(request.fn(*request.args, **request.kwargs))
+        except BaseException as e:
+            request.future.set_exception(e)
+        finally:
+            with self._lock:
+                self.tenants[name].running -= 1
+                self.running[request.priority] -= 1
+                self._dispatch()
+
+    def stats(self, tenant: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            def one(state: _Tenant) -> Dict[str, Any]:
+                return {"running": state.running, "queued": {p: len(q) for p, q in state.queues.items()},
+                        "requests": state.requests, "tokens_used": state.tokens_used,
+                        "tokens_remaining": state.quota.remaining}
+            if tenant is not None:
+                return one(self._tenant(tenant))
+            return {"running": dict(self.running), "tenants": {n: one(s) for n, s in self.tenants.items()}}
+
+
+class ScheduledLLM:
+    """
+    把 LLM 客戶端的呼叫交給排程器；其餘屬性（resolve_model、max_tokens、last_hedge…）轉給原客戶端
+
+    原客戶端有 generate / structured 時同樣經過排程器（沒有時維持沒有，呼叫端的 hasattr 判斷不變）。
+    成本以提示詞 token 數（含系統提示詞）加上輸出上限估計，送出時即自租戶額度扣除。
+    """
+
+    SCHEDULED_METHODS = ("generate", "structured")
+
+    def __init__(self, llm: Any, scheduler: FairScheduler, tenant: str, priority: str = BATCH):
+        self.llm = llm
+        self.scheduler = scheduler
+        self.tenant = tenant
+        self.priority = priority
+        self._overhead = count_tokens(getattr(llm, "system_prompt", "") or "") + (getattr(llm, "max_tokens", 0) or 0)
+
+    def _run(self, fn: Callable[..., Any], prompt: str, *args: Any, **kwargs: Any) -> Any:
+        cost = count_tokens(prompt) + self._overhead
+        return self.scheduler.run(self.tenant, fn, prompt, *args, cost=cost, priority=self.priority, **kwargs)
+
+    def __call__(self, prompt: str, model: Optional[str] = None, agent_id: Optional[str] = None) -> str:
+        kwargs = {"agent_id": agent_id} if agent_id else {}
+        return self._run(self.llm, prompt, model, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_") or name in ("llm", "scheduler", "tenant", "priority"):
+            raise AttributeError(name)
+        attr = getattr(self.llm, name)
+        if name in self.SCHEDULED_METHODS:
+            return functools.partial(self._run, attr)
+        return attr
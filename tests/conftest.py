@@ -0,0 +1,5 @@
+# tests/conftest.py - 讓測試可直接 import 專案內的套件（agents、services、utils）
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
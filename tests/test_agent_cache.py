@@ -0,0 +1,50 @@
+# tests/test_agent_cache.py - 代理輸出快取鍵：依賴模組與模型狀態變動時必須失效
+
+import pandas as pd
+import pytest
+
+from agents.pipeline import run_all_agents, score_risk
+from models.ml_models.anomaly_detector import AnomalyDetector
+from services import agent_cache
+from services.agent_cache import AgentCache, ColumnFingerprints, code_version
+from services.local_compute import LOCAL_AGENTS
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_code_version_covers_imported_modules(monkeypatch):
+    before = code_version(LOCAL_AGENTS["agent_008"])
+    # 模擬修改 services/forecasting.py：agent_008 定義在 local_compute，但預測邏輯在 forecasting
+    monkeypatch.setattr(agent_cache, "_module_digest",
+                        lambda m: "edited" if m == "services.forecasting" else m)
+    assert code_version(LOCAL_AGENTS["agent_008"]) != before
+
+
+def test_risk_stage_depends_on_features_module(monkeypatch):
+    before = code_version(score_risk, AnomalyDetector)
+    monkeypatch.setattr(agent_cache, "_module_digest", lambda m: "edited" if m == "utils.features" else m)
+    assert code_version(score_risk, AnomalyDetector) != before
+
+
+def test_risk_stage_recomputed_after_model_update():
+    df = pd.DataFrame({"batch_id": [f"B{i}" for i in range(50)], "temperature": [5.0 + i % 5 * 0.1 for i in range(50)]})
+    memo = AgentCache("cache.db")
+    assert AnomalyDetector.version() == "untrained"
+    run_all_agents(df.copy(), memo=memo, local_workers=1)
+    assert AnomalyDetector.version() != "untrained"
+    # 基線已更新，同一份資料不能直接沿用以舊基線算出的評分
+    again = run_all_agents(df.copy(), memo=memo, local_workers=1)
+    assert "agent_021-029" not in again["memoized"]
+
+
+def test_fingerprint_distinguishes_nested_values():
+    # pd.read_json 讀入的巢狀欄位：hash_pandas_object 遇到 dict 會丟出 TypeError
+    a = pd.DataFrame({"meta": [{"temp": 5}, {"temp": 6}, None]})
+    b = pd.DataFrame({"meta": [{"temp": 5}, {"temp": 7}, None]})
+    same = pd.DataFrame({"meta": [{"temp": 5}, {"temp": 6}, None]})
+    assert ColumnFingerprints(a).column("meta") != ColumnFingerprints(b).column("meta")
+    assert ColumnFingerprints(a).column("meta") == ColumnFingerprints(same).column("meta")
@@ -0,0 +1,94 @@
+# tests/test_alerts.py - 告警分組去重、限流、sink 失敗重送與待送區上限
+
+from services.alerts import MAX_AFFECTED_BATCHES, AlertDispatcher, TokenBucket, evaluate_metrics
+
+
+class ListSink:
+    def __init__(self, fail: int = 0):
+        self.fail = fail
+        self.batches = []
+
+    def __call__(self, notifications):
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("webhook down")
+        self.batches.append(notifications)
+
+
+def _event(batch_id, ts=0.0, rule="cold_chain_break", severity="red"):
+    return {"ts": ts, "batch_id": batch_id, "rule": rule, "severity": severity, "message": f"{batch_id} 超溫"}
+
+
+def test_duplicates_in_window_are_merged():
+    sink = ListSink()
+    dispatcher = AlertDispatcher(sink)
+    for ts in (0, 60, 120):
+        dispatcher.submit(_event("B1", ts))
+    dispatcher.submit(_event("B2", 30))
+    dispatcher.submit(_event("B1", 90, severity="green", rule="recovered"))    # info 以下不通知
+    [notification] = dispatcher.flush()
+    assert notification["affected_batches"] == ["B1", "B2"]
+    assert notification["severity"] == "critical"
+    assert "另有 2 筆重複告警已合併" in notification["message"]
+    assert dispatcher.stats == {"received": 5, "suppressed": 2, "notifications": 1, "failed": 0}
+    # 下一個分組視窗的同一批次再次通知
+    dispatcher.submit(_event("B1", 3600))
+    assert dispatcher.flush()[0]["affected_batches"] == ["B1"]
+
+
+def test_token_bucket_holds_groups_until_refilled():
+    bucket = TokenBucket(per_minute=60, burst=1)
+    assert bucket.take() and not bucket.take()
+    bucket.updated -= 1.0                      # 1 秒後補回 1 個額度
+    assert bucket.take()
+
+    dispatcher = AlertDispatcher(ListSink(), per_minute=1)
+    dispatcher.submit(_event("B1", rule="cold_chain_break"))
+    dispatcher.submit(_event("B2", rule="stage_order"))
+    assert len(dispatcher.flush()) == 1
+    assert len(dispatcher.pending) == 1         # 額度用完：留在待送區，繼續合併新事件
+    dispatcher.submit(_event("B3", rule="stage_order"))
+    dispatcher.bucket.updated -= 60
+    [held] = dispatcher.flush()
+    assert held["affected_batches"] == ["B2", "B3"]
+
+
+def test_sink_failure_requeues_and_merges():
+    sink = ListSink(fail=1)
+    dispatcher = AlertDispatcher(sink)
+    dispatcher.submit(_event("B1"))
+    assert dispatcher.flush() == []
+    assert dispatcher.stats["failed"] == 1 and "webhook down" in dispatcher.last_error
+    dispatcher.submit(_event("B2"))
+    [notification] = dispatcher.flush()
+    assert notification["affected_batches"] == ["B1", "B2"]
+    assert sink.batches == [[notification]]
+
+
+def test_pending_batches_are_capped():
+    dispatcher = AlertDispatcher(ListSink(fail=1))
+    n = MAX_AFFECTED_BATCHES * 4
+    for i in range(n):
+        dispatcher.submit(_event(f"B{i:04d}"))
+    [group] = dispatcher.pending.values()
+    assert len(group["batches"]) == MAX_AFFECTED_BATCHES
+    assert dispatcher.flush() == []            # 重送合併後仍維持上限
+    dispatcher.submit(_event("B9999"))
+    [group] = dispatcher.pending.values()
+    assert len(group["batches"]) == MAX_AFFECTED_BATCHES
+    [notification] = dispatcher.flush()
+    assert notification["total_batches"] == n + 1
+    assert len(notification["affected_batches"]) == MAX_AFFECTED_BATCHES
+    assert f"{n + 1} 個批次" in notification["message"]
+
+
+def test_evaluate_metrics():
+    rules = [{"condition": "execution_time > 30s", "action": "scale"},
+             {"condition": "error_rate > 5%", "action": "page"},
+             {"condition": "memory > 1", "action": "ignored"},
+             {"condition": "not a condition"}]
+    fired = evaluate_metrics({"execution_time": 45.0, "error_rate": 0.01}, rules, batches=["B1"])
+    assert [n["action"] for n in fired] == ["scale"]
+    assert fired[0]["affected_batches"] == ["B1"] and "45.0s" in fired[0]["message"]
+    fired = evaluate_metrics({"execution_time": 1.0, "error_rate": 0.2}, rules)
+    assert [n["action"] for n in fired] == ["page"] and "20.0%" in fired[0]["message"]
@@ -0,0 +1,29 @@
+# tests/test_apps.py - Streamlit app 的啟動檢查（不需安裝 streamlit：只檢查 import 時必定執行的內容）
+
+import ast
+import os
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _embedded_yaml(path: str, name: str) -> str:
+    with open(os.path.join(ROOT, path), "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == name for t in node.targets):
+            return node.value.args[0].value
+    raise AssertionError(f"{path} 沒有 {name}")
+
+
+def test_grok_app_agents_config_parses():
+    # AGENTS_CONFIG 在 import 時解析，YAML 錯誤會讓頁面完全無法顯示
+    config = yaml.safe_load(_embedded_yaml("Grok_app.py", "AGENTS_CONFIG"))
+    assert config["data_cleaning"]["agent_003"]["role"] == "基於3σ與箱形圖檢測"
+
+
+def test_apps_compile():
+    for app in ("app.py", "Grok_app.py"):
+        with open(os.path.join(ROOT, app), "r", encoding="utf-8") as f:
+            compile(f.read(), app, "exec")
@@ -0,0 +1,64 @@
+# tests/test_association_rules.py - Agent 010：FP-Growth 與暴力列舉的頻繁項目集、規則指標一致
+
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.association_rules import encode_transactions, frequent_itemsets, generate_rules, mine_batch_rules
+
+
+def _one_hot(n_rows: int, n_items: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    probs = rng.uniform(0.05, 0.6, n_items)
+    data = rng.random((n_rows, n_items)) < probs
+    data[:, 1] |= data[:, 0] & (rng.random(n_rows) < 0.9)     # 相關項目，產生高信心度規則
+    return pd.DataFrame(data, columns=[f"item{j:02d}" for j in range(n_items)])
+
+
+def _brute_force(one_hot: pd.DataFrame, min_count: int, max_size: int):
+    values = one_hot.to_numpy()
+    out = {}
+    for size in range(1, max_size + 1):
+        for combo in combinations(range(values.shape[1]), size):
+            count = int(values[:, list(combo)].all(axis=1).sum())
+            if count >= min_count:
+                out[frozenset(one_hot.columns[i] for i in combo)] = count
+    return out
+
+
+@pytest.mark.parametrize("n_items, max_size, seed", [(12, 4, 0), (70, 3, 1)])   # 70 項：bitset 跨兩個 word
+def test_fp_growth_matches_brute_force(n_items, max_size, seed):
+    one_hot = _one_hot(400, n_items, seed)
+    min_count = 20
+    names, unique, weights = encode_transactions(one_hot, min_count)
+    assert weights.sum() == len(one_hot)
+    found = frequent_itemsets(names, unique, weights, min_count, max_size)
+    named = {frozenset(names[i] for i in itemset): count for itemset, count in found.items()}
+    assert named == _brute_force(one_hot, min_count, max_size)
+
+
+def test_rule_metrics_match_direct_counts():
+    one_hot = _one_hot(500, 8, 2)
+    names, unique, weights = encode_transactions(one_hot, 10)
+    itemsets = frequent_itemsets(names, unique, weights, 10)
+    rules = generate_rules(itemsets, len(one_hot), 0.7)
+    assert rules
+    for rule in rules:
+        a = one_hot[[names[i] for i in rule["antecedent"]]].all(axis=1)
+        c = one_hot[[names[i] for i in rule["consequent"]]].all(axis=1)
+        assert rule["count"] == (a & c).sum()
+        assert rule["confidence"] == pytest.approx((a & c).sum() / a.sum())
+        assert rule["lift"] == pytest.approx(rule["confidence"] / c.mean())
+
+
+def test_mine_batch_rules_finds_planted_rule():
+    n = 400
+    farm = np.where(np.arange(n) % 4 == 0, "Farm A", "Farm B")
+    df = pd.DataFrame({"farm_name": farm, "packing_facility": np.where(farm == "Farm A", "P1", "P2"),
+                       "temperature": np.where(farm == "Farm A", 9.5, 5.0)})
+    result = mine_batch_rules(df)
+    assert result["transactions"] == n and result["distinct_transactions"] == 2
+    assert any(r["antecedent"] == ["farm_name=Farm A"] and "溫度異常" in r["consequent"] and r["confidence"] == 1.0
+               for r in result["rules"])
@@ -0,0 +1,76 @@
+# tests/test_batch_runner.py - 離線批次審計：送出 → 輪詢 → 收集，以及中斷後接續不重複送出
+
+import json
+
+import pandas as pd
+import pytest
+
+from services import batch_runner
+from services.batch_runner import BatchAuditRunner, LocalBatchBackend
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def _datasets():
+    return {name: pd.DataFrame({"batch_id": [f"{name}-{i}" for i in range(20)],
+                                "farm_name": ["Farm A", "Farm B"] * 10,
+                                "temperature": [4.0 + i % 6 for i in range(20)]})
+            for name in ("farm_a", "farm_b")}
+
+
+class FlakyBackend:
+    """轉送給 LocalBatchBackend，第 fail_at 次送出時模擬程序中斷"""
+
+    def __init__(self, inner, fail_at=None):
+        self.inner = inner
+        self.fail_at = fail_at
+        self.submitted = []
+
+    def submit(self, path, metadata=None):
+        if len(self.submitted) + 1 == self.fail_at:
+            raise ConnectionError("interrupted")
+        self.submitted.append(path)
+        return self.inner.submit(path, metadata)
+
+    def status(self, batch_id):
+        return self.inner.status(batch_id)
+
+    def results(self, batch_id):
+        return self.inner.results(batch_id)
+
+
+def test_local_backend_round_trip(workdir):
+    runner = BatchAuditRunner(LocalBatchBackend(root=str(workdir / "server")), workdir=str(workdir / "runs"),
+                              poll_interval=0.01, timeout=30)
+    reports = runner.run(_datasets(), run_id="audit")
+    assert set(reports) == {"farm_a", "farm_b"}
+    for report in reports.values():
+        assert report["final_report"].startswith("（本地批次模擬")
+        batch = [a for a in report["agents"].values() if a["source"] == "batch"]
+        assert batch and all(a["status"] == "ok" for a in batch)
+        assert report["agents"]["agent_007"]["source"] == "local"
+    manifest = json.loads((workdir / "runs" / "audit" / "manifest.json").read_text(encoding="utf-8"))
+    assert all(s["statuses"] and len(s["batch_ids"]) == len(s["files"]) for s in manifest["phases"].values())
+
+
+def test_resume_submits_only_remaining_files(workdir, monkeypatch):
+    monkeypatch.setattr(batch_runner, "MAX_REQUESTS_PER_FILE", 5)     # 階段 1 切成多個檔案
+    server = LocalBatchBackend(root=str(workdir / "server"))
+    flaky = FlakyBackend(server, fail_at=3)
+    runner = BatchAuditRunner(flaky, workdir=str(workdir / "runs"), poll_interval=0.01, timeout=30)
+    with pytest.raises(ConnectionError):
+        runner.run(_datasets(), run_id="audit")
+    manifest = json.loads((workdir / "runs" / "audit" / "manifest.json").read_text(encoding="utf-8"))
+    agents = manifest["phases"]["agents"]
+    assert len(agents["files"]) > 3 and len(agents["batch_ids"]) == 2
+
+    resumed = FlakyBackend(server)
+    runner.backend = resumed
+    reports = runner.run({}, run_id="audit")          # 接續時由 prepared.json 讀回資料集
+    assert resumed.submitted[:len(agents["files"]) - 2] == agents["files"][2:]
+    assert set(flaky.submitted).isdisjoint(resumed.submitted)
+    assert all(not r["final_report"].startswith("⚠️") for r in reports.values())
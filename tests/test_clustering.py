@@ -0,0 +1,75 @@
+# tests/test_clustering.py - Agent 009：mini-batch K-means、抽樣 silhouette 與 K 值選擇
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.clustering import assign, cluster_batches, minibatch_kmeans, silhouette_sample, sweep_k
+
+
+def _blobs(n_per: int = 300, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]])
+    X = np.concatenate([c + rng.normal(0, 0.5, (n_per, 2)) for c in centers])
+    return X, np.repeat(np.arange(3), n_per)
+
+
+def _naive_silhouette(X, labels):
+    d = np.sqrt(((X[:, None, :] - X[None, :, :]) ** 2).sum(-1))
+    scores = []
+    for i, own in enumerate(labels):
+        same = (labels == own) & (np.arange(len(X)) != i)
+        if not same.any():
+            scores.append(0.0)
+            continue
+        a = d[i, same].mean()
+        b = min(d[i, labels == other].mean() for other in set(labels) - {own})
+        scores.append((b - a) / max(a, b))
+    return float(np.mean(scores))
+
+
+def test_silhouette_matches_naive_definition():
+    X, labels = _blobs(20)
+    rng = np.random.default_rng(1)
+    noisy = np.where(rng.random(len(labels)) < 0.2, rng.integers(0, 3, len(labels)), labels)
+    noisy[0], noisy[1] = 3, 4                                   # 單一成員的群 silhouette 為 0
+    assert silhouette_sample(X, noisy) == pytest.approx(_naive_silhouette(X, noisy))
+
+
+def test_minibatch_kmeans_recovers_blobs():
+    X, truth = _blobs()
+    centers = minibatch_kmeans([X[:, 0], X[:, 1]], 3, seed=0)
+    labels, inertia = assign([X[:, 0], X[:, 1]], centers)
+    # 每個真實群都完整對應到一個群
+    assert len({tuple(np.unique(labels[truth == t])) for t in range(3)}) == 3
+    assert all(len(np.unique(labels[truth == t])) == 1 for t in range(3))
+    assert inertia / len(X) < 1.0
+
+
+def test_sweep_parallel_matches_serial():
+    X, _ = _blobs(100)
+    frame = pd.DataFrame(X, columns=["a", "b"])
+    serial = sweep_k(frame, range(2, 5), max_workers=1)
+    pooled = sweep_k(frame, range(2, 5), max_workers=2)
+    assert [r["k"] for r in serial] == [r["k"] for r in pooled] == [2, 3, 4]
+    for s, p in zip(serial, pooled):
+        assert s["inertia"] == pytest.approx(p["inertia"])
+        assert s["silhouette"] == pytest.approx(p["silhouette"])
+
+
+def test_cluster_batches_picks_planted_groups():
+    rng = np.random.default_rng(2)
+    n = 300
+    group = np.arange(n) % 3
+    df = pd.DataFrame({
+        "batch_id": [f"B{i:04d}" for i in range(n)],
+        "farm_name": np.array(["Farm A", "Farm B", "Farm C"])[group],
+        "temperature": np.array([4.0, 6.0, 12.0])[group] + rng.normal(0, 0.2, n),
+        "quantity": np.array([1000, 400, 1000])[group] + rng.normal(0, 10, n),
+    })
+    result = cluster_batches(df, max_workers=1)
+    assert result["best_k"] == 3
+    assert sorted(c["size"] for c in result["clusters"]) == [100, 100, 100]
+    high = result["clusters"][0]
+    assert high["risk_group"] == "高" and high["top_farms"] == {"Farm C": 100}
+    assert cluster_batches(df.head(2))["error"]
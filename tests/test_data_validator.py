@@ -0,0 +1,50 @@
+# tests/test_data_validator.py - 資料完整性驗證引擎（Agent 006）的回歸測試
+
+import pandas as pd
+
+from utils.data_validator import DataValidator, validate_dataframe
+
+
+def test_consistent_with_all_null_column():
+    # packing_facility 全為空值時 (key, value) 組合為空，不能讓整個驗證失敗
+    validator = DataValidator([{"id": "one_facility", "type": "consistent",
+                                "key": "batch_id", "column": "packing_facility"}])
+    df = pd.DataFrame({"batch_id": ["B1", "B2", "B3"], "farm_name": ["A", "B", "C"],
+                       "packing_facility": [None] * 3})
+    rule = validator.validate(df)["rules"][0]
+    assert rule["status"] == "ok"
+    assert rule["violations"] == 0
+
+
+def test_consistent_flags_conflicting_values():
+    validator = DataValidator([{"id": "one_facility", "type": "consistent",
+                                "key": "batch_id", "column": "packing_facility"}])
+    df = pd.DataFrame({"batch_id": ["B1", "B1", "B2"], "packing_facility": ["P1", "P2", "P1"]})
+    assert validator.validate(df)["rules"][0]["violations"] == 2
+
+
+def test_validate_dataframe_with_default_rules_and_null_columns():
+    df = pd.DataFrame({"batch_id": ["B1", "B2", "B3"], "farm_name": ["A", "B", "C"],
+                       "packing_facility": [None] * 3})
+    report = validate_dataframe(df)
+    assert report["rows"] == 3
+
+
+def test_run_all_agents_with_all_null_column():
+    from agents.pipeline import run_all_agents
+
+    df = pd.DataFrame({"batch_id": ["B1", "B2", "B3"], "farm_name": ["A", "B", "C"],
+                       "temperature": [4.0, 5.0, 6.0], "packing_facility": [None] * 3})
+    results = run_all_agents(df, update_model=False)
+    assert results["validation"]["rows"] == 3
+
+
+def test_default_rules_accept_multiple_rows_per_batch():
+    # 多列同一批次（各階段的出貨紀錄）：consistent / balance 以 batch_id 分組，不能同時要求 batch_id 唯一
+    df = pd.DataFrame({"batch_id": ["B1", "B1", "B2"], "farm_name": ["A", "A", "B"],
+                       "laying_date": ["2024-01-01"] * 3, "packing_facility": ["P1", "P1", "P2"],
+                       "quantity_packed": [100, 100, 50], "quantity_shipped": [60, 40, 50]})
+    report = validate_dataframe(df)
+    assert report["passed"], report["violated_rules"]
+    duplicated = DataValidator([{"id": "batch_id_unique", "type": "unique", "columns": ["batch_id"]}])
+    assert duplicated.validate(df)["rules"][0]["violations"] == 2
@@ -0,0 +1,34 @@
+# tests/test_entity_resolution.py - 實體名稱比對（Agent 005）的回歸測試
+
+import pandas as pd
+
+from services.entity_resolution import canonicalize_entities, numbers, resolve_entities
+
+
+def test_numbered_farms_are_not_merged():
+    names = ["Sunrise Farm 1", "Sunrise Farm 2", "Sunrise Farm 3", "Sunrise Farm 10"]
+    assert resolve_entities(names, {n: 10 for n in names}) == {}
+
+
+def test_numbered_farms_kept_in_dataframe():
+    df = pd.DataFrame({"farm_name": ["Sunrise Farm 1"] * 3 + ["Sunrise Farm 2", "Sunrise Farm 3"]})
+    assert canonicalize_entities(df) == {}
+    assert df["farm_name"].tolist() == ["Sunrise Farm 1"] * 3 + ["Sunrise Farm 2", "Sunrise Farm 3"]
+
+
+def test_cjk_numbered_facilities_are_not_merged():
+    assert resolve_entities(["快樂農場一廠", "快樂農場二廠"]) == {}
+
+
+def test_company_suffix_is_merged():
+    mapping = resolve_entities(["快樂農場", "快樂農場有限公司"], {"快樂農場": 5, "快樂農場有限公司": 2})
+    assert mapping == {"快樂農場有限公司": "快樂農場"}
+
+
+def test_same_number_with_company_suffix_is_merged():
+    mapping = resolve_entities(["Sunrise Farm 2", "SUNRISE FARM 2 Co., Ltd."], {"Sunrise Farm 2": 3})
+    assert mapping == {"SUNRISE FARM 2 Co., Ltd.": "Sunrise Farm 2"}
+
+
+def test_numbers_ignore_leading_zeros():
+    assert numbers("farm 01") == numbers("farm 1")
@@ -0,0 +1,44 @@
+# tests/test_forecasting.py - 預測快取（Agent 008）的並行寫入與損毀容錯
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from services.forecasting import ForecastCache, forecast_farms
+
+
+def _farm_frame(farms, days: int = 60, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2024-01-01", periods=days, freq="D")
+    rows = [(farm, d, int(rng.integers(80, 120))) for farm in farms for d in dates]
+    return pd.DataFrame(rows, columns=["farm_name", "laying_date", "quantity"])
+
+
+def _forecast(args):
+    path, farms, seed = args
+    return forecast_farms(_farm_frame(farms, seed=seed), cache=ForecastCache(path), max_workers=1)["farms"]
+
+
+def test_concurrent_writers_keep_every_farm(tmp_path):
+    path = str(tmp_path / "forecast_cache.db")
+    jobs = [(path, [f"Farm {w}-{i}" for i in range(5)], w) for w in range(6)]
+    with ProcessPoolExecutor(max_workers=6) as pool:
+        assert list(pool.map(_forecast, jobs)) == [5] * 6
+    farms = [farm for _, names, _ in jobs for farm in names]
+    assert set(ForecastCache(path).get_many(farms)) == set(farms)
+
+
+def test_corrupt_cache_is_rebuilt(tmp_path):
+    path = tmp_path / "forecast_cache.db"
+    path.write_bytes(b"{\"Farm A\": {\"model\": ")     # 寫到一半的舊快取
+    result = forecast_farms(_farm_frame(["Farm A"]), cache=ForecastCache(str(path)), max_workers=1)
+    assert result["farms"] == 1
+    assert ForecastCache(str(path)).get_many(["Farm A"])["Farm A"]["last_date"] == "2024-02-29"
+
+
+def test_second_run_updates_from_cache(tmp_path):
+    cache = ForecastCache(str(tmp_path / "forecast_cache.db"))
+    first = forecast_farms(_farm_frame(["Farm A"]), cache=cache, max_workers=1)
+    again = forecast_farms(_farm_frame(["Farm A"]), cache=cache, max_workers=1)
+    assert first["refitted"] == 1 and again["refitted"] == 0
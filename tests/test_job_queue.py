@@ -0,0 +1,35 @@
+# tests/test_job_queue.py - 背景工作佇列：反覆讓 worker 中斷的工作不能無限重試
+
+import pandas as pd
+
+from services.job_queue import MAX_ATTEMPTS, JobQueue
+
+
+def _crash(queue: JobQueue) -> None:
+    """模擬 worker 在執行中被終止：工作停在 running，heartbeat 不再更新"""
+    job = queue.claim("worker-1")
+    assert job is not None
+    queue.requeue_stale(stale_after=-1)
+
+
+def test_job_fails_after_max_attempts(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job_id = queue.submit(pd.DataFrame({"batch_id": ["B1"]}))
+    for _ in range(MAX_ATTEMPTS - 1):
+        _crash(queue)
+        assert queue.get(job_id)["status"] == "queued"
+    _crash(queue)
+    job = queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["attempts"] == MAX_ATTEMPTS
+    assert queue.claim("worker-1") is None
+
+
+def test_resume_resets_attempts(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job_id = queue.submit(pd.DataFrame({"batch_id": ["B1"]}))
+    for _ in range(MAX_ATTEMPTS):
+        _crash(queue)
+    queue.resume(job_id)
+    job = queue.get(job_id)
+    assert job["status"] == "queued" and job["attempts"] == 0
@@ -0,0 +1,109 @@
+# tests/test_llm.py - hedged request：勝者選擇、輸家取消、全部失敗時的備援，以及 Gemini 全域 key 的序列化
+
+import asyncio
+import sys
+import types
+
+import pytest
+
+from utils.llm import LLMProvider
+
+
+class FakeStreams(LLMProvider):
+    """以腳本取代真實供應商：{provider: (首 token 延遲秒數, 文字片段, 例外)}"""
+
+    def __init__(self, scripts, **keys):
+        super().__init__(**keys)
+        self.scripts = scripts
+        self.closed = set()
+
+    async def astream(self, prompt, model=None, provider=None, json_schema=None):
+        delay, chunks, error = self.scripts[provider]
+        try:
+            await asyncio.sleep(delay)
+            if error is not None:
+                raise error
+            for chunk in chunks:
+                yield chunk
+                await asyncio.sleep(0)
+        finally:
+            self.closed.add(provider)
+
+
+def _provider(scripts):
+    return FakeStreams(scripts, **{f"{p}_key": "k" for p in scripts})
+
+
+def test_fast_primary_wins_without_hedging():
+    llm = _provider({"openai": (0.0, ["ok"], None), "groq": (0.0, ["backup"], None)})
+    assert asyncio.run(llm.ahedged("p", "gpt-4o", hedge_delay=0.5)) == "ok"
+    assert llm.last_hedge["winner"] == "openai" and not llm.last_hedge["hedged"]
+    assert "groq" not in llm.closed          # 備援從未送出
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    llm = _provider({"openai": (5.0, ["late"], None), "groq": (0.0, ["fast", "!"], None)})
+    assert asyncio.run(llm.ahedged("p", "gpt-4o", hedge_delay=0.05)) == "fast!"
+    assert llm.last_hedge["winner"] == "groq" and llm.last_hedge["hedged"]
+    assert "openai" in llm.closed            # 輸家已取消（串流的 finally 已執行）
+
+
+def test_failed_primary_falls_to_backup():
+    llm = _provider({"openai": (0.0, [], RuntimeError("down")), "groq": (0.1, ["backup"], None)})
+    assert asyncio.run(llm.ahedged("p", "gpt-4o", hedge_delay=1.0)) == "backup"
+    assert llm.last_hedge["winner"] == "groq"
+
+
+def test_both_failing_uses_remaining_providers_then_raises():
+    scripts = {"openai": (0.0, [], RuntimeError("primary down")), "gemini": (0.0, [], RuntimeError("backup down")),
+               "groq": (0.0, ["third"], None)}
+    assert asyncio.run(_provider(scripts).ahedged("p", "gpt-4o", hedge_delay=0.01)) == "third"
+    del scripts["groq"]
+    with pytest.raises(RuntimeError, match="primary down"):
+        asyncio.run(_provider(scripts).ahedged("p", "gpt-4o", hedge_delay=0.01))
+
+
+def test_first_token_times_out():
+    llm = _provider({"openai": (5.0, ["late"], None)})
+
+    async def scenario():
+        runs = {"openai": llm._start("openai", "p", None)}
+        winner = await llm._first_token(runs, timeout=0.05)
+        runs["openai"].task.cancel()
+        return winner
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_gemini_key_is_not_shared_between_concurrent_calls(monkeypatch):
+    genai = types.ModuleType("google.generativeai")
+    state = {"key": None}
+    seen = []
+
+    def configure(api_key):
+        state["key"] = api_key
+
+    class GenerativeModel:
+        def __init__(self, name):
+            self.name = name
+
+        async def generate_content_async(self, text, stream, generation_config):
+            await asyncio.sleep(0.02)         # 送出請求前，另一個租戶可能已呼叫 configure
+            seen.append((text, state["key"]))
+
+            async def chunks():
+                yield types.SimpleNamespace(text="x")
+            return chunks()
+
+    genai.configure, genai.GenerativeModel = configure, GenerativeModel
+    google = types.ModuleType("google")
+    google.generativeai = genai
+    monkeypatch.setitem(sys.modules, "google", google)
+    monkeypatch.setitem(sys.modules, "google.generativeai", genai)
+
+    async def scenario():
+        tenants = [LLMProvider(gemini_key=f"key-{i}") for i in range(4)]
+        await asyncio.gather(*(t.agenerate(f"key-{i}", "gemini-1.5-pro") for i, t in enumerate(tenants)))
+
+    asyncio.run(scenario())
+    assert len(seen) == 4 and all(text == key for text, key in seen)
@@ -0,0 +1,40 @@
+# tests/test_local_compute.py - 本地統計代理的平行度：外層 pool 內不再開巢狀 pool
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from services import clustering
+from services.local_compute import run_local_agents
+from utils.shared_frame import default_workers
+
+
+def _frame(n: int = 400) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 60 * 24, n), unit="h")
+    return pd.DataFrame({
+        "batch_id": [f"B{i:04d}" for i in range(n)],
+        "farm_name": rng.choice(["Farm A", "Farm B", "Farm C"], n),
+        "laying_date": start,
+        "packing_date": start + pd.to_timedelta(rng.integers(1, 48, n), unit="h"),
+        "temperature": rng.normal(5, 2, n),
+        "quantity": rng.integers(500, 1500, n),
+    })
+
+
+def test_default_workers_is_serial_inside_pool_worker():
+    assert default_workers(3) == 3
+    assert default_workers() >= 1
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        assert pool.submit(default_workers).result() == 1
+
+
+def test_serial_run_does_not_open_nested_pool(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("max_workers=1 時不應再開 process pool")
+
+    monkeypatch.setattr(clustering, "ProcessPoolExecutor", no_pool)
+    result = run_local_agents(_frame(), ["agent_009"], max_workers=1)["agent_009"]
+    assert result["status"] == "ok", result["output"]
+    assert result["output"]["best_k"] >= 2
@@ -0,0 +1,85 @@
+# tests/test_map_reduce.py - 分區 map-reduce：區塊打包、reduce 扇入與快取
+
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.agent_cache import AgentCache
+from services.map_reduce import REDUCE_FANIN, build_chunks, map_reduce
+from utils.token_budget import count_tokens
+
+
+def _violations(farms: int = 20, rows_per_farm: int = 30) -> pd.DataFrame:
+    n = farms * rows_per_farm
+    return pd.DataFrame({"batch_id": [f"B{i:05d}" for i in range(n)],
+                         "farm_name": [f"Farm {i % farms:02d}" for i in range(n)],
+                         "laying_date": pd.Timestamp("2025-11-01"),
+                         "temperature": np.round(np.linspace(8.5, 12.0, n), 2)})
+
+
+class FakeLLM:
+    def __init__(self, fail_on=None):
+        self.prompts = []
+        self.fail_on = fail_on
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt, model):
+        with self._lock:
+            self.prompts.append(prompt)
+        if self.fail_on and self.fail_on in prompt:
+            raise ConnectionError("timeout")
+        return f"摘要（{prompt.count(chr(10))} 行）"
+
+
+def _map_prompt(label, text):
+    return f"MAP {label}\n{text}"
+
+
+def _reduce_prompt(parts):
+    return "REDUCE\n" + "\n".join(f"## {label}\n{text}" for label, text in parts)
+
+
+def test_chunks_pack_small_partitions_and_split_large_ones():
+    df = _violations(farms=6, rows_per_farm=10)
+    big = _violations(farms=1, rows_per_farm=600).assign(farm_name="Farm Big")
+    df = pd.concat([df, big], ignore_index=True)
+    budget = 1500
+    chunks = build_chunks(df, chunk_tokens=budget)
+    assert sum(c.rows for c in chunks) == len(df)
+    split = [c for c in chunks if c.partitions == ["Farm Big / 2025-11"]]
+    assert len(split) > 1 and sum(c.rows for c in split) == 600
+    packed = [c for c in chunks if c not in split]
+    assert len(packed) == 1 and len(packed[0].partitions) == 6       # 6 個小分區合併成一個區塊
+    header = ",".join(df.columns)
+    for c in chunks:
+        body = "\n".join(line for line in c.text.splitlines() if line and not line.startswith("###") and line != header)
+        assert count_tokens(body) <= budget
+
+
+def test_reduce_fan_in_and_coverage():
+    llm = FakeLLM()
+    result = map_reduce(_violations(), llm, _map_prompt, _reduce_prompt, chunk_tokens=300)
+    assert result["chunks"] > REDUCE_FANIN and result["coverage"] == 1.0
+    reduces = [p for p in llm.prompts if p.startswith("REDUCE")]
+    assert all(1 < p.count("\n## ") <= REDUCE_FANIN for p in reduces)
+    assert result["levels"] >= 2 and result["calls"] == result["chunks"] + len(reduces)
+    assert result["rows"] == len(_violations())
+
+
+def test_failed_chunk_lowers_coverage():
+    llm = FakeLLM(fail_on="MAP Farm 03")
+    result = map_reduce(_violations(), llm, _map_prompt, _reduce_prompt, chunk_tokens=300)
+    assert result["failed"] and all("Farm 03" in f["label"] for f in result["failed"])
+    assert result["coverage"] == pytest.approx(1 - sum(f["rows"] for f in result["failed"]) / result["rows"])
+
+
+def test_rerun_is_served_from_cache(tmp_path):
+    memo = AgentCache(str(tmp_path / "cache.db"))
+    first = map_reduce(_violations(), FakeLLM(), _map_prompt, _reduce_prompt, chunk_tokens=300, memo=memo)
+    assert first["cached"] == 0
+    llm = FakeLLM()
+    again = map_reduce(_violations(), llm, _map_prompt, _reduce_prompt, chunk_tokens=300, memo=memo)
+    assert llm.prompts == [] and again["cached"] == again["calls"] == first["calls"]
+    assert again["summary"] == first["summary"]
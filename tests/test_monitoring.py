@@ -0,0 +1,64 @@
+# tests/test_monitoring.py - 即時監控（Agent 003 / 019 / 021）的輸入防護
+
+import math
+import time
+
+from services.monitoring import Monitor, MonitorRunner
+
+
+def test_non_finite_temperature_is_rejected():
+    monitor = Monitor(window_seconds=600)
+    for i, line in enumerate(['{"batch_id": "B1", "ts": 0, "temperature": 5.0}',
+                              '{"batch_id": "B1", "ts": 60, "temperature": NaN}',
+                              '{"batch_id": "B1", "ts": 120, "temperature": Infinity}',
+                              '{"batch_id": "B1", "ts": 180, "temperature": 6.0}']):
+        monitor.ingest_line(line)
+    tile = monitor.batches["B1"].tile()
+    assert monitor.summary()["rejected"] == 2
+    assert tile["readings"] == 2
+    assert math.isfinite(tile["mean"]) and tile["mean"] == 5.5
+
+
+def test_non_finite_timestamp_is_rejected():
+    monitor = Monitor()
+    monitor.ingest_line('{"batch_id": "B1", "ts": NaN, "temperature": 5.0}')
+    assert monitor.summary()["rejected"] == 1
+    assert "B1" not in monitor.batches
+
+
+def test_non_object_events_and_bad_batch_ids_are_rejected():
+    monitor = Monitor()
+    for line in ['5', '[1, 2]', '"B1"', 'null',
+                 '{"batch_id": [1], "ts": 0, "temperature": 5.0}',
+                 '{"batch_id": {"id": 1}, "ts": 0}',
+                 '{"batch_id": true, "ts": 0}',
+                 '{"batch_id": 7, "ts": 0, "temperature": 5.0}']:
+        monitor.ingest_line(line)
+    assert monitor.summary()["rejected"] == 7
+    assert list(monitor.batches) == ["7"]
+
+
+def test_runner_survives_a_failing_line(tmp_path):
+    path = tmp_path / "events.ndjson"
+    path.write_text('{"batch_id": "B1", "ts": 0, "temperature": 5.0}\n'
+                    'boom\n'
+                    '{"batch_id": "B1", "ts": 60, "temperature": 6.0}\n', encoding="utf-8")
+    monitor = Monitor()
+    ingest = monitor.ingest_line
+
+    def flaky(line):
+        if line.strip() == "boom":
+            raise RuntimeError("unexpected")
+        return ingest(line)
+
+    monitor.ingest_line = flaky
+    runner = MonitorRunner(monitor, str(path)).start()
+    try:
+        deadline = time.time() + 5
+        while monitor.ingested < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert monitor.ingested == 2
+        assert monitor.rejected == 1
+        assert runner.alive and runner.error is None
+    finally:
+        runner.stop()
@@ -0,0 +1,22 @@
+# tests/test_pipeline.py - 多資料集執行（run_many）：單一 worker 與 process pool 行為一致
+
+import pandas as pd
+
+from agents import pipeline
+
+
+def test_serial_run_many_isolates_failures_and_keeps_model(monkeypatch):
+    calls = []
+
+    def fake_run_all_agents(df, llm_call=None, model="gpt-4o", **kwargs):
+        calls.append(kwargs)
+        if df.empty:
+            raise ValueError("empty dataset")
+        return {"rows": len(df)}
+
+    monkeypatch.setattr(pipeline, "run_all_agents", fake_run_all_agents)
+    datasets = {"bad": pd.DataFrame(), "good": pd.DataFrame({"batch_id": ["B1", "B2"]})}
+    results = pipeline.run_many(datasets, max_workers=1)
+    assert results == {"bad": {"error": "ValueError: empty dataset"}, "good": {"rows": 2}}
+    # 與 pool 相同：不更新共用的異常偵測模型、代理在本程序內依序執行
+    assert all(c["update_model"] is False and c["local_workers"] == 1 for c in calls)
@@ -0,0 +1,51 @@
+# tests/test_profiler.py - 資料剖析器（Agent 001 / 002）：巢狀 JSON 欄位與 KMV 基數估計
+
+import numpy as np
+import pandas as pd
+
+from services.local_compute import run_local_agents
+from services.profiler import KMV_SIZE, profile_dataframe
+from utils.hashing import hash_values
+
+
+def test_nested_json_columns_are_profiled():
+    df = pd.DataFrame({"meta": [{"k": 1}, {"k": 2}, {"k": 1}, None], "tags": [[1], [2, 3], [], [1]]})
+    profile = profile_dataframe(df)
+    assert profile["columns"]["meta"]["distinct"] == 2
+    assert profile["columns"]["meta"]["null_rate"] == 0.25
+    assert profile["columns"]["tags"]["distinct"] == 3
+
+
+def test_single_row_nested_frame():
+    assert profile_dataframe(pd.DataFrame({"meta": [{"k": 1}]}))["columns"]["meta"]["distinct"] == 1
+
+
+def test_nested_values_hash_consistently_across_chunks():
+    # 同一個值在只有字串的區塊與含 dict 的區塊中雜湊相同，跨區塊的相異值計數不會重複
+    plain = pd.Series(["a", "b"], dtype=object)
+    mixed = pd.Series(["a", {"k": 1}], dtype=object)
+    assert hash_values(plain)[0] == hash_values(mixed)[0]
+    assert hash_values(pd.Series([{"a": 1, "b": 2}]))[0] == hash_values(pd.Series([{"b": 2, "a": 1}]))[0]
+
+
+def test_exact_distinct_below_sketch_size():
+    df = pd.DataFrame({"x": np.arange(1000) % 250})
+    summary = profile_dataframe(df)["columns"]["x"]
+    assert summary["distinct"] == 250 and not summary["estimated"]
+
+
+def test_kmv_estimate_within_tolerance_across_chunks():
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 200_000, 400_000)
+    df = pd.DataFrame({"x": values})
+    summary = profile_dataframe(df, chunk_rows=50_000)["columns"]["x"]
+    exact = len(np.unique(values))
+    assert summary["estimated"] and exact > KMV_SIZE
+    assert abs(summary["distinct"] - exact) / exact < 0.05
+
+
+def test_descriptive_statistics_with_nested_column():
+    df = pd.DataFrame({"batch_id": ["B1", "B2"], "meta": [{"k": 1}, {"k": 1}]})
+    result = run_local_agents(df, ["agent_007"], max_workers=1)["agent_007"]
+    assert result["status"] == "ok"
+    assert result["output"]["categorical"]["meta"]["unique"] == 1
@@ -0,0 +1,100 @@
+# tests/test_risk_scoring.py - 風險評分（Agent 021-026 / 029）與異常偵測模型更新的回歸測試
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from agents.pipeline import run_all_agents, score_risk
+from models.ml_models.anomaly_detector import DEFAULT_MODEL_PATH, AnomalyDetector, model_path
+
+
+@pytest.fixture(autouse=True)
+def model_dir(tmp_path, monkeypatch):
+    # 模型檔路徑是相對路徑，測試在暫存目錄執行，不動到真正的基線
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def _batches(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"batch_id": [f"B{i:05d}" for i in range(n)],
+                         "temperature": rng.normal(5, 1, n).clip(2.5, 7.5),
+                         "quantity": rng.integers(900, 1100, n)})
+
+
+def test_no_numeric_features_skips_scoring():
+    df = pd.DataFrame({"batch_id": ["B1", "B2", "B3"], "farm_name": ["A", "B", "C"],
+                       "retailer": ["R1", "R2", "R3"]})
+    scored, risk = score_risk(df)
+    assert scored.empty
+    assert risk["risk_score"] == 0.0
+    assert not os.path.exists(DEFAULT_MODEL_PATH)
+    assert run_all_agents(df.copy())["risk_score"] == 0.0
+
+
+def test_in_range_batches_score_low():
+    _, risk = score_risk(_batches(2000))
+    assert risk["risk_score"] < 4
+
+
+def test_widespread_anomalies_score_high():
+    score_risk(_batches(2000))
+    bad = _batches(200, seed=1)
+    bad.loc[:60, "temperature"] = 25.0
+    _, risk = score_risk(bad)
+    assert risk["risk_score"] >= 9
+
+
+def test_model_learns_clean_batches_once():
+    df = _batches(500)
+    score_risk(df)
+    first = AnomalyDetector.load()
+    assert first is not None
+    score_risk(df)
+    again = AnomalyDetector.load()
+    np.testing.assert_array_equal(first.count, again.count)
+
+
+def test_anomalous_upload_does_not_shift_baseline():
+    score_risk(_batches(500))
+    before = AnomalyDetector.load()
+    bad = _batches(100, seed=2)
+    bad["temperature"] = 30.0
+    score_risk(bad)
+    after = AnomalyDetector.load()
+    np.testing.assert_array_equal(before.mean, after.mean)
+
+
+def test_new_features_extend_the_baseline():
+    score_risk(_batches(500)[["batch_id", "temperature"]])
+    assert "quantity" not in AnomalyDetector.load().features
+    score_risk(_batches(500))                            # 同一批資料再次上傳時多了 quantity
+    model = AnomalyDetector.load()
+    assert model.features[-1] == "quantity" and model.count[-1] > 0
+    bad = _batches(200, seed=4)
+    bad.loc[:60, "quantity"] = 50_000                     # 只有新特徵異常
+    scored, risk = score_risk(bad)
+    assert (scored["top_feature"] == "quantity").sum() >= 60
+    assert risk["risk_score"] >= 9
+
+
+def test_disjoint_features_are_scored_against_own_data():
+    score_risk(_batches(500)[["batch_id", "quantity"]])
+    df = _batches(300, seed=5)[["batch_id", "temperature"]]
+    _, risk = score_risk(df)                             # 既有基線沒有溫度特徵，不能全部評為 0
+    assert risk["anomaly_rate"] < 0.05
+    assert AnomalyDetector.load().features[:2] == ["quantity", "temp_mean"]
+
+
+def test_baselines_are_kept_per_tenant():
+    score_risk(_batches(500), baseline="tenant-a")
+    assert os.path.exists(model_path("tenant-a"))
+    assert not os.path.exists(DEFAULT_MODEL_PATH)
+    hot = _batches(500, seed=6)
+    hot["temperature"] += 20                              # 另一個租戶的正常範圍完全不同
+    score_risk(hot, baseline="tenant-b")
+    a, b = AnomalyDetector.load(model_path("tenant-a")), AnomalyDetector.load(model_path("tenant-b"))
+    assert a.mean[0] == pytest.approx(5, abs=0.2) and b.mean[0] == pytest.approx(25, abs=0.2)
+    assert model_path("tenant/a") != model_path("tenant_a")
@@ -0,0 +1,77 @@
+# tests/test_scheduler.py - 多租戶 LLM 排程：公平輪流、互動請求保留名額、token 額度
+
+import threading
+
+import pytest
+
+from services.scheduler import BATCH, INTERACTIVE, FairScheduler, QuotaExceededError, ScheduledLLM
+
+
+def _gate():
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocker():
+        started.set()
+        assert release.wait(5)
+    return blocker, started, release
+
+
+def test_tenants_take_turns_by_virtual_time():
+    scheduler = FairScheduler(max_concurrency=1, interactive_reserved=0)
+    blocker, started, release = _gate()
+    scheduler.submit("x", blocker, cost=1)
+    assert started.wait(5)
+    order = []
+    futures = [scheduler.submit("a", order.append, "a", cost=1) for _ in range(4)]
+    futures += [scheduler.submit("b", order.append, "b", cost=1) for _ in range(2)]
+    release.set()
+    for f in futures:
+        f.result(5)
+    # 先送出大量請求的租戶不會霸佔：a、b 輪流，b 用完後 a 才連續執行
+    assert order == ["a", "b", "a", "b", "a", "a"]
+
+
+def test_interactive_requests_bypass_busy_batch_slots():
+    scheduler = FairScheduler(max_concurrency=3, interactive_reserved=1, per_tenant=4)
+    gates = [_gate() for _ in range(3)]
+    batch = [scheduler.submit(f"t{i}", g[0], priority=BATCH) for i, g in enumerate(gates)]
+    assert gates[0][1].wait(5) and gates[1][1].wait(5)
+    assert scheduler.stats()["running"] == {INTERACTIVE: 0, BATCH: 2}    # 第 3 個批次請求在排隊
+    assert not gates[2][1].is_set()
+    assert scheduler.run("analyst", lambda: "answer", priority=INTERACTIVE, timeout=5) == "answer"
+    for _, _, release in gates:
+        release.set()
+    for f in batch:
+        f.result(5)
+
+
+def test_quota_rejects_without_charging():
+    scheduler = FairScheduler(tokens_per_hour=100)
+    assert scheduler.run("a", lambda: 1, cost=80, timeout=5) == 1
+    with pytest.raises(QuotaExceededError) as e:
+        scheduler.run("a", lambda: 2, cost=50, timeout=5)
+    assert e.value.tenant == "a" and e.value.retry_after > 0
+    stats = scheduler.stats("a")
+    assert stats["requests"] == 1 and stats["tokens_used"] == 80 and 19 <= stats["tokens_remaining"] <= 21
+    assert scheduler.run("b", lambda: 3, cost=50, timeout=5) == 3      # 額度各租戶獨立
+
+
+def test_scheduled_llm_routes_calls_through_scheduler():
+    class Provider:
+        system_prompt = ""
+        max_tokens = 10
+
+        def __call__(self, prompt, model=None):
+            return f"{model}:{prompt}"
+
+        def resolve_model(self, model=None):
+            return model or "gpt-4o"
+
+    scheduler = FairScheduler()
+    llm = ScheduledLLM(Provider(), scheduler, "a", INTERACTIVE)
+    assert llm("hello", "gpt-4o") == "gpt-4o:hello"
+    assert llm.resolve_model() == "gpt-4o"
+    assert not hasattr(llm, "structured")
+    stats = scheduler.stats("a")
+    assert stats["requests"] == 1 and stats["tokens_used"] > 10
@@ -0,0 +1,78 @@
+# tests/test_shared_frame.py - 共享記憶體 DataFrame 的 dtype 還原與 process pool 結果一致性
+
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.local_compute import LOCAL_AGENTS, run_local_agents
+from utils.shared_frame import SharedFrame
+
+
+def _frame(n: int = 300) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    temps = rng.normal(5, 2, n)
+    df = pd.DataFrame({
+        "batch_id": [f"B{i:04d}" for i in range(n)],
+        "farm_name": rng.choice(["Farm A", "Farm B", "Farm C"], n),
+        "packing_facility": rng.choice(["P1", "P2"], n),
+        "retailer": rng.choice(["R1", "R2"], n),
+        "temperature": pd.array(temps, dtype="Float64"),
+        "quantity": pd.array((temps * 100).round(), dtype="Int64"),
+        "temperature_violation": np.where(rng.random(n) < 0.1, None, temps > 8).astype(object),
+        "laying_date": pd.date_range("2024-01-01", periods=n, freq="h"),
+    })
+    df.loc[3, "quantity"] = pd.NA
+    return df
+
+
+def test_round_trip_preserves_dtypes_and_values():
+    df = pd.DataFrame({
+        "int": pd.array([1, None, 3], dtype="Int64"),
+        "float": pd.array([1.5, None, 2.0], dtype="Float64"),
+        "flag": pd.array([True, None, False], dtype="boolean"),
+        "object_flag": [True, None, False],
+        "text": ["a", None, "b"],
+        "string": pd.Series(["a", None, "b"], dtype="string"),
+        "category": pd.Categorical(["x", "y", None], ordered=True),
+        "mixed": [1, "a", np.nan],
+        "numeric": [1.0, np.nan, 2.0],
+        "date": pd.to_datetime(["2024-01-01", None, "2024-02-01"]),
+        "local_date": pd.to_datetime(["2024-01-01", None, "2024-02-01"]).tz_localize("Asia/Taipei"),
+    })
+    with SharedFrame.from_dataframe(df) as shared:
+        attached = pickle.loads(pickle.dumps(shared))   # 與 worker 相同：只傳欄位描述再 attach
+        out = attached.to_dataframe()
+        pd.testing.assert_frame_equal(out, df)
+        assert out["object_flag"].tolist() == [True, None, False]
+        del out
+        attached.close()
+
+
+@pytest.mark.parametrize("agent_ids", [["agent_007", "agent_012"], list(LOCAL_AGENTS)])
+def test_pool_matches_serial(agent_ids):
+    df = _frame()
+    serial = run_local_agents(df, agent_ids, max_workers=1)
+    pooled = run_local_agents(df, agent_ids, max_workers=4)
+    for agent_id in agent_ids:
+        assert serial[agent_id]["status"] == pooled[agent_id]["status"] == "ok"
+        assert serial[agent_id]["output"] == pooled[agent_id]["output"]
+
+
+def test_nested_json_columns_round_trip_and_pool():
+    # pd.read_json 讀入的巢狀欄位是 dict / list 物件，無法 factorize
+    df = _frame(60)
+    df["meta"] = [{"sensor": i % 3} if i % 4 else None for i in range(60)]
+    df["tags"] = [["cold", "chain"][: i % 3] for i in range(60)]
+    with SharedFrame.from_dataframe(df) as shared:
+        attached = pickle.loads(pickle.dumps(shared))
+        out = attached.to_dataframe()
+        pd.testing.assert_frame_equal(out, df)
+        del out
+        attached.close()
+    serial = run_local_agents(df, ["agent_007", "agent_012"], max_workers=1)
+    pooled = run_local_agents(df, ["agent_007", "agent_012"], max_workers=2)
+    for agent_id in ("agent_007", "agent_012"):
+        assert serial[agent_id]["status"] == pooled[agent_id]["status"] == "ok"
+        assert serial[agent_id]["output"] == pooled[agent_id]["output"]
@@ -0,0 +1,57 @@
+# tests/test_token_budget.py - 提示詞超出上下文視窗時的自動壓縮
+
+import json
+
+import pytest
+
+from utils.prompt_engine import render_value
+from utils.token_budget import PromptTooLargeError, compact_text, compact_value, count_tokens, fit_prompt
+
+MODEL = "gpt-4"        # 8,192 tokens 的小視窗
+
+
+def _build(context):
+    return "\n\n".join(f"### {title}\n{render_value(value)}" for title, value in context.items())
+
+
+def _records(n):
+    return [{"batch_id": f"B{i:05d}", "farm_name": "快樂農場", "temperature": 9.5, "stage": "packing_date"}
+            for i in range(n)]
+
+
+def test_small_prompt_untouched():
+    prompt, est = fit_prompt(_build, {"資料": {"rows": 3}}, MODEL, max_output_tokens=100)
+    assert prompt == _build({"資料": {"rows": 3}}) and not est.compacted
+
+
+def test_single_line_json_is_compacted_structurally():
+    context = {"摘要": {"總批次數": 5000}, "異常批次": {"rows": _records(5000), "note": "溫度超標"}}
+    assert "\n" not in render_value(context["異常批次"])           # render_value 輸出單行 JSON
+    prompt, est = fit_prompt(_build, context, MODEL, max_output_tokens=1000, render=render_value)
+    assert est.compacted and est.fits
+    section = json.loads(prompt.split("### 異常批次\n", 1)[1])     # 壓縮後仍是完整的 JSON
+    rows = section["rows"]
+    assert rows[:-1] == _records(len(rows) - 1)
+    assert rows[-1] == f"…（以下省略 {5001 - len(rows)} 項，共 5000 項）"
+    assert section["note"] == "溫度超標"
+    assert json.loads(prompt.split("### 摘要\n", 1)[1].split("\n\n###")[0]) == {"總批次數": 5000}
+
+
+def test_compact_value_truncates_dict_keys():
+    value = {f"farm_{i:04d}": list(range(20)) for i in range(500)}
+    compacted = compact_value(value, 600, MODEL, render_value)
+    assert count_tokens(render_value(compacted), MODEL) <= 600
+    kept = [k for k in compacted if k != "…"]
+    assert kept == list(value)[:len(kept)] and compacted["…"].startswith(f"…（以下省略 {500 - len(kept)} 項")
+
+
+def test_text_sections_keep_whole_lines():
+    text = "\n".join(f"B{i:05d},快樂農場,9.5" for i in range(5000))
+    compacted = compact_text(text, 500, MODEL)
+    lines = compacted.splitlines()
+    assert lines[-1].startswith("…（以下省略") and set(lines[:-1]) <= set(text.splitlines())
+
+
+def test_uncompactable_prompt_rejected():
+    with pytest.raises(PromptTooLargeError):
+        fit_prompt(lambda c: "溫度" * 20_000, {"資料": "x"}, MODEL)
@@ -0,0 +1 @@
+"""共用工具：欄位偵測、特徵工程與資料處理輔助函式。"""
@@ -0,0 +1,92 @@
+# utils/features.py - 批次資料欄位偵測與特徵工程
+# 所有本地代理共用同一套欄位規則，避免各自猜測溫度/日期欄位
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 冷藏安全溫度區間（°C）
+SAFE_TEMP_RANGE: Tuple[float, float] = (2.0, 8.0)
+
+# 供應鏈各階段日期（依先後順序）
+STAGE_DATE_COLUMNS = ["laying_date", "packing_date", "distribution_date", "delivery_date"]
+DATE_COLUMNS = STAGE_DATE_COLUMNS + ["產蛋日期", "包裝日期", "出貨日期"]
+
+# 供應鏈節點欄位（依上下游順序）
+ENTITY_COLUMNS = ["farm_name", "packing_facility", "distributor", "retailer"]
+
+
+def find_temp_column(df: pd.DataFrame) -> Optional[str]:
+    """找出第一個溫度欄位（欄名含 temp 或 溫度）"""
+    for col in df.columns:
+        if any(k in str(col).lower() for k in ["temp", "溫度"]) and pd.api.types.is_numeric_dtype(df[col]):
+            return col
+    return None
+
+
+def find_quantity_column(df: pd.DataFrame) -> Optional[str]:
+    for col in ["quantity_cartons", "quantity", "數量"]:
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col]):
+            return col
+    return None
+
+
+def parse_dates(df: pd.DataFrame) -> pd.DataFrame:
+    """就地把已知日期欄位轉成 datetime（無法解析者為 NaT）"""
+    for col in DATE_COLUMNS:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    return df
+
+
+def stage_pairs(df: pd.DataFrame) -> List[Tuple[str, str]]:
+    """資料中實際存在的相鄰階段組合，例如 (laying_date, packing_date)"""
+    present = [c for c in STAGE_DATE_COLUMNS if c in df.columns]
+    return list(zip(present, present[1:]))
+
+
+def stage_delays(df: pd.DataFrame) -> pd.DataFrame:
+    """各相鄰階段間隔（小時），欄名如 laying_date→packing_date"""
+    out = {}
+    for start, end in stage_pairs(df):
+        delta = pd.to_datetime(df[end], errors="coerce") - pd.to_datetime(df[start], errors="coerce")
+        out[f"{start}→{end}"] = delta.dt.total_seconds() / 3600.0
+    return pd.DataFrame(out, index=df.index)
+
+
+def temperature_excursion(temps: pd.Series) -> pd.Series:
+    """超出 2-8°C 的度數（區間內為 0，缺值維持 NaN）"""
+    low, high = SAFE_TEMP_RANGE
+    values = temps.to_numpy(dtype=float)
+    return pd.Series(np.maximum(values - high, 0) + np.maximum(low - values, 0), index=temps.index)
+
+
+def batch_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    每個批次一列的數值特徵（供分群、異常偵測使用）
+
+    - 階段間隔（小時）
+    - 溫度平均/最高/最低、超出 2-8°C 的最大度數與超標比例
+    - 數量
+    同一 batch_id 有多筆（例如多筆感測紀錄）時彙總為一列。
+    """
+    frame = stage_delays(df)
+    agg = {col: "mean" for col in frame.columns}
+    temp_col = find_temp_column(df)
+    if temp_col:
+        frame["temp_mean"] = frame["temp_max"] = frame["temp_min"] = df[temp_col]
+        excursion = temperature_excursion(df[temp_col])
+        frame["temp_excursion_max"] = excursion
+        frame["temp_excursion_rate"] = (excursion > 0).astype(float).where(excursion.notna())
+        agg.update(temp_mean="mean", temp_max="max", temp_min="min",
+                   temp_excursion_max="max", temp_excursion_rate="mean")
+    qty_col = find_quantity_column(df)
+    if qty_col:
+        frame["quantity"] = df[qty_col]
+        agg["quantity"] = "sum"
+    if "batch_id" not in df.columns or not df["batch_id"].duplicated().any():
+        if "batch_id" in df.columns:
+            frame.index = df["batch_id"].astype(str)
+        return frame
+    return frame.groupby(df["batch_id"].astype(str), sort=False).agg(agg)
@@ -0,0 +1,38 @@
+# utils/hashing.py - 欄位值的 64-bit 雜湊（剖析器的 KMV 基數估計、代理快取的欄位指紋共用）
+# pd.util.hash_pandas_object 遇到 dict / list 等不可雜湊的值會丟出 TypeError（或全部雜湊成同一個值）；
+# pd.read_json 讀入巢狀 JSON 時物件欄位正是這種值，因此先把這些值轉成穩定的 JSON 文字再雜湊。
+
+import json
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+_UNHASHABLE = (dict, list, set, tuple, np.ndarray)
+_MARKER = "\ufffejson:"       # 雜湊時與原本就是同樣文字的字串值區隔（不能用 NUL：字串雜湊會在 NUL 截斷）
+
+
+def _to_json(value: Any) -> str:
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    elif isinstance(value, set):
+        value = sorted(value, key=repr)
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def jsonify_nested(s: pd.Series, prefix: str = "") -> pd.Series:
+    """物件欄位中的 dict / list 等值轉成 JSON 文字（鍵排序，內容相同即文字相同），其他值不變"""
+    if s.dtype != object:
+        return s
+    values = s.to_numpy()
+    nested = np.fromiter((isinstance(v, _UNHASHABLE) for v in values), dtype=bool, count=len(values))
+    if not nested.any():
+        return s
+    values = values.copy()
+    values[nested] = [prefix + _to_json(v) for v in values[nested]]
+    return pd.Series(values, index=s.index, dtype=object, name=s.name)
+
+
+def hash_values(s: pd.Series) -> np.ndarray:
+    """每個值的 uint64 雜湊（不含 index）；相同的值不論出現在哪一塊資料雜湊都相同"""
+    return pd.util.hash_pandas_object(jsonify_nested(s, _MARKER), index=False).to_numpy()
@@ -0,0 +1,65 @@
+# utils/lazy.py - 延遲匯入重量級套件
+# Streamlit 每次冷啟動都會執行整個 script 的頂層 import；LLM SDK 與繪圖套件改成第一次使用時才匯入，
+# 上傳檔案前的首頁不需要付出 plotly / openai / google-generativeai 等套件的載入時間。
+#
+#   px = lazy_import("plotly.express")
+#   OpenAI = lazy_import("openai", "OpenAI")
+#   px.line(...)          # 此時才真正 import plotly.express
+
+import importlib
+import threading
+from typing import Any, Dict, List, Optional
+
+_REGISTRY: Dict[str, "LazyImport"] = {}
+_LOCK = threading.Lock()
+
+
+class LazyImport:
+    """模組（或模組中的某個屬性）的代理物件，第一次取屬性或呼叫時才匯入"""
+
+    def __init__(self, module: str, attr: Optional[str] = None):
+        self._module = module
+        self._attr = attr
+        self._target: Any = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"{self._module}.{self._attr}" if self._attr else self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._target is not None
+
+    def resolve(self) -> Any:
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    target = importlib.import_module(self._module)
+                    self._target = getattr(target, self._attr) if self._attr else target
+        return self._target
+
+    def __getattr__(self, name: str) -> Any:
+        # 只有一般屬性會進到這裡（_module 等已在 __dict__ 中）
+        return getattr(self.resolve(), name)
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        return f"<lazy {self.name} ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+def lazy_import(module: str, attr: Optional[str] = None) -> LazyImport:
+    """同一個模組 / 屬性在整個 process 共用一個代理物件"""
+    key = f"{module}:{attr or ''}"
+    with _LOCK:
+        if key not in _REGISTRY:
+            _REGISTRY[key] = LazyImport(module, attr)
+        return _REGISTRY[key]
+
+
+def loaded_imports() -> List[str]:
+    """已實際匯入的延遲模組（除錯與基準測試用）"""
+    with _LOCK:
+        return sorted(proxy.name for proxy in _REGISTRY.values() if proxy.loaded)
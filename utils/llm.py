@@ -0,0 +1,330 @@
+# utils/llm.py - 多供應商 LLM 呼叫（OpenAI / Gemini / Groq / xAI）
+# 同步呼叫沿用 llm_call(prompt, model) 介面（依序備援）；
+# 延遲敏感的代理（agent_021 / 022 / 031）改用 hedged request：
+# 先送主要供應商，若超過該供應商首 token 延遲（TTFT）的 p95 仍未收到第一個 token，
+# 再送備援供應商，先吐出 token 的一方勝出，另一方立即取消。
+# 需要結構化結果的代理用 structured()：各供應商的 JSON mode（OpenAI / xAI 為 json_schema，
+# Groq 為 json_object，Gemini 為 response_mime_type）+ pydantic 驗證，不再二次請 LLM 擷取數字。
+
+import asyncio
+import inspect
+import json
+import re
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Type
+
+HEDGED_AGENTS = {"agent_021", "agent_022", "agent_031"}
+
+DEFAULT_MODELS = {
+    "openai": "gpt-4o",
+    "gemini": "gemini-1.5-pro",
+    "groq": "llama3-70b-8192",
+    "xai": "grok-beta",
+}
+# 由模型名稱判斷所屬供應商
+MODEL_PREFIXES = {"gpt": "openai", "o1": "openai", "gemini": "gemini", "llama": "groq",
+                  "mixtral": "groq", "gemma": "groq", "grok": "xai"}
+XAI_BASE_URL = "https://api.x.ai/v1"
+
+TEMPERATURE = 0.2
+MAX_TOKENS = 3000
+HEDGE_QUANTILE = 0.95
+DEFAULT_HEDGE_DELAY_S = 2.0    # 樣本不足時的備援觸發時間
+MIN_TTFT_SAMPLES = 20
+TTFT_WINDOW = 200
+LOCK_POLL_S = 0.005
+# google-generativeai 的 API key 是程序全域設定（genai.configure），
+# 模型物件在第一次呼叫時才綁定用戶端；不同租戶的 Gemini 呼叫必須把「設定 key + 送出請求」整段序列化
+_GENAI_LOCK = threading.Lock()
+_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+class StructuredOutputError(ValueError):
+    """LLM 回應不是符合 schema 的 JSON"""
+
+    def __init__(self, message: str, text: str):
+        super().__init__(message)
+        self.text = text
+
+
+def json_instruction(schema: Dict[str, Any]) -> str:
+    """附加在提示詞結尾的輸出格式說明（JSON mode 只保證是 JSON，欄位仍需在提示詞中說明）"""
+    return ("\n\n## 輸出格式\n只輸出一個 JSON 物件（不要 Markdown 程式碼區塊），符合以下 JSON Schema：\n"
+            + json.dumps(schema, ensure_ascii=False, separators=(",", ":")))
+
+
+class LatencyTracker:
+    """記錄各供應商最近的首 token 延遲，供 hedging 門檻使用（thread-safe）"""
+
+    def __init__(self, window: int = TTFT_WINDOW):
+        self._samples: Dict[str, Deque[float]] = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(provider, deque(maxlen=self._window)).append(seconds)
+
+    def quantile(self, provider: str, q: float = HEDGE_QUANTILE,
+                 default: float = DEFAULT_HEDGE_DELAY_S) -> float:
+        with self._lock:
+            samples = sorted(self._samples.get(provider, ()))
+        if len(samples) < MIN_TTFT_SAMPLES:
+            return default
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+@dataclass
+class _Run:
+    """一個供應商的串流呼叫：背景 task 與「已收到第一個 token」事件"""
+    provider: str
+    task: "asyncio.Task[str]"
+    first_token: asyncio.Event
+
+    def failed(self) -> bool:
+        return self.task.done() and not self.task.cancelled() and self.task.exception() is not None
+
+
+class LLMProvider:
+    """
+    多供應商 LLM 客戶端
+
+    llm = LLMProvider(openai_key, gemini_key, groq_key)
+    llm(prompt, "gpt-4o")                          # 同步，失敗時依序改用其他供應商
+    llm(prompt, "gpt-4o", agent_id="agent_031")    # 關鍵代理自動改用 hedged request
+    """
+
+    def __init__(self, openai_key: str = "", gemini_key: str = "", groq_key: str = "",
+                 xai_key: str = "", system_prompt: str = "", temperature: float = TEMPERATURE,
+                 max_tokens: int = MAX_TOKENS, latency: Optional[LatencyTracker] = None):
+        self.keys = {"openai": openai_key, "gemini": gemini_key, "groq": groq_key, "xai": xai_key}
+        self.providers: List[str] = [p for p, k in self.keys.items() if k]
+        self.system_prompt = system_prompt
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.latency = latency or LatencyTracker()
+        self.last_hedge: Dict[str, Any] = {}
+
+    # ---------- 供應商選擇 ----------
+    @staticmethod
+    def provider_for(model: Optional[str]) -> Optional[str]:
+        name = (model or "").lower()
+        for prefix, provider in MODEL_PREFIXES.items():
+            if name.startswith(prefix):
+                return provider
+        return None
+
+    def _order(self, model: Optional[str], provider: Optional[str] = None) -> List[str]:
+        """主要供應商在前，其餘依設定順序作為備援"""
+        first = provider or self.provider_for(model)
+        return sorted(self.providers, key=lambda p: p != first)
+
+    def _model_for(self, provider: str, model: Optional[str]) -> str:
+        return model if model and self.provider_for(model) == provider else DEFAULT_MODELS[provider]
+
+    def resolve_model(self, model: Optional[str] = None) -> str:
+        """實際會送出的模型（主要供應商）；用於送出前估算 token 與成本"""
+        return self._model_for(self._order(model)[0], model) if self.providers else (model or DEFAULT_MODELS["openai"])
+
+    # ---------- 串流 ----------
+    async def astream(self, prompt: str, model: Optional[str] = None, provider: Optional[str] = None,
+                      json_schema: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """逐段產生回應文字；json_schema 有值時使用該供應商的 JSON mode"""
+        provider = provider or self._order(model)[0]
+        model = self._model_for(provider, model)
+        if provider == "gemini":
+            import google.generativeai as genai
+            config = {"temperature": self.temperature, "max_output_tokens": self.max_tokens}
+            if json_schema is not None:
+                config["response_mime_type"] = "application/json"
+            async with _hold(_GENAI_LOCK):
+                genai.configure(api_key=self.keys["gemini"])
+                response = await genai.GenerativeModel(model).generate_content_async(
+                    self.system_prompt + prompt, stream=True, generation_config=config)
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+            return
+
+        if provider == "groq":
+            from groq import AsyncGroq
+            client = AsyncGroq(api_key=self.keys["groq"])
+        else:
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(api_key=self.keys[provider],
+                                 base_url=XAI_BASE_URL if provider == "xai" else None)
+        messages = ([{"role": "system", "content": self.system_prompt}] if self.system_prompt else []) + \
+                   [{"role": "user", "content": prompt}]
+        extra: Dict[str, Any] = {}
+        if json_schema is not None and provider == "groq":
+            extra["extra_body"] = {"response_format": {"type": "json_object"}}
+        elif json_schema is not None:
+            extra["response_format"] = {"type": "json_schema", "json_schema": {
+                "name": json_schema.get("title", "output"), "schema": json_schema, "strict": False}}
+        stream = await client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                      temperature=self.temperature, max_tokens=self.max_tokens,
+                                                      **extra)
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            # 被取消時關閉 HTTP 串流，不再消耗輸出 token
+            close = getattr(stream, "close", None)
+            if close is not None:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+
+    async def _collect(self, provider: str, prompt: str, model: Optional[str],
+                       first_token: Optional[asyncio.Event] = None,
+                       json_schema: Optional[Dict[str, Any]] = None) -> str:
+        start = time.perf_counter()
+        parts: List[str] = []
+        async for text in self.astream(prompt, model, provider, json_schema):
+            if not parts:
+                self.latency.record(provider, time.perf_counter() - start)
+                if first_token is not None:
+                    first_token.set()
+            parts.append(text)
+        return "".join(parts)
+
+    async def agenerate(self, prompt: str, model: Optional[str] = None,
+                        json_schema: Optional[Dict[str, Any]] = None) -> str:
+        """依序嘗試各供應商，第一個成功者的完整回應"""
+        if not self.providers:
+            raise RuntimeError("未設定任何 LLM API Key")
+        error: Optional[Exception] = None
+        for provider in self._order(model):
+            try:
+                return await self._collect(provider, prompt, model, json_schema=json_schema)
+            except Exception as e:
+                error = e
+        raise error
+
+    # ---------- Hedged request ----------
+    def _start(self, provider: str, prompt: str, model: Optional[str],
+               json_schema: Optional[Dict[str, Any]] = None) -> _Run:
+        first_token = asyncio.Event()
+        task = asyncio.create_task(self._collect(provider, prompt, model, first_token, json_schema))
+        return _Run(provider, task, first_token)
+
+    @staticmethod
+    async def _first_token(runs: Dict[str, _Run], timeout: Optional[float]) -> Optional[str]:
+        """等到任一呼叫吐出第一個 token（或直接完成）；逾時或全部失敗回傳 None"""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            live = [r for r in runs.values() if not r.failed()]
+            for run in live:
+                if run.first_token.is_set() or run.task.done():
+                    return run.provider
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if not live or (remaining is not None and remaining <= 0):
+                return None
+            waiters = [asyncio.create_task(r.first_token.wait()) for r in live]
+            try:
+                done, _ = await asyncio.wait(waiters + [r.task for r in live], timeout=remaining,
+                                             return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for w in waiters:
+                    w.cancel()
+            if not done:
+                return None
+
+    async def ahedged(self, prompt: str, model: Optional[str] = None, hedge_delay: Optional[float] = None,
+                      json_schema: Optional[Dict[str, Any]] = None) -> str:
+        """主要供應商超過 p95 TTFT 仍無回應時送出備援請求，先吐 token 者勝出，輸家取消"""
+        order = self._order(model)
+        if len(order) < 2:
+            return await self.agenerate(prompt, model, json_schema)
+        primary, backup = order[0], order[1]
+        delay = self.latency.quantile(primary) if hedge_delay is None else hedge_delay
+        started = time.perf_counter()
+        runs = {primary: self._start(primary, prompt, model, json_schema)}
+        winner = await self._first_token(runs, timeout=delay)
+        if winner is None:
+            runs[backup] = self._start(backup, prompt, model, json_schema)
+            winner = await self._first_token(runs, timeout=None)
+        for run in runs.values():
+            if run.provider != winner:
+                run.task.cancel()
+        self.last_hedge = {"primary": primary, "hedged": backup in runs, "winner": winner,
+                           "delay_s": round(delay, 3), "first_token_s": round(time.perf_counter() - started, 3)}
+        if winner is None:
+            # 兩邊都失敗：其餘供應商依序備援，仍失敗則回報主要供應商的錯誤
+            for provider in order[2:]:
+                try:
+                    return await self._collect(provider, prompt, model, json_schema=json_schema)
+                except Exception:
+                    continue
+            raise runs[primary].task.exception()
+        return await runs[winner].task
+
+    # ---------- 同步介面 ----------
+    def generate(self, prompt: str, model: Optional[str] = None, hedged: bool = False,
+                 json_schema: Optional[Dict[str, Any]] = None) -> str:
+        coro = (self.ahedged(prompt, model, json_schema=json_schema) if hedged
+                else self.agenerate(prompt, model, json_schema))
+        return _run_sync(coro)
+
+    def __call__(self, prompt: str, model: Optional[str] = None, agent_id: Optional[str] = None) -> str:
+        return self.generate(prompt, model, hedged=agent_id in HEDGED_AGENTS)
+
+    def structured(self, prompt: str, schema: Type[Any], model: Optional[str] = None,
+                   agent_id: Optional[str] = None) -> Any:
+        """
+        以 JSON mode 取得符合 schema（pydantic 模型類別）的輸出
+
+        Raises:
+            StructuredOutputError: 回應不是符合 schema 的 JSON（.text 保留原始回應）
+        """
+        json_schema = schema.model_json_schema()
+        text = self.generate(prompt + json_instruction(json_schema), model, hedged=agent_id in HEDGED_AGENTS,
+                             json_schema=json_schema)
+        return parse_structured(schema, text)
+
+
+def parse_structured(schema: Type[Any], text: str) -> Any:
+    """驗證 JSON 回應（容許模型多包一層 ```json 程式碼區塊）"""
+    try:
+        return schema.model_validate_json(_FENCE.sub("", text))
+    except ValueError as e:
+        raise StructuredOutputError(f"{schema.__name__} 驗證失敗：{e}", text) from None
+
+
+@asynccontextmanager
+async def _hold(lock: threading.Lock) -> AsyncIterator[None]:
+    """在 coroutine 中取得跨執行緒的鎖：輪詢而不阻塞 event loop，等待中被取消也不會遺留鎖"""
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(LOCK_POLL_S)
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def _run_sync(coro) -> Any:
+    """在同步程式碼（Streamlit script thread）中執行 coroutine；已有 event loop 時改在新執行緒執行"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    result: Dict[str, Any] = {}
+
+    def runner() -> None:
+        try:
+            result["value"] = asyncio.run(coro)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
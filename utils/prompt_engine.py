@@ -0,0 +1,142 @@
+# utils/prompt_engine.py - 代理提示詞編譯與快取
+# agents5.yaml 只在啟動時解析一次：每個代理的 system_prompt 編譯成
+# 「固定前綴 + 待填入模板」，並先驗證 ${placeholder}。
+# 組出來的提示詞永遠是「固定內容在前、動態資料在後」，
+# 相同代理的重複呼叫前綴位元組完全相同，供應商的 prompt prefix cache 才能命中。
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from string import Template
+from typing import Any, Dict, FrozenSet, List, Optional
+
+import yaml
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "agents5.yaml")
+
+
+class PromptTemplateError(ValueError):
+    """提示詞模板錯誤（placeholder 格式錯誤、缺值或多餘的值）"""
+
+
+@dataclass(frozen=True)
+class AgentPrompt:
+    agent_id: str
+    name: str
+    category: str
+    prefix: str                      # 第一個 placeholder 之前的固定內容
+    template: Optional[Template]     # 其餘需要填值的部分（無 placeholder 時為 None）
+    placeholders: FrozenSet[str]
+    model_preference: str
+    temperature: float
+    max_tokens: int
+
+    @property
+    def prefix_hash(self) -> str:
+        return hashlib.sha256(self.prefix.encode("utf-8")).hexdigest()[:12]
+
+    def render(self, values: Dict[str, Any]) -> str:
+        missing = self.placeholders - values.keys()
+        extra = values.keys() - self.placeholders
+        if missing or extra:
+            raise PromptTemplateError(
+                f"{self.agent_id} 的 placeholder 不符：缺少 {sorted(missing)}，多餘 {sorted(extra)}")
+        return self.prefix + (self.template.substitute(values) if self.template else "")
+
+
+def _compile(agent: Dict[str, Any]) -> AgentPrompt:
+    agent_id = agent.get("id")
+    text = agent.get("system_prompt")
+    if not agent_id or not isinstance(text, str):
+        raise PromptTemplateError(f"代理設定缺少 id 或 system_prompt：{agent.get('name', agent)}")
+    template = Template(text.strip())
+    placeholders, first = set(), None
+    for match in Template.pattern.finditer(template.template):
+        if match.group("invalid") is not None:
+            raise PromptTemplateError(f"{agent_id} 的 system_prompt 在位置 {match.start()} 有無效的 $ 用法（字面 $ 請寫成 $$）")
+        name = match.group("named") or match.group("braced")
+        if name:
+            placeholders.add(name)
+            first = match.start() if first is None else first
+    # placeholder 之前的內容固定不變，直接存成字串；$$ 跳脫在固定前綴中需先還原
+    head = template.template if first is None else template.template[:first]
+    return AgentPrompt(
+        agent_id=agent_id,
+        name=agent.get("name", agent_id),
+        category=agent.get("category", ""),
+        prefix=head.replace("$$", "$"),
+        template=None if first is None else Template(template.template[first:]),
+        placeholders=frozenset(placeholders),
+        model_preference=agent.get("model_preference", "gpt-4o"),
+        temperature=float(agent.get("temperature", 0.2)),
+        max_tokens=int(agent.get("max_tokens", 2000)),
+    )
+
+
+def render_value(value: Any) -> str:
+    """dict / list 以固定格式序列化（鍵排序），相同資料位元組相同"""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def _render_context(context: Dict[str, Any]) -> str:
+    """上下文依呼叫端給定的順序輸出"""
+    return "\n\n".join(f"### {title}\n{render_value(value)}" for title, value in context.items())
+
+
+class PromptEngine:
+    """已編譯的 31 個代理提示詞"""
+
+    def __init__(self, config_path: str = DEFAULT_CONFIG_PATH):
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+        self.config_path = config_path
+        self.agents: Dict[str, AgentPrompt] = {}
+        for agent in config.get("agents", []):
+            compiled = _compile(agent)
+            if compiled.agent_id in self.agents:
+                raise PromptTemplateError(f"代理 id 重複：{compiled.agent_id}")
+            self.agents[compiled.agent_id] = compiled
+        self.output_templates: Dict[str, Any] = config.get("output_formats", {}).get("templates", {})
+
+    def get(self, agent_id: str) -> AgentPrompt:
+        try:
+            return self.agents[agent_id]
+        except KeyError:
+            raise PromptTemplateError(f"未知的代理：{agent_id}") from None
+
+    def build_prompt(self, agent_id: str, user_query: str = "", context_data: Optional[Dict[str, Any]] = None,
+                     few_shot_examples: Optional[List[Dict[str, str]]] = None, **values: Any) -> str:
+        """
+        組出完整提示詞，順序固定為：
+        代理 system_prompt → few-shot 範例 → 數據上下文 → 本次任務
+
+        Args:
+            values: system_prompt 中 ${placeholder} 的值
+        """
+        agent = self.get(agent_id)
+        parts = [agent.render(values)]
+        if few_shot_examples:
+            shots = "\n\n".join(f"輸入：{ex['input']}\n輸出：{ex['output']}" for ex in few_shot_examples)
+            parts.append(f"## 範例\n{shots}")
+        if context_data:
+            parts.append(f"## 數據上下文\n{_render_context(context_data)}")
+        if user_query:
+            parts.append(f"## 任務\n{user_query}")
+        return "\n\n".join(parts)
+
+    def prefix_groups(self) -> Dict[str, List[str]]:
+        """固定前綴相同的代理分組（前綴雜湊 → 代理 id），用來檢查快取共用情況"""
+        groups: Dict[str, List[str]] = {}
+        for agent in self.agents.values():
+            groups.setdefault(agent.prefix_hash, []).append(agent.agent_id)
+        return groups
+
+
+@lru_cache(maxsize=None)
+def get_prompt_engine(config_path: str = DEFAULT_CONFIG_PATH) -> PromptEngine:
+    """整個 process 共用一份已編譯的提示詞（Streamlit 重新執行 script 時不會重新解析）"""
+    return PromptEngine(config_path)
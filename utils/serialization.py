@@ -0,0 +1,26 @@
+# utils/serialization.py - 分析結果的 JSON 化（本地代理輸出、run_all_agents 結果、批次審計的前處理）
+# 結果會寫入 SQLite 快取、manifest 與報告，也會放進提示詞，因此 numpy / pandas 型別要先轉成原生型別，
+# 浮點數統一四捨五入到 4 位、NaN / inf 轉成 None（json.dumps 預設會輸出非標準的 NaN）。
+
+import math
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+
+def to_jsonable(value: Any) -> Any:
+    """把 numpy / pandas 型別轉成可 JSON 序列化的 Python 型別"""
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (np.floating, float)):
+        return None if math.isnan(value) or math.isinf(value) else round(float(value), 4)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value
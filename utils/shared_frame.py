@@ -0,0 +1,187 @@
+# utils/shared_frame.py - 以 multiprocessing.shared_memory 共享 DataFrame
+# 主程序把每個欄位寫入一塊共享記憶體，handle 本身只帶欄位描述（可 pickle、很小），
+# worker attach 後直接以 numpy view 讀取，不論同時跑幾個代理，資料只佔一份記憶體。
+# attach 後的欄位 dtype 與原 DataFrame 完全相同，代理在 process pool 與依序執行時看到的資料一致。
+
+import multiprocessing
+import os
+import pickle
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+# pandas 的 nullable 欄位（Int64 / Float64 / boolean）：值與缺值遮罩分開存放
+_MASKED_ARRAYS = (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)
+
+
+@dataclass
+class _ColumnSpec:
+    name: str
+    kind: str                     # "array"（numpy 數值/日期）、"masked"（nullable）、"category" 或 "dict"（字典編碼）
+    dtype: str                    # 共享記憶體中 values / codes 的 numpy dtype
+    shm_name: str
+    tz: Optional[str] = None      # 有時區的日期欄位
+    ext_dtype: Any = None         # 原欄位的 pandas dtype（array 以外的欄位依此還原）
+    mask_shm_name: Optional[str] = None
+    dict_shm_name: Optional[str] = None
+    dict_nbytes: int = 0          # 字典（pickle 後的唯一值與缺值）的位元組數
+
+
+def default_workers(max_workers: Optional[int] = None) -> int:
+    """
+    平行工作的 process 數：呼叫端指定時照用；未指定時在 process pool 的 worker 內為 1
+    （外層已平行，不再開巢狀 pool 造成 N² 個 process），否則為 CPU 數
+    """
+    if max_workers:
+        return max_workers
+    if multiprocessing.parent_process() is not None:
+        return 1
+    return os.cpu_count() or 1
+
+
+def _create(nbytes: int) -> shared_memory.SharedMemory:
+    return shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # worker 由 multiprocessing 啟動，與建立者共用同一個 resource_tracker，
+    # 重複註冊不會讓 worker 結束時提早 unlink
+    return shared_memory.SharedMemory(name=name)
+
+
+@dataclass
+class SharedFrame:
+    """
+    DataFrame 的共享記憶體 handle
+
+    - 數值、布林、日期欄位：原始 buffer 放進共享記憶體，attach 時零複製
+    - nullable 欄位（Int64 / Float64 / boolean）：values 與缺值遮罩各一塊，attach 時零複製
+    - category 欄位：codes 零複製，類別隨 dtype 傳送
+    - 其他欄位（文字、混合型別等）：字典編碼，attach 時以原 dtype 還原（值與缺值原樣保留）
+    - 索引不保留，attach 後一律是 RangeIndex
+
+    用法：
+        with SharedFrame.from_dataframe(df) as shared:
+            pool.submit(work, shared)          # worker 內 shared.to_dataframe()
+    """
+
+    n_rows: int
+    columns: List[_ColumnSpec]
+    _owner: bool = field(default=False, repr=False)
+    _blocks: Dict[str, shared_memory.SharedMemory] = field(default_factory=dict, repr=False)
+
+    # ---------- 建立（主程序） ----------
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "SharedFrame":
+        frame = cls(n_rows=len(df), columns=[], _owner=True)
+        try:
+            for name in df.columns:
+                frame.columns.append(frame._share_column(str(name), df[name]))
+        except Exception:
+            frame.unlink()
+            raise
+        return frame
+
+    def _put(self, values: np.ndarray) -> str:
+        shm = _create(values.nbytes)
+        np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+        self._blocks[shm.name] = shm
+        return shm.name
+
+    def _share_column(self, name: str, series: pd.Series) -> _ColumnSpec:
+        dtype = series.dtype
+        if isinstance(dtype, pd.DatetimeTZDtype):
+            values = series.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy()
+            return _ColumnSpec(name, "array", str(values.dtype), self._put(values), tz=str(dtype.tz))
+        if isinstance(dtype, np.dtype) and dtype.kind in "biufcmM":
+            values = np.ascontiguousarray(series.to_numpy())
+            return _ColumnSpec(name, "array", str(values.dtype), self._put(values))
+        if isinstance(series.array, _MASKED_ARRAYS):
+            values = series.to_numpy(dtype=dtype.numpy_dtype, na_value=dtype.numpy_dtype.type(0))
+            return _ColumnSpec(name, "masked", str(values.dtype), self._put(values), ext_dtype=dtype,
+                               mask_shm_name=self._put(series.isna().to_numpy()))
+        if isinstance(dtype, pd.CategoricalDtype):
+            codes = np.ascontiguousarray(series.cat.codes.to_numpy())
+            return _ColumnSpec(name, "category", str(codes.dtype), self._put(codes), ext_dtype=dtype)
+
+        try:
+            codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        except TypeError:
+            # 巢狀 JSON 讀入的 dict / list 不可雜湊：不做字典編碼，每列各自一個值
+            uniques = series.to_numpy(dtype=object)
+            codes = np.where(series.isna().to_numpy(), -1, np.arange(len(series)))
+        codes = codes.astype(np.int32)
+        missing = series[codes < 0]
+        payload = np.frombuffer(pickle.dumps((np.asarray(uniques, dtype=object),
+                                              missing.iloc[0] if len(missing) else None)), dtype=np.uint8)
+        return _ColumnSpec(name, "dict", str(codes.dtype), self._put(codes), ext_dtype=dtype,
+                           dict_shm_name=self._put(payload), dict_nbytes=len(payload))
+
+    # ---------- attach（worker） ----------
+    def _block(self, shm_name: str) -> shared_memory.SharedMemory:
+        if shm_name not in self._blocks:
+            self._blocks[shm_name] = _attach(shm_name)
+        return self._blocks[shm_name]
+
+    def _read_column(self, spec: _ColumnSpec):
+        values = np.ndarray((self.n_rows,), dtype=spec.dtype, buffer=self._block(spec.shm_name).buf)
+        if spec.kind == "array":
+            if spec.tz:
+                return pd.DatetimeIndex(values).tz_localize("UTC").tz_convert(spec.tz)
+            return values
+        if spec.kind == "masked":
+            mask = np.ndarray((self.n_rows,), dtype=bool, buffer=self._block(spec.mask_shm_name).buf)
+            return spec.ext_dtype.construct_array_type()(values, mask)
+        if spec.kind == "category":
+            return pd.Categorical.from_codes(values, dtype=spec.ext_dtype)
+        uniques, na_value = pickle.loads(bytes(self._block(spec.dict_shm_name).buf[:spec.dict_nbytes]))
+        decoded = uniques.take(np.maximum(values, 0)) if len(uniques) else np.empty(self.n_rows, dtype=object)
+        decoded[values < 0] = na_value
+        if isinstance(spec.ext_dtype, np.dtype):
+            return decoded
+        return pd.array(decoded, dtype=spec.ext_dtype)
+
+    def to_dataframe(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """建立指向共享記憶體的 DataFrame（只解碼需要的欄位）"""
+        wanted = [c for c in self.columns if columns is None or c.name in columns]
+        data = {spec.name: self._read_column(spec) for spec in wanted}
+        return pd.DataFrame(data, index=pd.RangeIndex(self.n_rows), copy=False)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(shm.size for shm in self._blocks.values())
+
+    # ---------- 釋放 ----------
+    def close(self) -> None:
+        """關閉本程序的對應；DataFrame view 仍在使用時請勿呼叫"""
+        for shm in self._blocks.values():
+            try:
+                shm.close()
+            except BufferError:
+                pass
+        self._blocks.clear()
+
+    def unlink(self) -> None:
+        """由建立者呼叫，釋放共享記憶體"""
+        blocks = list(self._blocks.values())
+        self.close()
+        if self._owner:
+            for shm in blocks:
+                shm.unlink()
+
+    def __enter__(self) -> "SharedFrame":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.unlink()
+
+    def __getstate__(self):
+        # 只傳送欄位描述；共享記憶體由接收端自行 attach
+        return {"n_rows": self.n_rows, "columns": self.columns, "_owner": False, "_blocks": {}}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
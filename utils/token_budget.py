@@ -0,0 +1,229 @@
+# utils/token_budget.py - 送出前的 token 計數、成本與延遲估算
+# OpenAI 模型有 tiktoken 時精確計數；其他供應商（或未安裝 tiktoken）用 CJK 感知的快速估算。
+# 超過模型上下文視窗的提示詞會自動壓縮數據上下文（保留開頭、標註省略），仍放不下就拒絕送出。
+# dict / list 上下文依結構壓縮（保留前面的項目），壓縮後仍是完整的 JSON，不會從單行 JSON 中間截斷。
+
+import re
+from bisect import bisect_right
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from itertools import accumulate
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 各模型規格：上下文視窗、最大輸出、每百萬 token 價格（USD，公開牌價，可依合約調整）、
+# 首 token 延遲與輸出速度（tokens/s）的經驗值
+MODEL_SPECS: Dict[str, Dict[str, Any]] = {
+    "gpt-4o":                 {"family": "openai", "context": 128_000, "max_output": 16_384,
+                               "input_per_1m": 2.50, "output_per_1m": 10.00, "ttft_s": 0.6, "tps": 80},
+    "gpt-4-turbo-2024-04-09": {"family": "openai", "context": 128_000, "max_output": 4_096,
+                               "input_per_1m": 10.00, "output_per_1m": 30.00, "ttft_s": 0.8, "tps": 35},
+    "gpt-4":                  {"family": "openai", "context": 8_192, "max_output": 8_192,
+                               "input_per_1m": 30.00, "output_per_1m": 60.00, "ttft_s": 0.8, "tps": 25},
+    "gpt-3.5-turbo":          {"family": "openai", "context": 16_385, "max_output": 4_096,
+                               "input_per_1m": 0.50, "output_per_1m": 1.50, "ttft_s": 0.4, "tps": 100},
+    "gemini-1.5-pro":         {"family": "gemini", "context": 2_000_000, "max_output": 8_192,
+                               "input_per_1m": 1.25, "output_per_1m": 5.00, "ttft_s": 1.0, "tps": 60},
+    "gemini-1.5-flash":       {"family": "gemini", "context": 1_000_000, "max_output": 8_192,
+                               "input_per_1m": 0.075, "output_per_1m": 0.30, "ttft_s": 0.5, "tps": 150},
+    "gemini-pro":             {"family": "gemini", "context": 32_760, "max_output": 8_192,
+                               "input_per_1m": 0.50, "output_per_1m": 1.50, "ttft_s": 0.8, "tps": 60},
+    "llama3-70b-8192":        {"family": "llama", "context": 8_192, "max_output": 8_192,
+                               "input_per_1m": 0.59, "output_per_1m": 0.79, "ttft_s": 0.3, "tps": 300},
+    "llama3-8b-8192":         {"family": "llama", "context": 8_192, "max_output": 8_192,
+                               "input_per_1m": 0.05, "output_per_1m": 0.08, "ttft_s": 0.2, "tps": 800},
+    "grok-beta":              {"family": "xai", "context": 131_072, "max_output": 8_192,
+                               "input_per_1m": 5.00, "output_per_1m": 15.00, "ttft_s": 0.8, "tps": 60},
+    "grok-2":                 {"family": "xai", "context": 131_072, "max_output": 8_192,
+                               "input_per_1m": 2.00, "output_per_1m": 10.00, "ttft_s": 0.8, "tps": 60},
+}
+DEFAULT_SPEC = MODEL_SPECS["gpt-4o"]
+
+# 估算法的供應商校正係數（相對於 o200k/cl100k 類 BPE 的 token 數）
+FAMILY_FACTOR = {"openai": 1.0, "llama": 1.05, "gemini": 0.95, "xai": 1.0}
+SAFETY_MARGIN = 0.05          # 估算值預留 5% 誤差
+OMITTED_MARK = "…（以下省略 {n} 行，共 {total} 行）"
+OMITTED_ITEMS = "…（以下省略 {n} 項，共 {total} 項）"
+OMITTED_KEY = "…"              # dict 省略標記的鍵
+
+_CJK = re.compile(r"[぀-ヿ㐀-鿿豈-﫿＀-￯]")
+_PIECES = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d぀-ヿ㐀-鿿豈-﫿＀-￯]")
+
+
+class PromptTooLargeError(ValueError):
+    """提示詞壓縮後仍超過模型上下文視窗"""
+
+
+@dataclass
+class PromptEstimate:
+    model: str
+    prompt_tokens: int
+    max_output_tokens: int
+    context_window: int
+    fits: bool
+    cost_usd: float
+    latency_s: float
+    exact: bool                # True 表示使用 tiktoken 精確計數
+    compacted: bool = False
+    agent_id: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def model_spec(model: str) -> Dict[str, Any]:
+    return MODEL_SPECS.get(model, DEFAULT_SPEC)
+
+
+@lru_cache(maxsize=None)
+def _tiktoken_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def estimate_tokens(text: str, family: str = "openai") -> int:
+    """快速估算：中日文每字約 1 token，英文單字、3 位數字與標點各約 1 token"""
+    cjk = len(_CJK.findall(text))
+    pieces = len(_PIECES.findall(text))
+    return int((cjk + pieces) * FAMILY_FACTOR.get(family, 1.0) * (1 + SAFETY_MARGIN)) + 1
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    spec = model_spec(model)
+    encoding = _tiktoken_encoding(model) if spec["family"] == "openai" else None
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text, spec["family"])
+
+
+def estimate(prompt: str, model: str = "gpt-4o", max_output_tokens: Optional[int] = None,
+             system_prompt: str = "", agent_id: Optional[str] = None) -> PromptEstimate:
+    """送出前估算 token、成本（USD）與延遲（秒，首 token + 輸出時間，輸出以上限計）"""
+    spec = model_spec(model)
+    output = min(max_output_tokens or spec["max_output"], spec["max_output"])
+    tokens = count_tokens(system_prompt + prompt, model)
+    cost = (tokens * spec["input_per_1m"] + output * spec["output_per_1m"]) / 1_000_000
+    return PromptEstimate(
+        model=model, prompt_tokens=tokens, max_output_tokens=output, context_window=spec["context"],
+        fits=tokens + output <= spec["context"], cost_usd=round(cost, 5),
+        latency_s=round(spec["ttft_s"] + output / spec["tps"], 1),
+        exact=spec["family"] == "openai" and _tiktoken_encoding(model) is not None, agent_id=agent_id,
+    )
+
+
+# ==================== 壓縮 ====================
+def compact_text(text: str, max_tokens: int, model: str = "gpt-4o") -> str:
+    """保留開頭的行（表頭與前幾列），在結尾註明省略多少行"""
+    tokens = count_tokens(text, model)
+    if tokens <= max_tokens:
+        return text
+    lines = text.splitlines()
+    ends = list(accumulate(len(line) + 1 for line in lines))
+    budget = max_tokens
+    while budget > 0:
+        # 依全文的平均字元/token 比例決定保留多少字元，再對齊到行尾
+        keep_chars = int(len(text) * budget / tokens)
+        if len(lines) <= 1:
+            candidate = text[:keep_chars] + "…（已截斷）"
+        else:
+            keep = bisect_right(ends, keep_chars)
+            candidate = "\n".join(lines[:keep] + [OMITTED_MARK.format(n=len(lines) - keep, total=len(lines))])
+        if count_tokens(candidate, model) <= max_tokens:
+            return candidate
+        budget = int(budget * 0.9)
+    return OMITTED_MARK.format(n=len(lines), total=len(lines))
+
+
+def _truncate(value: Any, keys: List[Any], keep: int) -> Any:
+    """保留前 keep 個項目，其餘以一個省略標記代替"""
+    omitted = len(keys) - keep
+    mark = OMITTED_ITEMS.format(n=omitted, total=len(keys))
+    if isinstance(value, dict):
+        kept = {k: value[k] for k in keys[:keep]}
+        if omitted:
+            kept[OMITTED_KEY] = mark
+        return kept
+    return list(value[:keep]) + ([mark] if omitted else [])
+
+
+def compact_value(value: Any, max_tokens: int, model: str = "gpt-4o", render: Callable[[Any], str] = str) -> Any:
+    """
+    依結構壓縮上下文值：單一子項佔大半時先壓縮該子項，仍放不下再只保留前面的項目並註明省略數量
+
+    回傳的 dict / list 以 render 序列化後仍是完整結構；字串與其他值（序列化後）以 compact_text 依行壓縮。
+    """
+    if isinstance(value, str):
+        return compact_text(value, max_tokens, model)
+    text = render(value)
+    tokens = count_tokens(text, model)
+    if tokens <= max_tokens or (isinstance(value, (dict, list, tuple)) and not value):
+        return value
+    if not isinstance(value, (dict, list, tuple)):
+        return compact_text(text, max_tokens, model)
+    keys = list(value) if isinstance(value, dict) else list(range(len(value)))
+    sizes = [count_tokens(render(value[k]), model) for k in keys]
+    largest = max(range(len(keys)), key=sizes.__getitem__)
+    if sizes[largest] * 2 > tokens:
+        shrunk = compact_value(value[keys[largest]], max(sizes[largest] - (tokens - max_tokens), 1), model, render)
+        value = dict(value) if isinstance(value, dict) else list(value)
+        value[keys[largest]] = shrunk
+        if count_tokens(render(value), model) <= max_tokens:
+            return value
+    # 二分搜尋可保留的項目數
+    low, high = 0, len(keys)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(render(_truncate(value, keys, mid)), model) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return _truncate(value, keys, low)
+
+
+def fit_prompt(build: Callable[[Dict[str, Any]], str], context: Dict[str, Any], model: str = "gpt-4o",
+               max_output_tokens: Optional[int] = None, system_prompt: str = "",
+               agent_id: Optional[str] = None, auto_compact: bool = True,
+               render: Callable[[Any], str] = str) -> Tuple[str, PromptEstimate]:
+    """
+    組出符合上下文視窗的提示詞
+
+    Args:
+        build: 以 context 組出完整提示詞的函式（例：lambda c: engine.build_prompt(agent_id, query, c)）
+        context: 有序的數據上下文區段，放不下時由最大的區段開始壓縮
+        render: 把區段值轉成文字的函式（與 build 內的序列化一致）
+
+    Raises:
+        PromptTooLargeError: 無法壓縮到視窗內，或 auto_compact=False 且超出視窗
+    """
+    prompt = build(context)
+    est = estimate(prompt, model, max_output_tokens, system_prompt, agent_id)
+    if est.fits:
+        return prompt, est
+    if not auto_compact:
+        raise PromptTooLargeError(
+            f"{agent_id or '提示詞'} 約 {est.prompt_tokens:,} tokens，超過 {model} 上下文視窗 {est.context_window:,}")
+
+    sections = {k: v if isinstance(v, str) else render(v) for k, v in context.items()}
+    sizes = {k: count_tokens(v, model) for k, v in sections.items()}
+    overflow = est.prompt_tokens + est.max_output_tokens - est.context_window
+    while overflow > 0 and sizes:
+        largest = max(sizes, key=sizes.get)
+        if sizes[largest] <= 50:
+            break
+        # 每個區段只壓縮一次（省略行數才正確），不夠再換下一個最大的區段
+        compacted = compact_value(context[largest], max(sizes[largest] - overflow, 50), model, render)
+        sections[largest] = compacted if isinstance(compacted, str) else render(compacted)
+        overflow -= sizes.pop(largest) - count_tokens(sections[largest], model)
+
+    prompt = build(sections)
+    est = estimate(prompt, model, max_output_tokens, system_prompt, agent_id)
+    est.compacted = True
+    if not est.fits:
+        raise PromptTooLargeError(
+            f"{agent_id or '提示詞'} 壓縮後仍約 {est.prompt_tokens:,} tokens，超過 {model} 上下文視窗 {est.context_window:,}")
+    return prompt, est